@@ -0,0 +1,69 @@
+"""
+Shared setup for the benchmarks.
+
+The benchmarks import the coda apps, so Django is set up from
+DJANGO_SETTINGS_MODULE (config.settings by default), with the coda
+directory on the path the way manage.py puts it there.
+"""
+import contextlib
+import os
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_django():
+    sys.path.insert(0, os.path.join(ROOT, 'coda'))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    import django
+    django.setup()
+
+
+def _free_port():
+    with contextlib.closing(socket.socket()) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def node_server(directory):
+    """
+    Serve a directory over HTTP from a separate process, standing in for a
+    storage node, and yield its url
+    """
+
+    port = _free_port()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'http.server', str(port), '--bind', '127.0.0.1',
+         '--directory', directory],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        for _ in range(100):
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                time.sleep(0.05)
+        yield 'http://127.0.0.1:%d' % port
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def measure(func, repeat=3):
+    """
+    Run func repeat times and return the best wall-clock and CPU seconds,
+    along with its last result
+    """
+
+    best_wall = best_cpu = float('inf')
+    for _ in range(repeat):
+        wall, cpu = time.perf_counter(), time.process_time()
+        result = func()
+        best_wall = min(best_wall, time.perf_counter() - wall)
+        best_cpu = min(best_cpu, time.process_time() - cpu)
+    return best_wall, best_cpu, result
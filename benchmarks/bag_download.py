@@ -0,0 +1,80 @@
+"""
+Compare the ways a whole bag can be downloaded.
+
+A temporary bag is served by a local HTTP server standing in for a storage
+node. It is streamed as a zip the way bagDownload did before downloads
+read large, growing chunks (1 KiB chunks from iter_content), as a zip with
+the current chunking, and as a tar. The CPU time spent in this process
+and the throughput of each are reported.
+
+    python benchmarks/bag_download.py [--files N] [--size BYTES]
+"""
+import argparse
+import os
+import tempfile
+from unittest import mock
+
+from _common import measure, node_server, setup_django
+
+
+def legacy_chunks(url, localNodes=()):
+    """
+    file_chunk_generator as it was, yielding 1 KiB chunks
+    """
+    from coda_mdstore import presentation
+
+    r = presentation.nodeSessions.get(url, stream=True)
+    try:
+        for chunk in r.iter_content(1024):
+            yield chunk
+    finally:
+        r.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--files', type=int, default=50)
+    parser.add_argument('--size', type=int, default=4 * 1024 * 1024)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    setup_django()
+    from coda_mdstore import presentation, tarstream
+
+    with tempfile.TemporaryDirectory() as root:
+        bag = os.path.join(root, 'coda1', 'data')
+        os.makedirs(bag)
+        names = ['file%04d.bin' % i for i in range(args.files)]
+        for name in names:
+            with open(os.path.join(bag, name), 'wb') as f:
+                f.write(os.urandom(args.size))
+
+        with node_server(root) as node_url:
+            urls = ['%s/coda1/data/%s' % (node_url, name) for name in names]
+            members = [
+                ('coda1/data/%s' % name, url, args.size) for name, url in zip(names, urls)
+            ]
+
+            def zip_bytes():
+                return sum(len(c) for c in presentation.zip_file_streamer(urls, 'coda1'))
+
+            def tar_bytes():
+                return sum(len(c) for c in tarstream.TarStream(members))
+
+            def legacy_zip_bytes():
+                with mock.patch.object(presentation, 'file_chunk_generator', legacy_chunks):
+                    return zip_bytes()
+
+            print('%d files of %d bytes' % (args.files, args.size))
+            print('%-24s %10s %10s %10s' % ('', 'wall (s)', 'cpu (s)', 'MB/s'))
+            for label, func in [
+                ('zip, 1 KiB chunks', legacy_zip_bytes),
+                ('zip, adaptive chunks', zip_bytes),
+                ('tar, adaptive chunks', tar_bytes),
+            ]:
+                wall, cpu, size = measure(func, args.repeat)
+                print('%-24s %10.2f %10.2f %10.1f' % (label, wall, cpu, size / wall / 1e6))
+
+
+if __name__ == '__main__':
+    main()
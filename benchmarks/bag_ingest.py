@@ -0,0 +1,140 @@
+"""
+Compare the ways a bag's metadata can be written when it is ingested.
+
+Atom entries for bags with a growing number of bag-info fields, a few of
+them External-Identifiers, are ingested into a throwaway test database
+the way createBag did before it wrote in bulk, saving and deleting one
+row at a time, with createBag as it is now, and all together as one feed
+through ingestBagFeed, as the /APP/bag/batch/ endpoint does. Each bag is
+ingested more than once, so its old rows are replaced as they would be
+when a bag is sent again. The database round trips and the wall-clock
+time per bag are reported.
+
+    python benchmarks/bag_ingest.py [--fields N [N ...]] [--bags N]
+"""
+import argparse
+import io
+
+from _common import measure, setup_django
+
+ENTRY = """<?xml version="1.0"?>
+<entry xmlns="http://www.w3.org/2005/Atom">
+<title>%(name)s</title>
+<id>%(name)s</id>
+<updated>2013-06-05T17:05:33Z</updated>
+<content type="application/xml">
+<bag:codaXML xmlns:bag="http://digital2.library.unt.edu/coda/bagxml/">
+<bag:name>%(name)s</bag:name>
+<bag:fileCount>43</bag:fileCount>
+<bag:payloadSize>46259062</bag:payloadSize>
+<bag:bagitVersion>0.96</bag:bagitVersion>
+<bag:lastVerified>2015-01-01</bag:lastVerified>
+<bag:baggingDate>2015-01-01</bag:baggingDate>
+<bag:bagInfo>%(items)s</bag:bagInfo>
+</bag:codaXML>
+</content>
+</entry>
+"""
+
+ITEM = "<bag:item><bag:name>%s</bag:name><bag:body>%s</bag:body></bag:item>"
+
+
+def entry(name, fields):
+    """
+    Return an Atom entry for a bag with the given number of bag-info
+    fields, one in five of them an External-Identifier
+    """
+
+    items = ''.join(
+        ITEM % (
+            'External-Identifier' if i % 5 == 0 else 'Internal-Sender-Description',
+            'ark:/67531/metapth%d' % i,
+        )
+        for i in range(fields)
+    )
+    return (ENTRY % {'name': name, 'items': items}).encode()
+
+
+def feed(entries):
+    """
+    Return an Atom feed of the given entries, as a file
+    """
+
+    body = b''.join(xmlText.split(b'?>', 1)[1] for xmlText in entries)
+    return io.BytesIO(b'<feed xmlns="http://www.w3.org/2005/Atom">%s</feed>' % body)
+
+
+def legacy_create(xmlText):
+    """
+    createBag as it was, writing each row on its own
+    """
+    from lxml import etree
+    from coda_mdstore.models import Bag_Info, External_Identifier
+    from coda_mdstore.presentation import xmlToBagObject
+
+    entryRoot = etree.XML(xmlText)
+    contentElement = entryRoot.xpath("*[local-name() = 'content']")[0]
+    codaXML = contentElement.xpath("*[local-name() = 'codaXML']")[0]
+    codaName = codaXML.xpath("*[local-name() = 'name']")[0].text.strip()
+    for oldBagInfoObject in Bag_Info.objects.filter(bag_name=codaName):
+        oldBagInfoObject.delete()
+    bagObject, bagInfoObjectList, errorCode = xmlToBagObject(codaXML)
+    bagObject.save()
+    # xmlToBagObject used to save these as it parsed them, before the bag
+    # was saved; they are saved after it here so foreign keys are met.
+    for bagInfoObject in bagInfoObjectList:
+        if bagInfoObject.field_name == 'External-Identifier':
+            External_Identifier(
+                value=bagInfoObject.field_body, belong_to_bag=bagObject
+            ).save()
+    for bagInfoObject in bagInfoObjectList:
+        bagInfoObject.save()
+    return bagObject, bagInfoObjectList
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--fields', type=int, nargs='+', default=[5, 30, 100])
+    parser.add_argument('--bags', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.db import connection
+    from coda_mdstore import presentation
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        print('%-8s %-10s %14s %14s' % ('fields', '', 'queries/bag', 'ms/bag'))
+        for fields in args.fields:
+            entries = [
+                entry('ark:/67531/bench%d' % i, fields) for i in range(args.bags)
+            ]
+            for label, create in [
+                ('before', legacy_create),
+                ('after', presentation.createBag),
+                ('batch', None),
+            ]:
+                def ingest():
+                    queries = []
+
+                    def count(execute, sql, params, many, context):
+                        queries.append(sql)
+                        return execute(sql, params, many, context)
+                    with connection.execute_wrapper(count):
+                        if create is None:
+                            presentation.ingestBagFeed(feed(entries))
+                        else:
+                            for xmlText in entries:
+                                create(xmlText)
+                    return len(queries)
+                wall, cpu, count = measure(ingest, args.repeat)
+                print('%-8d %-10s %14.1f %14.2f' % (
+                    fields, label, count / args.bags, wall * 1000 / args.bags))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
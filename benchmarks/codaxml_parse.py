@@ -0,0 +1,166 @@
+"""
+Compare the ways the fields of codaXML, node and validate entries are read.
+
+Atom entries like those sent to the APP views, a bag with a growing
+number of bag-info items, a node and a validate record, are read the way
+the views did with an XPath expression for each field, and with
+coda_mdstore.codaxml as they do now, which goes through each element's
+children once. Both read the same values from an entry that is already
+parsed, so the times are of finding the fields alone. The microseconds
+per entry are reported.
+
+    python benchmarks/codaxml_parse.py [--items N [N ...]] [--entries N]
+"""
+import argparse
+
+from _common import measure, setup_django
+
+BAG = """<?xml version="1.0"?>
+<entry xmlns="http://www.w3.org/2005/Atom">
+<title>ark:/67531/coda2</title>
+<id>ark:/67531/coda2</id>
+<updated>2013-06-05T17:05:33Z</updated>
+<author><name>server</name></author>
+<content type="application/xml">
+<bag:codaXML xmlns:bag="http://digital2.library.unt.edu/coda/bagxml/">
+<bag:name>ark:/67531/coda2</bag:name>
+<bag:fileCount>43</bag:fileCount>
+<bag:payloadSize>46259062</bag:payloadSize>
+<bag:bagitVersion>0.96</bag:bagitVersion>
+<bag:lastStatus>pass</bag:lastStatus>
+<bag:lastVerified>2015-01-01</bag:lastVerified>
+<bag:baggingDate>2015-01-01</bag:baggingDate>
+<bag:bagInfo>%s</bag:bagInfo>
+</bag:codaXML>
+</content>
+</entry>
+"""
+
+ITEM = "<bag:item><bag:name>%s</bag:name><bag:body>%s</bag:body></bag:item>"
+
+NODE = b"""<?xml version="1.0"?>
+<entry xmlns="http://www.w3.org/2005/Atom">
+<title>coda-001</title>
+<id>http://example.com/APP/node/coda-001/</id>
+<updated>2015-08-17T17:13:07Z</updated>
+<content type="application/xml">
+<node:node xmlns:node="http://digital2.library.unt.edu/coda/nodexml/">
+<node:name>coda-001</node:name>
+<node:status>active</node:status>
+<node:capacity>100000000000</node:capacity>
+<node:size>48000000000</node:size>
+<node:path>/coda-001/store</node:path>
+<node:url>http://example.com/coda-001/store</node:url>
+<node:last_checked>2015-08-17</node:last_checked>
+</node:node>
+</content>
+</entry>
+"""
+
+VALIDATE = b"""<?xml version="1.0"?>
+<entry xmlns="http://www.w3.org/2005/Atom">
+<title>ark:/00001/codajom1</title>
+<id>http://example.com/APP/validate/ark:/00001/codajom1/</id>
+<updated>2015-08-17T17:13:07Z</updated>
+<content type="application/xml">
+<v:validate xmlns:v="http://digital2.library.unt.edu/coda/validatexml/">
+<v:identifier>ark:/00001/codajom1</v:identifier>
+<v:last_verified>2015-01-01T12:11:43</v:last_verified>
+<v:last_verified_status>Passed</v:last_verified_status>
+<v:priority_change_date>2000-01-01T00:00:00</v:priority_change_date>
+<v:priority>1</v:priority>
+<v:server>arch01.example.com</v:server>
+</v:validate>
+</content>
+</entry>
+"""
+
+BAG_FIELDS = [
+    'name', 'fileCount', 'payloadSize', 'bagitVersion', 'lastVerified',
+    'lastStatus', 'baggingDate',
+]
+NODE_FIELDS = ['name', 'capacity', 'size', 'path', 'url']
+VALIDATE_FIELDS = [
+    'identifier', 'last_verified', 'last_verified_status',
+    'priority_change_date', 'priority', 'server',
+]
+
+
+def bag(items):
+    """
+    Return an Atom entry for a bag with the given number of bag-info items
+    """
+
+    return (BAG % ''.join(
+        ITEM % ('Internal-Sender-Description', 'Item %d' % i) for i in range(items)
+    )).encode()
+
+
+def legacy_fields(entry, name, fieldNames):
+    """
+    Read the fields of the named document in an entry as the views did,
+    along with the bag-info items of a codaXML document
+    """
+
+    contentElement = entry.xpath("*[local-name() = 'content']")[0]
+    document = contentElement.xpath("*[local-name() = '%s']" % name)[0]
+    values = [
+        document.xpath("*[local-name() = '%s']" % field)[0].text.strip()
+        for field in fieldNames
+    ]
+    if name == 'codaXML':
+        bagInfo = document.xpath("*[local-name() = 'bagInfo']")[0]
+        for item in bagInfo.xpath("*[local-name() = 'item']"):
+            values.append((
+                item.xpath("*[local-name() = 'name']")[0].text.strip(),
+                item.xpath("*[local-name() = 'body']")[0].text.strip(),
+            ))
+    return values
+
+
+def codaxml_fields(entry, name, fieldNames):
+    """
+    Read the same values with coda_mdstore.codaxml
+    """
+
+    from coda_mdstore import codaxml
+
+    fields = codaxml.children(codaxml.content(entry, name))
+    values = [codaxml.text(fields, field) for field in fieldNames]
+    if name == 'codaXML':
+        values.extend(codaxml.items(fields['bagInfo']))
+    return values
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--items', type=int, nargs='+', default=[5, 30, 100])
+    parser.add_argument('--entries', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    setup_django()
+    from lxml import etree
+
+    documents = [
+        ('bag, %d items' % items, bag(items), 'codaXML', BAG_FIELDS)
+        for items in args.items
+    ] + [
+        ('node', NODE, 'node', NODE_FIELDS),
+        ('validate', VALIDATE, 'validate', VALIDATE_FIELDS),
+    ]
+    print('%-16s %-8s %14s' % ('entry', '', 'us/entry'))
+    for label, xmlText, name, fieldNames in documents:
+        entry = etree.fromstring(xmlText)
+        expected = legacy_fields(entry, name, fieldNames)
+        assert codaxml_fields(entry, name, fieldNames) == expected
+        for method, read in [('before', legacy_fields), ('after', codaxml_fields)]:
+            def parse():
+                for _ in range(args.entries):
+                    read(entry, name, fieldNames)
+            wall, cpu, result = measure(parse, args.repeat)
+            print('%-16s %-8s %14.1f' % (label, method, cpu * 1e6 / args.entries))
+
+
+if __name__ == '__main__':
+    main()
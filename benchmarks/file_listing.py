@@ -0,0 +1,91 @@
+"""
+Compare the ways a node's directory listing can be read.
+
+Synthetic Apache-style autoindex pages with many files are parsed the way
+getFileList did with BeautifulSoup, building the whole tree, and with the
+streaming lxml link extractor it uses now. The CPU time of each and the
+links per second are reported. The BeautifulSoup version needs bs4
+installed, which coda itself no longer requires.
+
+    python benchmarks/file_listing.py [--files N [N ...]]
+"""
+import argparse
+import io
+
+from _common import measure, setup_django
+
+ROW = (
+    '<tr><td valign="top"><img src="/icons/text.gif" alt="[TXT]"></td>'
+    '<td><a href="file%(i)07d.txt">file%(i)07d.txt</a></td>'
+    '<td align="right">2019-10-22 09:35  </td>'
+    '<td align="right">%(i)5dK</td><td>&nbsp;</td></tr>\n'
+)
+
+
+def listing(files):
+    """
+    Return an autoindex page listing a directory and the given number of
+    files
+    """
+
+    rows = ''.join(ROW % {'i': i} for i in range(files))
+    return (
+        '<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 3.2 Final//EN">\n'
+        '<html><head><title>Index of /coda1</title></head><body>'
+        '<h1>Index of /coda1</h1><table>'
+        '<tr><th><a href="?C=N;O=D">Name</a></th><th>Last modified</th></tr>'
+        '<tr><td><a href="/">Parent Directory</a></td></tr>'
+        '<tr><td><a href="data/">data/</a></td></tr>\n'
+        '%s</table></body></html>' % rows
+    ).encode()
+
+
+def soup_links(page):
+    """
+    getFileList as it was, with BeautifulSoup
+    """
+    from bs4 import BeautifulSoup
+
+    fileList = []
+    soup = BeautifulSoup(io.BytesIO(page), 'lxml')
+    for tr in soup.find_all('tr'):
+        for td in tr.find_all('td'):
+            for anchor in td.find_all('a'):
+                if anchor['href'][-1] == "/":
+                    continue
+                fileList.append(anchor['href'])
+    return fileList
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--files', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    setup_django()
+    from coda_mdstore import presentation
+
+    try:
+        import bs4  # noqa: F401
+    except ImportError:
+        bs4 = None
+        print('bs4 is not installed, so only the lxml extractor is measured')
+
+    print('%-10s %-22s %10s %10s %14s' % ('files', '', 'wall (s)', 'cpu (s)', 'links/s'))
+    for files in args.files:
+        page = listing(files)
+        parsers = [('streaming lxml', lambda: list(presentation.iterFileLinks(io.BytesIO(page))))]
+        if bs4 is not None:
+            parsers.insert(0, ('BeautifulSoup', lambda: soup_links(page)))
+        found = []
+        for label, func in parsers:
+            wall, cpu, links = measure(func, args.repeat)
+            found.append(links)
+            print('%-10d %-22s %10.3f %10.3f %14.0f' % (
+                files, label, wall, cpu, len(links) / wall))
+        assert all(links == found[0] for links in found)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
-from coda_mdstore.models import Bag, Bag_Info, Node, External_Identifier
+from coda_mdstore.models import Bag, Bag_Info, Node, External_Identifier, \
+    Bag_Location, Bag_File, Bag_Replica
 from django.contrib import admin
 
 
@@ -18,14 +19,37 @@ class BagAdmin(admin.ModelAdmin):
 
 
 class NodeAdmin(admin.ModelAdmin):
-    list_display = ("node_url", "node_path", "node_capacity", "node_size", "status")
+    list_display = (
+        "node_url", "node_path", "node_capacity", "node_size", "status", "access_mode"
+    )
 
 
 class External_IdentifierAdmin(admin.ModelAdmin):
     list_display = ("value", "belong_to_bag")
 
 
+class Bag_LocationAdmin(admin.ModelAdmin):
+    list_display = ("bag_name", "node", "last_served")
+    search_fields = ["bag_name"]
+
+
+class Bag_FileAdmin(admin.ModelAdmin):
+    list_display = ("bag_name", "path", "md5", "size")
+    search_fields = ["bag_name__name", "md5"]
+    raw_id_fields = ["bag_name"]
+
+
+class Bag_ReplicaAdmin(admin.ModelAdmin):
+    list_display = ("bag_name", "node", "status", "verified")
+    list_filter = ["node", "status"]
+    search_fields = ["bag_name__name"]
+    raw_id_fields = ["bag_name"]
+
+
 admin.site.register(Bag, BagAdmin)
 admin.site.register(Bag_Info, BagInfoAdmin)
 admin.site.register(Node, NodeAdmin)
 admin.site.register(External_Identifier, External_IdentifierAdmin)
+admin.site.register(Bag_Location, Bag_LocationAdmin)
+admin.site.register(Bag_File, Bag_FileAdmin)
+admin.site.register(Bag_Replica, Bag_ReplicaAdmin)
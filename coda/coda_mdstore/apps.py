@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+
+
+class CodaMdstoreConfig(AppConfig):
+    name = 'coda_mdstore'
+
+    def ready(self):
+        # connect the signal handlers that keep the bag location cache
+        # in step with the nodes, and record replicas as replication
+        # completes.
+        from . import locations, replicas  # noqa
@@ -0,0 +1,71 @@
+"""
+Reading the codaXML, node and validate documents sent to the APP views.
+
+The fields of these documents are the children of a single element,
+matched by local name whatever namespace they are in. Rather than look
+for each of them with an XPath expression of its own, which lxml compiles
+and evaluates over all of the children every time, the children are gone
+through once with children() and the fields read from the dict it
+returns. The one XPath expression left, for the document in an Atom
+entry's content, is compiled once here.
+"""
+from lxml import etree
+
+_content = etree.XPath("*[local-name() = 'content']/*[local-name() = $name]")
+
+
+def content(entry, name):
+    """
+    Return the element with the given local name in the content of an Atom
+    entry. Raises IndexError if there is none.
+    """
+
+    return _content(entry, name=name)[0]
+
+
+def localName(element):
+    """
+    Return an element's tag without its namespace
+    """
+
+    return element.tag.rpartition('}')[2]
+
+
+def children(element):
+    """
+    Return the child elements of an element in a dict by local name,
+    keeping the first of any that share one
+    """
+
+    fields = {}
+    for child in element.iterchildren(tag=etree.Element):
+        fields.setdefault(localName(child), child)
+    return fields
+
+
+def text(fields, name):
+    """
+    Return the stripped text of the named field from a children() dict.
+    Raises KeyError if there is no such field, and AttributeError if it is
+    empty.
+    """
+
+    return fields[name].text.strip()
+
+
+def items(bagInfo):
+    """
+    Return a (name, body) pair for each item of a codaXML bagInfo element,
+    leaving out those without both
+    """
+
+    pairs = []
+    for item in bagInfo.iterchildren(tag=etree.Element):
+        if localName(item) != 'item':
+            continue
+        fields = children(item)
+        try:
+            pairs.append((text(fields, 'name'), text(fields, 'body')))
+        except (KeyError, AttributeError):
+            continue
+    return pairs
@@ -0,0 +1,129 @@
+"""
+A cache of the file lists read from bags on the nodes.
+
+When a bag's files have to be read from its node, because it isn't in the
+Bag_File index or indexing is turned off, the parsed manifest and top-level
+listing are kept here along with the ETag and Last-Modified headers they
+came with. Each process keeps the lists it has used recently in memory, in
+front of the Django cache named by CODA_FILE_LIST_CACHE. That is a
+FileBasedCache in the default settings, which keeps them on disk and shares
+them between the processes on a server. The sizes of files found for a zip
+or tar download are filled in on the cached list too.
+
+A list is used as is for CODA_FILE_LIST_TTL seconds after it was read or
+last checked. After that, the node is asked for it again with a
+conditional request, and it is only read and parsed again if it changed.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .lru import LRUCache
+
+# How long lists are kept in the Django cache, to be revalidated.
+FILE_LIST_CACHE_TIMEOUT = 60 * 60 * 24 * 30
+
+memory = LRUCache(setting='CODA_FILE_LIST_CACHE_SIZE')
+
+
+def _key(bag_name):
+    return 'coda_mdstore.filelists:%s' % hashlib.md5(bag_name.encode('utf-8')).hexdigest()
+
+
+def _cache():
+    return caches[settings.CODA_FILE_LIST_CACHE]
+
+
+def lookup(bag_name):
+    """
+    Return the cached file list of the bag, or None. The list is a dict
+    with the id of the node it was read from, the url of the bag's root
+    there, the time it was last checked, and a dict for each of the
+    'manifest' and the 'listing' with their 'files' and 'validators'.
+    """
+
+    entry = memory.get(bag_name)
+    if entry is None:
+        entry = _cache().get(_key(bag_name))
+        if entry is not None:
+            memory.set(bag_name, entry)
+    return entry
+
+
+def _store(bag_name, entry):
+    memory.set(bag_name, entry)
+    _cache().set(_key(bag_name), entry, FILE_LIST_CACHE_TIMEOUT)
+
+
+def remember(bag_name, entry):
+    """
+    Cache the file list of the bag, as checked now
+    """
+
+    entry['checked'] = time.time()
+    _store(bag_name, entry)
+
+
+def remember_sizes(bag_name, sizes):
+    """
+    Fill in the sizes of files in the bag's cached list, given a dict of
+    sizes by path, leaving the time it was checked alone
+    """
+
+    entry = lookup(bag_name)
+    if entry is None:
+        return
+    for part in ('manifest', 'listing'):
+        entry[part] = dict(entry[part], files=[
+            (path, md5, sizes.get(path) if size is None else size)
+            for path, md5, size in entry[part]['files']
+        ])
+    _store(bag_name, entry)
+
+
+def forget(bag_name):
+    """
+    Drop the cached file list of the bag
+    """
+
+    memory.discard(bag_name)
+    _cache().delete(_key(bag_name))
+
+
+def is_fresh(entry):
+    """
+    Check whether a cached file list can be used without asking the node
+    """
+
+    ttl = settings.CODA_FILE_LIST_TTL
+    return time.time() - entry['checked'] < ttl
+
+
+def validators(handle):
+    """
+    Return the headers a file was sent with that a conditional request for
+    it can be made with
+    """
+
+    headers = handle.info()
+    return dict(
+        (name, headers.get(name)) for name in ('ETag', 'Last-Modified') if headers.get(name)
+    )
+
+
+def conditional_headers(part):
+    """
+    Return the headers for a conditional request for a cached part of a
+    file list, or None if it has nothing to revalidate with
+    """
+
+    if part is None:
+        return None
+    headers = {}
+    if part['validators'].get('ETag'):
+        headers['If-None-Match'] = part['validators']['ETag']
+    if part['validators'].get('Last-Modified'):
+        headers['If-Modified-Since'] = part['validators']['Last-Modified']
+    return headers or None
@@ -0,0 +1,98 @@
+"""
+Fixity checks of bag files made while they are downloaded.
+
+With CODA_VERIFY_DOWNLOADS on, each file served by bagProxy, and each file
+in a whole-bag zip or tar, is hashed as it streams by and its md5 compared
+with the one in the bag's manifest once the whole file has gone through.
+Files only partly sent (Range requests, interrupted downloads) aren't
+judged, and files sent by the front-end server can't be. Nor are files
+that couldn't be fetched in full: the node error raised ends the download
+and is logged where it happens, but says nothing about the bag's fixity.
+
+A mismatch is logged and the bag's Validate row is marked Failed. Files
+that match change nothing: a download doesn't check the tag manifests,
+bag-info or Payload-Oxum, so it is no stand-in for a run of the
+validator, and marking a bag Passed, or when it was last verified, is
+left to coda_validate.
+"""
+import hashlib
+import logging
+import threading
+from django.conf import settings
+
+from coda_validate.models import Validate
+
+logger = logging.getLogger(__name__)
+
+
+def enabled():
+    return settings.CODA_VERIFY_DOWNLOADS
+
+
+class FixityCheck(object):
+    """
+    Checks the files of one bag against their manifest checksums as they
+    are streamed
+    """
+
+    def __init__(self, identifier, checksums):
+        """
+        checksums maps the url each file is fetched from to its md5
+        """
+
+        self.identifier = identifier
+        self.checksums = checksums
+        self.results = {}
+        self._lock = threading.Lock()
+
+    def wrap(self, url, chunks):
+        """
+        Return the chunks of the file at url, hashed as they are read if
+        its checksum is known
+        """
+
+        expected = self.checksums.get(url)
+        if not expected:
+            return chunks
+        return self._hashed(url, expected, chunks)
+
+    def _hashed(self, url, expected, chunks):
+        digest = hashlib.md5()
+        for chunk in chunks:
+            digest.update(chunk)
+            yield chunk
+        # only reached once the whole file has been read; an error fetching
+        # it raises out of the loop above, and the file isn't judged.
+        actual = digest.hexdigest()
+        with self._lock:
+            self.results[url] = actual == expected
+        if actual != expected:
+            logger.warning(
+                'Fixity mismatch in %s: %s has md5 %s, the manifest has %s',
+                self.identifier, url, actual, expected,
+            )
+
+    def stream(self, url, chunks):
+        """
+        Yield the chunks of a single file, hashed as they go, and record
+        the outcome once done
+        """
+
+        try:
+            yield from self.wrap(url, chunks)
+        finally:
+            self.record()
+
+    @property
+    def failed(self):
+        return [url for url, matched in self.results.items() if not matched]
+
+    def record(self):
+        """
+        Mark the bag's Validate row Failed if any file didn't match
+        """
+
+        if self.failed:
+            Validate.objects.filter(identifier=self.identifier).update(
+                last_verified_status='Failed'
+            )
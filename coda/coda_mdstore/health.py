@@ -0,0 +1,168 @@
+"""
+The health of the storage nodes, as seen by the requests made to them.
+
+Every probe of a node records how long the node took to answer, or that it
+failed, in the Django cache named by CODA_NODE_HEALTH_CACHE, so that every
+process shares what the others have seen. That only holds if the cache is
+one they all reach; a LocMemCache leaves each process on its own. A node
+answering with an error status of its own (other than a 5xx) is healthy;
+it just doesn't have the file.
+
+A node's health is read, updated and written back without a lock, so when
+probes of the same node finish at the same moment one update can overwrite
+another. At worst a success or failure goes uncounted, or two requests get
+through to a half-open node, which only moves the circuit a probe later
+than it would otherwise.
+
+After CODA_NODE_FAILURE_THRESHOLD failures in a row, a node's circuit
+opens and it is left out of probes for CODA_NODE_CIRCUIT_RESET seconds.
+Then a single probe is let through: if it succeeds the circuit closes,
+and if it fails it stays open for another round. Nodes that are probed
+are tried in order of how quickly they have been answering.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+# How much each new request counts towards a node's average latency and
+# error rate.
+WEIGHT = 0.2
+
+# How long a node's health is kept after the last request to it.
+HEALTH_TIMEOUT = 60 * 60 * 24
+
+
+class NodeHealth(object):
+    """
+    What the requests to one node have shown
+    """
+
+    def __init__(self, latency=None, error_rate=0.0, failures=0, opened=None,
+                 last_error='', last_seen=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.failures = failures
+        self.opened = opened
+        self.last_error = last_error
+        self.last_seen = last_seen
+
+    @property
+    def state(self):
+        """
+        'closed' while the node is used, 'open' while it is left out, and
+        'half-open' once it is due a probe to see if it has recovered
+        """
+
+        if self.opened is None:
+            return 'closed'
+        reset = settings.CODA_NODE_CIRCUIT_RESET
+        if time.time() - self.opened < reset:
+            return 'open'
+        return 'half-open'
+
+    @property
+    def latency_ms(self):
+        if self.latency is None:
+            return None
+        return int(round(self.latency * 1000))
+
+    @property
+    def error_percent(self):
+        return int(round(self.error_rate * 100))
+
+    def succeeded(self, seconds):
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency += WEIGHT * (seconds - self.latency)
+        self.error_rate -= WEIGHT * self.error_rate
+        self.failures = 0
+        self.opened = None
+        self.last_seen = time.time()
+
+    def failed(self, error):
+        self.error_rate += WEIGHT * (1 - self.error_rate)
+        self.failures += 1
+        self.last_error = str(error)[:255]
+        self.last_seen = time.time()
+        threshold = settings.CODA_NODE_FAILURE_THRESHOLD
+        if self.opened is not None or self.failures >= threshold:
+            self.opened = time.time()
+
+
+def _cache():
+    return caches[settings.CODA_NODE_HEALTH_CACHE]
+
+
+def _key(node):
+    return 'coda_mdstore.health:%s' % node.node_name
+
+
+def get(node):
+    """
+    Return the NodeHealth of a node
+    """
+
+    return _cache().get(_key(node)) or NodeHealth()
+
+
+def get_many(nodes):
+    """
+    Return the NodeHealth of each of the nodes, by node name
+    """
+
+    found = _cache().get_many([_key(node) for node in nodes])
+    return dict(
+        (node.node_name, found.get(_key(node)) or NodeHealth()) for node in nodes
+    )
+
+
+def _save(node, health):
+    _cache().set(_key(node), health, HEALTH_TIMEOUT)
+
+
+def record_success(node, seconds):
+    """
+    Record that a node answered a request in the given number of seconds
+    """
+
+    health = get(node)
+    health.succeeded(seconds)
+    _save(node, health)
+
+
+def record_failure(node, error):
+    """
+    Record that a request to a node failed
+    """
+
+    health = get(node)
+    health.failed(error)
+    _save(node, health)
+
+
+def available(nodes):
+    """
+    Return the nodes to probe, fastest first, leaving out those whose
+    circuit is open. A node due a probe is let through, and its circuit
+    held open meanwhile so only one request goes to it. If every node's
+    circuit is open, they are all returned, since there is nothing to
+    lose by trying them.
+    """
+
+    healths = get_many(nodes)
+    chosen = []
+    for node in nodes:
+        health = healths[node.node_name]
+        if health.state == 'open':
+            continue
+        if health.state == 'half-open':
+            health.opened = time.time()
+            _save(node, health)
+        chosen.append(node)
+    if not chosen:
+        chosen = list(nodes)
+    return sorted(
+        chosen, key=lambda node: healths[node.node_name].latency or 0
+    )
@@ -0,0 +1,86 @@
+"""
+A cache of which node holds each bag.
+
+Locations are stored in the Bag_Location table so they survive restarts and
+are shared between processes, and each process keeps the ones it has used
+recently in a small LRU in front of the table.
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .lru import LRUCache
+from .models import Bag_Location, Node
+
+
+class LocationCache(LRUCache):
+    """
+    An LRU mapping bag names to node ids
+    """
+
+    def __init__(self, maxsize=None, setting='CODA_LOCATION_CACHE_SIZE'):
+        super(LocationCache, self).__init__(maxsize, setting)
+
+    def discard_node(self, node_id):
+        with self._lock:
+            for bag_name in [b for b, n in self._entries.items() if n == node_id]:
+                del self._entries[bag_name]
+
+
+cache = LocationCache()
+
+
+def lookup(bag_name):
+    """
+    Return the id of the node that last served the bag, or None
+    """
+
+    node_id = cache.get(bag_name)
+    if node_id is None:
+        node_id = Bag_Location.objects.filter(
+            bag_name=bag_name
+        ).values_list('node_id', flat=True).first()
+        if node_id is not None:
+            cache.set(bag_name, node_id)
+    return node_id
+
+
+def remember(bag_name, node):
+    """
+    Record that the node has served a file from the bag
+    """
+
+    if cache.get(bag_name) == node.pk:
+        return
+    Bag_Location.objects.update_or_create(
+        bag_name=bag_name, defaults={'node': node}
+    )
+    cache.set(bag_name, node.pk)
+
+
+def forget(bag_name):
+    """
+    Drop the recorded location of the bag
+    """
+
+    cache.discard(bag_name)
+    Bag_Location.objects.filter(bag_name=bag_name).delete()
+
+
+@receiver(post_save, sender=Node)
+def node_saved(sender, instance, **kwargs):
+    """
+    Drop every location pointing at a node once it is marked inactive
+    """
+
+    if instance.status == '0':
+        cache.discard_node(instance.pk)
+        Bag_Location.objects.filter(node=instance).delete()
+
+
+@receiver(post_delete, sender=Node)
+def node_deleted(sender, instance, **kwargs):
+    """
+    The rows go with the node, but this process still has them cached
+    """
+
+    cache.discard_node(instance.pk)
@@ -0,0 +1,54 @@
+"""
+A small thread-safe LRU, for the things each process keeps in memory in
+front of a table or a shared cache.
+"""
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class LRUCache(object):
+    """
+    A thread-safe mapping that drops the least recently used entries once
+    it holds more than maxsize of them, or as many as the named setting
+    says when maxsize isn't given
+    """
+
+    def __init__(self, maxsize=None, setting=None):
+        self.maxsize = maxsize
+        self.setting = setting
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def limit(self):
+        if self.maxsize is not None:
+            return self.maxsize
+        return getattr(settings, self.setting)
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            limit = self.limit
+            while len(self._entries) > limit:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,41 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Q
+
+from coda_mdstore import presentation
+from coda_mdstore.models import Bag, Node
+
+
+class Command(BaseCommand):
+    help = (
+        "Look for every bag on every active node and record which nodes "
+        "hold a copy. Bags can be named to look for just those."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('bags', nargs='*', help="Names of the bags to look for")
+        parser.add_argument(
+            '--stale', type=int, metavar='DAYS',
+            help="Only look for bags that haven't been looked for in this many days")
+
+    def handle(self, *args, **options):
+        bags = Bag.objects.order_by('name')
+        if options['bags']:
+            bags = bags.filter(name__in=options['bags'])
+        if options['stale'] is not None:
+            cutoff = datetime.now() - timedelta(days=options['stale'])
+            bags = bags.annotate(checked=Max('bag_replica__verified')).filter(
+                Q(checked__isnull=True) | Q(checked__lt=cutoff)
+            )
+        nodes = list(Node.objects.exclude(status='0'))
+        checked = missing = 0
+        for name in bags.values_list('name', flat=True).iterator():
+            found = presentation.locateReplicas(name, nodes)
+            checked += 1
+            if not found:
+                self.stderr.write("%s was not found on any node" % name)
+                missing += 1
+            elif options['verbosity'] > 1:
+                self.stdout.write("%s: %s" % (name, ', '.join(node.node_name for node in found)))
+        self.stdout.write("Checked %d bags, %d not found." % (checked, missing))
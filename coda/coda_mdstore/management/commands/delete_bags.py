@@ -0,0 +1,38 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from coda_mdstore import presentation
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete bags along with their metadata, file index, replica and "
+        "validation records. Bags can be named on the command line or one "
+        "to a line in a file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('bags', nargs='*', help="Names of the bags to delete")
+        parser.add_argument(
+            '--file', metavar='PATH',
+            help="Read the names of the bags to delete from this file, or - for stdin")
+        parser.add_argument(
+            '--batch-size', type=int,
+            help="How many bags to delete at a time")
+
+    def handle(self, *args, **options):
+        names = list(options['bags'])
+        if options['file'] == '-':
+            names.extend(line.strip() for line in sys.stdin)
+        elif options['file']:
+            with open(options['file']) as f:
+                names.extend(line.strip() for line in f)
+        names = [name for name in names if name]
+        deleted, rows = presentation.deleteBags(names, options['batch_size'])
+        for name in sorted(set(names) - set(deleted)):
+            self.stderr.write("%s was not found" % name)
+        if options['verbosity'] > 1:
+            for label, count in sorted(rows.items()):
+                self.stdout.write("%s: %d rows" % (label, count))
+        self.stdout.write("Deleted %d bags." % len(deleted))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+
+from coda_mdstore import manifests, presentation
+from coda_mdstore.models import Bag, Bag_File
+
+
+class Command(BaseCommand):
+    help = (
+        "Index the files of bags that haven't been indexed yet, reading "
+        "their manifests from the nodes. Bags can be named to index just "
+        "those."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('bags', nargs='*', help="Names of the bags to index")
+        parser.add_argument(
+            '--refresh', action='store_true',
+            help="Read the manifests of bags that are already indexed again")
+        parser.add_argument(
+            '--sizes', action='store_true',
+            help="Also find the size of each file on its node")
+
+    def handle(self, *args, **options):
+        bags = Bag.objects.order_by('name')
+        if options['bags']:
+            bags = bags.filter(name__in=options['bags'])
+        if not options['refresh']:
+            bags = bags.exclude(
+                name__in=Bag_File.objects.values('bag_name_id')
+            )
+        indexed = failed = 0
+        for name in bags.values_list('name', flat=True).iterator():
+            if options['refresh']:
+                manifests.forget(name)
+            try:
+                bag_root, node, files = presentation.readBagFiles(name)
+                if options['sizes'] and presentation.bagFileSizes(name, node, files) is None:
+                    self.stderr.write("Unable to find the sizes of the files in %s" % name)
+            except presentation.FileHandleError:
+                self.stderr.write("Unable to read the manifest of %s" % name)
+                failed += 1
+                continue
+            indexed += 1
+            if options['verbosity'] > 1:
+                self.stdout.write("%s: %d files" % (name, len(files)))
+        self.stdout.write("Indexed %d bags, %d failed." % (indexed, failed))
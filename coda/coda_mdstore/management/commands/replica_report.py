@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from coda_mdstore import replicas
+
+
+class Command(BaseCommand):
+    help = (
+        "List the bags with fewer copies on active nodes than they should "
+        "have, from what crawl_replicas and the downloads have found."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--copies', type=int,
+            default=settings.CODA_REPLICA_COUNT,
+            help="How many copies each bag should have")
+
+    def handle(self, *args, **options):
+        bags = replicas.under_replicated(options['copies'])
+        count = 0
+        for name, copies in bags.values_list('name', 'copies').iterator():
+            self.stdout.write("%s\t%d" % (name, copies))
+            count += 1
+        self.stdout.write(
+            "%d bags with fewer than %d copies." % (count, options['copies'])
+        )
+        if options['copies'] == settings.CODA_REPLICA_COUNT:
+            # the node status page shows this count
+            replicas.remember_under_replicated(count)
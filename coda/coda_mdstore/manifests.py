@@ -0,0 +1,161 @@
+"""
+An index of the files in each bag.
+
+The first time a bag's payload manifest is read from a node, its paths and
+md5 checksums are stored in the Bag_File table along with the files at the
+bag's top level. From then on the bag's files are listed from the table
+without a trip to the node. Sizes aren't in the manifest, so they are
+filled in once something has had to find them, and so are the CRC-32s of
+files that have gone out whole in a zip of the bag.
+
+Bags indexed before this existed can be filled in with the
+index_bag_files management command.
+"""
+from django.db import transaction
+
+from .models import Bag, Bag_File
+
+# How many rows go in each INSERT or UPDATE.
+BATCH_SIZE = 1000
+
+
+def lookup(bag_name):
+    """
+    Return a (path, md5, size) tuple for each indexed file in the bag, in
+    the order they were listed, or None if the bag hasn't been indexed. A
+    file missing from the manifest has a blank md5, and a size of None
+    until it is known.
+    """
+
+    files = list(
+        Bag_File.objects.filter(bag_name_id=bag_name).order_by('pk').values_list(
+            'path', 'md5', 'size'
+        )
+    )
+    return files or None
+
+
+def is_indexed(bag_name):
+    """
+    Check whether the bag's files have been indexed
+    """
+
+    return Bag_File.objects.filter(bag_name_id=bag_name).exists()
+
+
+def paths(bag_name, reverse=False):
+    """
+    Iterate over the paths of the bag's indexed files, in the order they
+    were listed or in reverse, reading them from the table in batches
+    """
+
+    return Bag_File.objects.filter(bag_name_id=bag_name).order_by(
+        '-pk' if reverse else 'pk'
+    ).values_list('path', flat=True).iterator(chunk_size=BATCH_SIZE)
+
+
+def remember(bag_name, files):
+    """
+    Replace the index of a bag with the given (path, md5, size) tuples.
+    Nothing is stored for a bag that has no record.
+    """
+
+    if not Bag.objects.filter(name=bag_name).exists():
+        return
+    with transaction.atomic():
+        Bag_File.objects.filter(bag_name_id=bag_name).delete()
+        Bag_File.objects.bulk_create(
+            [
+                Bag_File(
+                    bag_name_id=bag_name, path=path, path_hash=Bag_File.hash_path(path),
+                    md5=md5 or '', size=size,
+                )
+                for path, md5, size in files
+            ],
+            batch_size=BATCH_SIZE,
+        )
+
+
+def remember_sizes(bag_name, sizes):
+    """
+    Store the sizes of indexed files in the bag, given a dict of sizes by
+    path
+    """
+
+    rows = list(
+        Bag_File.objects.filter(bag_name_id=bag_name, size__isnull=True).only('path')
+    )
+    rows = [row for row in rows if row.path in sizes]
+    for row in rows:
+        row.size = sizes[row.path]
+    Bag_File.objects.bulk_update(rows, ['size'], batch_size=BATCH_SIZE)
+
+
+def crcs(bag_name):
+    """
+    Return the CRC-32s worked out so far for the bag's indexed files, in a
+    dict by path
+    """
+
+    return dict(
+        Bag_File.objects.filter(bag_name_id=bag_name, crc32__isnull=False).values_list(
+            'path', 'crc32'
+        )
+    )
+
+
+def remember_crcs(bag_name, crcs):
+    """
+    Store the CRC-32s of indexed files in the bag, given a dict of them by
+    path
+    """
+
+    rows = list(
+        Bag_File.objects.filter(bag_name_id=bag_name, crc32__isnull=True).only('path')
+    )
+    rows = [row for row in rows if row.path in crcs]
+    for row in rows:
+        row.crc32 = crcs[row.path]
+    Bag_File.objects.bulk_update(rows, ['crc32'], batch_size=BATCH_SIZE)
+
+
+class MemberCRCs(object):
+    """
+    The stored CRC-32s of a bag's files, by the names they go under in an
+    archive of the bag: their paths after a prefix
+    """
+
+    def __init__(self, bag_name, prefix):
+        self.bag_name = bag_name
+        self.prefix = prefix
+
+    def lookup(self):
+        return dict(
+            (self.prefix + path, crc) for path, crc in crcs(self.bag_name).items()
+        )
+
+    def remember(self, found):
+        remember_crcs(self.bag_name, dict(
+            (name[len(self.prefix):], crc) for name, crc in found.items()
+            if name.startswith(self.prefix)
+        ))
+
+
+def checksum(bag_name, path):
+    """
+    Return the md5 checksum of a file in the bag from its manifest, or None
+    if it isn't known
+    """
+
+    # the path isn't indexed, so the file is found by the hash of it.
+    return Bag_File.objects.filter(
+        bag_name_id=bag_name, path_hash=Bag_File.hash_path(path), path=path
+    ).exclude(md5='').values_list('md5', flat=True).first()
+
+
+def forget(bag_name):
+    """
+    Drop the index of the bag, so it is read again from its manifest
+    """
+
+    Bag_File.objects.filter(bag_name_id=bag_name).delete()
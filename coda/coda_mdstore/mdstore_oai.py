@@ -1,4 +1,5 @@
-from coda_mdstore.models import Bag, Bag_Info
+from coda_mdstore.models import Bag
+from coda_mdstore.presentation import prefetchBagInfo
 from coda_mdstore.views import objectsToXML
 from oaipmh import common, error
 from datetime import datetime
@@ -128,7 +129,7 @@ class OAIInterface(object):
         else:
             resultSet = bagObjectList[cursor:cursor + batch_size]
         resultList = []
-        for result in resultSet:
+        for result in prefetchBagInfo(resultSet):
             record = makeDataRecord(
                 result, domain=self.domain,
                 metadataPrefix=metadataPrefix
@@ -151,7 +152,7 @@ def makeDataRecord(
 
     # to build the header, we need the unique ID, and the datestamp
     # would the setspec be taken from facets?
-    bagInfoObjectList = Bag_Info.objects.filter(bag_name=bagObject)
+    bagInfoObjectList = bagObject.bag_info_set.all()
 
     id = arkToInfo(bagObject.name)
     date = bagObject.bagging_date
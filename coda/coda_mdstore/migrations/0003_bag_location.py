@@ -0,0 +1,21 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coda_mdstore', '0002_node_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Bag_Location',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bag_name', models.CharField(help_text='Name of Bag', max_length=255, unique=True)),
+                ('last_served', models.DateTimeField(auto_now=True, help_text='Date the node last served a file from the bag')),
+                ('node', models.ForeignKey(help_text='The node that last served a file from the bag', on_delete=django.db.models.deletion.CASCADE, to='coda_mdstore.node')),
+            ],
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coda_mdstore', '0003_bag_location'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='node',
+            name='access_mode',
+            field=models.CharField(choices=[('http', 'HTTP'), ('local', 'Local filesystem')], default='http', help_text='How files on the node are read. Local nodes are read from node_path when it is mounted on this server.', max_length=5),
+        ),
+    ]
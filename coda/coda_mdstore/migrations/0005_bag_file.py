@@ -0,0 +1,26 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coda_mdstore', '0004_node_access_mode'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Bag_File',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.TextField(help_text='Path of the file within the bag')),
+                ('md5', models.CharField(blank=True, db_index=True, help_text="MD5 checksum from the bag's manifest, if it is listed there", max_length=32)),
+                ('size', models.BigIntegerField(blank=True, help_text='Size of the file (in bytes), once it is known', null=True)),
+                ('bag_name', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='coda_mdstore.bag')),
+            ],
+            options={
+                'verbose_name_plural': 'Bag Files',
+                'ordering': ['id'],
+            },
+        ),
+    ]
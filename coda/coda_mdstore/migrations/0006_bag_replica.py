@@ -0,0 +1,30 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coda_mdstore', '0005_bag_file'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Bag_Replica',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('0', 'Missing'), ('1', 'Present')], default='1', help_text='Whether the copy was found on the node', max_length=1)),
+                ('verified', models.DateTimeField(help_text='Date the node was last checked for the bag')),
+                ('bag_name', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='coda_mdstore.bag')),
+                ('node', models.ForeignKey(help_text='The node the copy is on', on_delete=django.db.models.deletion.CASCADE, to='coda_mdstore.node')),
+            ],
+            options={
+                'verbose_name_plural': 'Bag Replicas',
+                'indexes': [models.Index(fields=['node', 'status'], name='bag_replica_node_status'), models.Index(fields=['verified'], name='bag_replica_verified')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='bag_replica',
+            constraint=models.UniqueConstraint(fields=('bag_name', 'node'), name='unique_bag_replica'),
+        ),
+    ]
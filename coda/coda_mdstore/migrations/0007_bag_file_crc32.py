@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coda_mdstore', '0006_bag_replica'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bag_file',
+            name='crc32',
+            field=models.BigIntegerField(blank=True, help_text='CRC-32 of the file, once it has been streamed whole', null=True),
+        ),
+    ]
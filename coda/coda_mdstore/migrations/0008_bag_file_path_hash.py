@@ -0,0 +1,35 @@
+import hashlib
+
+from django.db import migrations, models
+
+
+def hash_paths(apps, schema_editor):
+    Bag_File = apps.get_model('coda_mdstore', 'Bag_File')
+    rows = []
+    for row in Bag_File.objects.only('path').iterator(chunk_size=1000):
+        row.path_hash = hashlib.md5(row.path.encode('utf-8', 'surrogateescape')).hexdigest()
+        rows.append(row)
+        if len(rows) >= 1000:
+            Bag_File.objects.bulk_update(rows, ['path_hash'])
+            rows = []
+    Bag_File.objects.bulk_update(rows, ['path_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coda_mdstore', '0007_bag_file_crc32'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bag_file',
+            name='path_hash',
+            field=models.CharField(blank=True, editable=False, help_text='MD5 of the path, so a file can be looked up by an index', max_length=32),
+        ),
+        migrations.RunPython(hash_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='bag_file',
+            index=models.Index(fields=['bag_name', 'path_hash'], name='bag_file_path_hash'),
+        ),
+    ]
@@ -1,3 +1,6 @@
+import hashlib
+import os
+
 from django.db import models
 from django.db.models import Field, Lookup
 
@@ -74,6 +77,10 @@ class Node(models.Model):
         ('0', 'Inactive'),
         ('1', 'Active'),
     ]
+    ACCESS_MODE_CHOICES = [
+        ('http', 'HTTP'),
+        ('local', 'Local filesystem'),
+    ]
     node_name = models.CharField(
         max_length=255,
         help_text="The name of the node",
@@ -93,6 +100,15 @@ class Node(models.Model):
     status = models.CharField(
         max_length=1, choices=STATUS_CHOICES,
         help_text="The current status of the node", blank=True)
+    access_mode = models.CharField(
+        max_length=5, choices=ACCESS_MODE_CHOICES, default='http',
+        help_text="How files on the node are read. Local nodes are read "
+                  "from node_path when it is mounted on this server.")
+
+    @property
+    def is_mounted(self):
+        return self.access_mode == 'local' and os.path.isdir(
+            os.path.join(self.node_path, 'store', 'pairtree_root'))
 
 
 class External_Identifier(models.Model):
@@ -104,3 +120,100 @@ class External_Identifier(models.Model):
 
     def __str__(self):
         return self.value
+
+
+class Bag_Location(models.Model):
+    """
+    Remembers which node last served a file from a bag, so that lookups can
+    go straight to that node instead of probing all of them
+    """
+
+    bag_name = models.CharField(
+        max_length=255,
+        unique=True,
+        help_text="Name of Bag")
+    node = models.ForeignKey(
+        Node, on_delete=models.CASCADE,
+        help_text="The node that last served a file from the bag")
+    last_served = models.DateTimeField(
+        auto_now=True,
+        help_text="Date the node last served a file from the bag")
+
+    def __str__(self):
+        return "%s:%s" % (self.bag_name, self.node_id)
+
+
+class Bag_File(models.Model):
+    """
+    A file in a bag, as listed in its payload manifest or found at its top
+    level, so the bag's files can be listed without asking a node
+    """
+
+    bag_name = models.ForeignKey(Bag, on_delete=models.CASCADE)
+    path = models.TextField(
+        help_text="Path of the file within the bag")
+    path_hash = models.CharField(
+        max_length=32, blank=True, editable=False,
+        help_text="MD5 of the path, so a file can be looked up by an index")
+    md5 = models.CharField(
+        max_length=32, blank=True, db_index=True,
+        help_text="MD5 checksum from the bag's manifest, if it is listed there")
+    size = models.BigIntegerField(
+        null=True, blank=True,
+        help_text="Size of the file (in bytes), once it is known")
+    crc32 = models.BigIntegerField(
+        null=True, blank=True,
+        help_text="CRC-32 of the file, once it has been streamed whole")
+
+    def __str__(self):
+        return "%s:%s" % (self.bag_name_id, self.path)
+
+    @staticmethod
+    def hash_path(path):
+        return hashlib.md5(path.encode('utf-8', 'surrogateescape')).hexdigest()
+
+    def save(self, *args, **kwargs):
+        self.path_hash = self.hash_path(self.path)
+        super().save(*args, **kwargs)
+
+    class Meta:
+        ordering = ['id']
+        verbose_name_plural = "Bag Files"
+        indexes = [
+            models.Index(fields=['bag_name', 'path_hash'], name='bag_file_path_hash'),
+        ]
+
+
+class Bag_Replica(models.Model):
+    """
+    Records whether a node holds a copy of a bag, and when that was last
+    checked, so bags can be found and counted without asking the nodes
+    """
+
+    STATUS_CHOICES = [
+        ('0', 'Missing'),
+        ('1', 'Present'),
+    ]
+    bag_name = models.ForeignKey(Bag, on_delete=models.CASCADE)
+    node = models.ForeignKey(
+        Node, on_delete=models.CASCADE,
+        help_text="The node the copy is on")
+    status = models.CharField(
+        max_length=1, choices=STATUS_CHOICES, default='1',
+        help_text="Whether the copy was found on the node")
+    verified = models.DateTimeField(
+        help_text="Date the node was last checked for the bag")
+
+    def __str__(self):
+        return "%s:%s" % (self.bag_name_id, self.node_id)
+
+    class Meta:
+        verbose_name_plural = "Bag Replicas"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['bag_name', 'node'], name='unique_bag_replica'),
+        ]
+        indexes = [
+            models.Index(fields=['node', 'status'], name='bag_replica_node_status'),
+            models.Index(fields=['verified'], name='bag_replica_verified'),
+        ]
@@ -0,0 +1,149 @@
+"""
+Backends for handing the sending of bag files to the front-end web server.
+
+bagProxy asks the configured backend for a response for each file it
+serves, and bagDownload asks it for one for the whole bag. A backend
+returns None for anything it can't offload, and the file is streamed
+through Django instead.
+
+The backend is picked with the CODA_OFFLOAD setting, either by name or by
+the dotted path of a backend class.
+"""
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.module_loading import import_string
+
+from . import presentation
+
+BACKENDS = {
+    'reproxy': 'coda_mdstore.offload.ReproxyOffload',
+    'accel': 'coda_mdstore.offload.AccelRedirectOffload',
+    'sendfile': 'coda_mdstore.offload.SendfileOffload',
+}
+
+
+class Offload(object):
+    """
+    Offloads nothing, so every file is streamed through Django
+    """
+
+    def serve(self, handle, content_type):
+        """
+        Return a response that has the front-end server send the file the
+        handle was opened on, or None
+        """
+
+        return None
+
+    def serve_bag(self, identifier, meta_id):
+        """
+        Return a response that has the front-end server send a zip of the
+        whole bag, with its files under meta_id, or None
+        """
+
+        return None
+
+
+class ReproxyOffload(Offload):
+    """
+    Points a Perlbal-style proxy at the node's url for the file with an
+    X-REPROXY-URL header
+    """
+
+    def serve(self, handle, content_type):
+        resp = HttpResponse(content_type=content_type)
+        resp['X-REPROXY-URL'] = handle.geturl()
+        etag = presentation.fileETag(handle)
+        if etag:
+            resp['ETag'] = etag
+        return resp
+
+
+class SendfileOffload(Offload):
+    """
+    Has Apache (mod_xsendfile) or lighttpd send files from nodes mounted on
+    this server with an X-Sendfile header. Files on other nodes are
+    streamed through Django.
+    """
+
+    def serve(self, handle, content_type):
+        if not isinstance(handle, presentation.LocalFileHandle):
+            return None
+        resp = HttpResponse(content_type=content_type)
+        resp['X-Sendfile'] = handle.path
+        return resp
+
+
+class AccelRedirectOffload(Offload):
+    """
+    Has nginx send files with an X-Accel-Redirect header. Each node must be
+    proxied (or aliased, when mounted) under an internal location named
+    after it, e.g.
+
+        location /_node/coda-001/ {
+            internal;
+            proxy_pass http://node1.example.com/coda-001/;
+        }
+
+    Whole bags are zipped by nginx's mod_zip from the same locations.
+    """
+
+    def __init__(self, prefix=None):
+        if prefix is None:
+            prefix = settings.CODA_ACCEL_PREFIX
+        self.prefix = prefix
+
+    def location(self, node, bagPath):
+        """
+        Return the internal location of a file on a node, given its path
+        from presentation.bagFilePath
+        """
+
+        return '%s%s/%s' % (self.prefix, quote(node.node_name), bagPath.lstrip('/'))
+
+    def serve(self, handle, content_type):
+        if handle.node is None:
+            return None
+        prefix = presentation.nodeFileURL(handle.node, '')
+        if not handle.geturl().startswith(prefix):
+            return None
+        resp = HttpResponse(content_type=content_type)
+        resp['X-Accel-Redirect'] = self.location(
+            handle.node, handle.geturl()[len(prefix):]
+        )
+        return resp
+
+    def serve_bag(self, identifier, meta_id):
+        bag_root, node, files = presentation.readBagFiles(identifier)
+        if node is None:
+            return None
+        sizes = presentation.bagFileSizes(identifier, node, files)
+        if sizes is None:
+            return None
+        pathList = [path for path, md5, size in files]
+        bagPaths = [presentation.bagFilePath(identifier, path) for path in pathList]
+        # mod_zip wants one "crc32 size location name" line per file; a crc
+        # of "-" has it work the checksum out as the file goes by.
+        lines = [
+            '- %d %s %s/%s\n' % (size, self.location(node, bagPath), meta_id, path)
+            for size, bagPath, path in zip(sizes, bagPaths, pathList)
+        ]
+        resp = HttpResponse(''.join(lines), content_type='text/plain')
+        resp['X-Archive-Files'] = 'zip'
+        return resp
+
+
+def get_backend():
+    """
+    Return the offload backend named by the CODA_OFFLOAD setting. When it
+    isn't set, REPROXY = True still selects the reproxy backend.
+    """
+
+    name = settings.CODA_OFFLOAD
+    if not name and getattr(settings, 'REPROXY', False):
+        name = 'reproxy'
+    if not name:
+        return Offload()
+    return import_string(BACKENDS.get(name, name))()
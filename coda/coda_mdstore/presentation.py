@@ -1,21 +1,41 @@
+import collections
+import functools
+import hashlib
+import io
+import logging
+import mimetypes
 import os
+import queue
 import re
-import urllib.request
+import threading
+import time
 import urllib.parse
 import requests
+import urllib3
 import zipstream
 
-from bs4 import BeautifulSoup as BSoup
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from codalib import APP_AUTHOR
 from codalib.bagatom import (
     wrapAtom, ATOM, ATOM_NSMAP, BAG, BAG_NSMAP, TIME_FORMAT_STRING
 )
 from datetime import datetime
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, transaction
+from django.db.models import prefetch_related_objects
+from django.utils.http import http_date, parse_http_date_safe
 from lxml import etree
 from pypairtree import pairtree
+from requests.structures import CaseInsensitiveDict
 
-from . import exceptions
-from coda_mdstore.models import Bag, Bag_Info, Node, External_Identifier
+from . import codaxml, exceptions, filelists, health, locations, manifests, replicas
+from coda_mdstore.models import (
+    Bag, Bag_File, Bag_Info, Bag_Location, Bag_Replica, Node, External_Identifier
+)
+from coda_validate.models import Validate
+
+logger = logging.getLogger(__name__)
 
 XHTML_NAMESPACE = "http://www.w3.org/1999/xhtml/"
 XHTML = "{%s}" % XHTML_NAMESPACE
@@ -23,33 +43,472 @@ XHTML_NSMAP = {None: XHTML_NAMESPACE}
 
 
 class FileHandleError(Exception):
+
+    def __init__(self, *args, status=None):
+        super().__init__(*args)
+        # the HTTP status the node answered with, if it answered.
+        self.status = status
+
+
+class _ReuseCountingPool(object):
+    """
+    Counts how many requests go out over a connection that was already open
+    """
+
+    num_reused = 0
+
+    def _get_conn(self, timeout=None):
+        conn = super(_ReuseCountingPool, self)._get_conn(timeout=timeout)
+        if conn.is_connected:
+            self.num_reused += 1
+        return conn
+
+
+class ReuseCountingHTTPConnectionPool(_ReuseCountingPool, urllib3.HTTPConnectionPool):
+    pass
+
+
+class ReuseCountingHTTPSConnectionPool(_ReuseCountingPool, urllib3.HTTPSConnectionPool):
     pass
 
 
+class NodeAdapter(requests.adapters.HTTPAdapter):
+    """
+    A transport adapter whose connection pools keep reuse counters
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(NodeAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': ReuseCountingHTTPConnectionPool,
+            'https': ReuseCountingHTTPSConnectionPool,
+        }
+
+
+class NodeSessionPool(object):
+    """
+    Hands out one requests session per node, so connections to a node are
+    kept alive and shared by every thread talking to it
+    """
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _key(self, url):
+        url_parts = urllib.parse.urlsplit(url)
+        return "%s://%s" % (url_parts.scheme, url_parts.netloc)
+
+    def session(self, url):
+        """
+        Return the session for the node that serves the url
+        """
+
+        key = self._key(url)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                pool_size = settings.CODA_NODE_POOL_SIZE
+                adapter = NodeAdapter(pool_connections=1, pool_maxsize=pool_size)
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                # we pass the bytes on as they are stored, so don't let the
+                # node compress them on the way over.
+                session.headers['Accept-Encoding'] = 'identity'
+                self._sessions[key] = session
+        return session
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request through the node's session
+        """
+
+        kwargs.setdefault('timeout', (
+            settings.CODA_NODE_CONNECT_TIMEOUT,
+            settings.CODA_NODE_TIMEOUT,
+        ))
+        return self.session(url).request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request('HEAD', url, **kwargs)
+
+    def stats(self):
+        """
+        Return connection counters for each node, keyed by the node's
+        scheme and host. 'reused' counts the requests that went out over a
+        connection that was already open, and 'connections' the ones that
+        had to open a new one.
+        """
+
+        stats = {}
+        with self._lock:
+            sessions = list(self._sessions.items())
+        for key, session in sessions:
+            pools = session.get_adapter(key).poolmanager.pools
+            requests_made = reused = 0
+            for pool_key in pools.keys():
+                pool = pools.get(pool_key)
+                if pool is not None:
+                    requests_made += pool.num_requests
+                    reused += pool.num_reused
+            stats[key] = {
+                'requests': requests_made,
+                'reused': reused,
+                'connections': requests_made - reused,
+            }
+        return stats
+
+    def clear(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+
+nodeSessions = NodeSessionPool()
+
+
+class NodeFileHandle(object):
+    """
+    A file-like view of a streamed response from a node, offering the parts
+    of the urllib response interface that the views rely on
+    """
+
+    # the node the file was found on, set by getFileHandle
+    node = None
+
+    def __init__(self, response):
+        self.response = response
+        self.url = response.url
+        self.status = response.status_code
+        self.headers = response.headers
+        # urllib3 closes the body as soon as it is read to the end unless
+        # told not to, which the buffered reader takes for an error.
+        response.raw.auto_close = False
+        self._reader = io.BufferedReader(response.raw)
+
+    def geturl(self):
+        return self.url
+
+    def info(self):
+        return self.headers
+
+    def read(self, size=-1):
+        return self._reader.read(size)
+
+    def readinto(self, buffer):
+        return self._reader.readinto(buffer)
+
+    def readline(self, size=-1):
+        return self._reader.readline(size)
+
+    def __iter__(self):
+        return iter(self._reader)
+
+    def close(self):
+        self.response.close()
+
+
+def openNodeFile(url, timeout=None, headers=None):
+    """
+    Open a file on a node through the node's pooled session. Raises
+    FileHandleError unless the node answers with a 2xx status, with a 416
+    to a Range request (the node has the file, just not those bytes), or
+    with a 304 to a conditional request.
+    """
+
+    kwargs = {'stream': True, 'headers': headers}
+    if timeout is not None:
+        kwargs['timeout'] = timeout
+    response = nodeSessions.get(url, **kwargs)
+    headers = headers or {}
+    unsatisfiable = response.status_code == 416 and 'Range' in headers
+    notModified = response.status_code == 304 and (
+        'If-None-Match' in headers or 'If-Modified-Since' in headers)
+    if not (200 <= response.status_code < 300 or unsatisfiable or notModified):
+        response.close()
+        raise FileHandleError(
+            "%s returned %s" % (url, response.status_code), status=response.status_code
+        )
+    return NodeFileHandle(response)
+
+
+def parseByteRange(header, size):
+    """
+    Parse a Range header asking for a single range of bytes from a file of
+    the given size. Returns the first and last byte positions, None if the
+    header should be ignored, or False if the range can't be satisfied.
+    """
+
+    if not header:
+        return None
+    match = re.match(r'^bytes=(\d*)-(\d*)$', header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        length = int(last)
+        if not length or not size:
+            return False
+        return max(size - length, 0), size - 1
+    first = int(first)
+    if last != '' and int(last) < first:
+        return None
+    if first >= size:
+        return False
+    last = size - 1 if last == '' else min(int(last), size - 1)
+    return first, last
+
+
+class LocalFileHandle(object):
+    """
+    A file on a node that is mounted on this server, offering the same
+    interface as NodeFileHandle. A Range header naming a single range of
+    bytes is honored; any other is ignored and the whole file is read.
+    """
+
+    # the node the file was found on, set by getFileHandle
+    node = None
+
+    def __init__(self, path, url, headers=None):
+        self.path = path
+        self.url = url
+        self.status = 200
+        stat = os.stat(path)
+        self.headers = CaseInsensitiveDict({'Last-Modified': http_date(stat.st_mtime)})
+        if os.path.isdir(path):
+            # the bag's top level, which is only ever listed.
+            self.file = io.BytesIO()
+            self._remaining = 0
+            return
+        contentType, encoding = mimetypes.guess_type(path)
+        self.headers['Content-Type'] = contentType or 'application/octet-stream'
+        self.file = open(path, 'rb')
+        size = stat.st_size
+        byteRange = parseByteRange((headers or {}).get('Range'), size)
+        if byteRange is False:
+            self.status = 416
+            self.headers['Content-Range'] = 'bytes */%d' % size
+            size = 0
+        elif byteRange:
+            first, last = byteRange
+            self.status = 206
+            self.headers['Content-Range'] = 'bytes %d-%d/%d' % (first, last, size)
+            self.file.seek(first)
+            size = last - first + 1
+        self.headers['Content-Length'] = str(size)
+        self._remaining = size
+
+    def geturl(self):
+        return self.url
+
+    def info(self):
+        return self.headers
+
+    def read(self, size=-1):
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self.file.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def readinto(self, buffer):
+        with memoryview(buffer) as view:
+            count = self.file.readinto(view[:self._remaining])
+        self._remaining -= count
+        return count
+
+    def readline(self, size=-1):
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        line = self.file.readline(size)
+        self._remaining -= len(line)
+        return line
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+    def close(self):
+        self.file.close()
+
+
+def fileETag(handle, checksum=None):
+    """
+    Return a stable, quoted ETag for a file from a node, or None if there
+    is nothing stable to build one from. A known md5 checksum is preferred,
+    then the node's own ETag, then one derived from the file's url and
+    modification date.
+    """
+
+    if checksum:
+        return '"%s"' % checksum
+    headers = handle.info()
+    if headers.get('ETag'):
+        return headers.get('ETag')
+    lastModified = headers.get('Last-Modified')
+    if not lastModified:
+        return None
+    digest = hashlib.md5()
+    digest.update(handle.geturl().encode())
+    digest.update(lastModified.encode())
+    return '"%s"' % digest.hexdigest()
+
+
+def ifRangeMatches(ifRange, etag, lastModified):
+    """
+    Check an If-Range header against a file's ETag and modification date
+    (as seconds since the epoch). Weak ETags never match.
+    """
+
+    if ifRange.startswith('"') or ifRange.startswith('W/'):
+        return etag is not None and ifRange == etag and not etag.startswith('W/')
+    date = parse_http_date_safe(ifRange)
+    return date is not None and lastModified is not None and date == lastModified
+
+
+class BufferPool(object):
+    """
+    A fixed set of reusable buffers for streaming files through Django.
+    When every buffer is in use a throwaway one is handed out, so streams
+    never wait on each other.
+    """
+
+    def __init__(self, buffer_size, count):
+        self.buffer_size = buffer_size
+        self._free = queue.LifoQueue(maxsize=count)
+
+    def acquire(self):
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            return bytearray(self.buffer_size)
+
+    def release(self, buffer):
+        try:
+            self._free.put_nowait(buffer)
+        except queue.Full:
+            pass
+
+
+@functools.lru_cache(maxsize=None)
+def sharedBufferPool(buffer_size, count):
+    """
+    Return the BufferPool shared by the streams using count buffers of
+    buffer_size bytes. The pools are looked up by the settings in force
+    when a stream starts, so changing them takes effect on the next one.
+    """
+
+    return BufferPool(buffer_size, count)
+
+
+def bufferPool():
+    return sharedBufferPool(
+        settings.CODA_STREAM_BUFFER_SIZE, settings.CODA_STREAM_BUFFER_COUNT,
+    )
+
+
+def downloadBufferPool():
+    return sharedBufferPool(
+        settings.CODA_DOWNLOAD_CHUNK_SIZE, settings.CODA_DOWNLOAD_BUFFER_COUNT,
+    )
+
+
+def streamFileHandle(handle, pool=None, minimum=None):
+    """
+    Stream a file handle a buffer at a time. The handle is closed when the
+    stream runs out or is closed early, e.g. when the client disconnects.
+    Buffers come from the pool given, or the one for the
+    CODA_STREAM_BUFFER_SIZE and CODA_STREAM_BUFFER_COUNT settings.
+
+    Given a minimum, the first chunk is that big and each full one after
+    it twice as big, up to the size of the pool's buffers, so small files
+    go out in one small chunk and big ones in few big ones.
+    """
+
+    if pool is None:
+        pool = bufferPool()
+    buffer = pool.acquire()
+    view = memoryview(buffer)
+    size = min(minimum or len(buffer), len(buffer))
+    try:
+        while True:
+            count = handle.readinto(view[:size])
+            if not count:
+                break
+            yield bytes(view[:count])
+            if count == size:
+                size = min(size * 2, len(buffer))
+    finally:
+        view.release()
+        pool.release(buffer)
+        handle.close()
+
+
+def listBagDirectory(handle):
+    """
+    List the files in a directory of a bag, given a handle opened on it.
+    A node's listing is read from the handle, not fetched again.
+    """
+
+    if isinstance(handle, LocalFileHandle):
+        return sorted(
+            entry.name for entry in os.scandir(handle.path) if entry.is_file()
+        )
+    return list(iterFileLinks(handle))
+
+
+def iterFileLinks(handle):
+    """
+    Yield the href of each link to a file (not a directory) in the table
+    cells of a node's directory listing. The page is parsed as it is read,
+    and the rows already looked at are dropped, so the whole document is
+    never built.
+    """
+
+    parser = etree.HTMLPullParser(events=('start', 'end'), tag=('tr', 'td', 'a'))
+    size = settings.CODA_STREAM_BUFFER_SIZE
+    cells = 0
+    done = False
+    while not done:
+        data = handle.read(size)
+        if data:
+            parser.feed(data)
+        else:
+            parser.close()
+            done = True
+        for event, element in parser.read_events():
+            if element.tag == 'td':
+                cells += 1 if event == 'start' else -1
+            elif element.tag == 'a':
+                href = element.get('href')
+                if event == 'start' and cells and href and not href.endswith('/'):
+                    yield href
+            elif event == 'end':
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+
+
 def getFileList(url):
     """
-    Use BeautifulSoup to get a List of Files
+    Return the files linked to from a node's directory listing
     """
 
-    fileList = []
-    handle = urllib.request.urlopen(url)
-    soup = BSoup(handle, 'lxml')
-    trList = soup.find_all('tr')
-    for tr in trList:
-        tds = tr.find_all('td')
-        for td in tds:
-            anchors = td.find_all('a')
-            for anchor in anchors:
-                if anchor['href'][-1] == "/":
-                    continue
-                fileList.append(anchor['href'])
-    return fileList
+    handle = openNodeFile(url)
+    try:
+        return list(iterFileLinks(handle))
+    finally:
+        handle.close()
 
 
-def getFileHandle(codaId, codaPath):
+def bagFilePath(codaId, codaPath):
     """
-    Attempt to get a urllib2 handle that we can read from based on a file
-    specification
+    Build the path of a file within a bag, relative to the root of a node
     """
 
     codaSplit = re.compile(r"ark:/\d+?/")
@@ -60,100 +519,807 @@ def getFileHandle(codaId, codaPath):
         part = codaPathParts[i]
         codaPathParts[i] = urllib.parse.quote(part)
     escapedCodaPath = "/".join(codaPathParts)
-    nodeList = Node.objects.all()
-    exceptionList = []
-    for node in nodeList:
-        url_parts = urllib.parse.urlparse(node.node_url)
-        url = urllib.parse.urljoin(
-            "%s://%s" % (url_parts.scheme, url_parts.hostname),
-            os.path.join(
-                url_parts.path,
-                "store/pairtree_root",
-                codaPairtree,
-                codaPart,
-                escapedCodaPath,
-            )
+    return os.path.join(
+        "store/pairtree_root",
+        codaPairtree,
+        codaPart,
+        escapedCodaPath,
+    )
+
+
+def nodeFileURL(node, bagPath):
+    """
+    Resolve a path from bagFilePath against the url of a node
+    """
+
+    url_parts = urllib.parse.urlparse(node.node_url)
+    return urllib.parse.urljoin(
+        "%s://%s" % (url_parts.scheme, url_parts.hostname),
+        os.path.join(url_parts.path, bagPath)
+    )
+
+
+def nodeFilePath(node, bagPath):
+    """
+    Resolve a path from bagFilePath (or the rest of a node file url) against
+    the root of a node on disk. Returns None for paths that would escape the
+    node's store.
+    """
+
+    root = os.path.join(node.node_path, 'store')
+    path = os.path.normpath(
+        os.path.join(node.node_path, urllib.parse.unquote(bagPath).lstrip('/'))
+    )
+    if not path.startswith(root + os.sep):
+        return None
+    return path
+
+
+def openLocalFile(node, bagPath, headers=None):
+    """
+    Open a file on a node mounted on this server, or return None if the
+    node doesn't have it
+    """
+
+    path = nodeFilePath(node, bagPath)
+    if path is None:
+        return None
+    try:
+        return LocalFileHandle(path, nodeFileURL(node, bagPath), headers)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
+def localNodeFile(url, localNodes, headers=None):
+    """
+    Open the file at a node url from disk, if it lives on one of the given
+    mounted nodes. Returns None otherwise.
+    """
+
+    for node in localNodes:
+        prefix = nodeFileURL(node, '')
+        if url.startswith(prefix):
+            return openLocalFile(node, url[len(prefix):], headers)
+    return None
+
+
+def mountedNodes():
+    """
+    Return the active local nodes whose storage is mounted on this server
+    """
+
+    return [
+        node for node in Node.objects.exclude(status='0').filter(access_mode='local')
+        if node.is_mounted
+    ]
+
+
+def _closeLosingHandle(future):
+    """
+    Close a handle opened by a probe that lost the race in probeNodes
+    """
+
+    if future.cancelled() or future.exception() is not None:
+        return
+    future.result().close()
+
+
+def probeNode(node, bagPath, timeout, headers=None):
+    """
+    Open a file on a node, recording how the node did in its health
+    """
+
+    started = time.monotonic()
+    try:
+        handle = openNodeFile(nodeFileURL(node, bagPath), timeout=timeout, headers=headers)
+    except FileHandleError as e:
+        # the node answered; unless it was with a server error, it is
+        # healthy and just doesn't have the file.
+        if e.status is not None and e.status < 500:
+            health.record_success(node, time.monotonic() - started)
+        else:
+            health.record_failure(node, e)
+        raise
+    except Exception as e:
+        health.record_failure(node, e)
+        raise
+    health.record_success(node, time.monotonic() - started)
+    return handle
+
+
+def probeNodes(nodeList, bagPath, exceptionList, headers=None):
+    """
+    Ask every node in the list for the file at once, through a bounded
+    thread pool, and return the first node to answer along with its handle.
+    Probes still waiting to run are cancelled and handles opened by the
+    losing nodes are closed. Returns (None, None) if no node has the file.
+    """
+
+    if not nodeList:
+        return None, None
+    timeout = (
+        settings.CODA_NODE_CONNECT_TIMEOUT,
+        settings.CODA_NODE_TIMEOUT,
+    )
+    workers = settings.CODA_NODE_PROBE_WORKERS
+    executor = ThreadPoolExecutor(max_workers=min(workers, len(nodeList)))
+    futures = dict(
+        (
+            executor.submit(probeNode, node, bagPath, timeout, headers),
+            node
         )
-        try:
-            fileHandle = urllib.request.urlopen(url)
+        for node in nodeList
+    )
+    try:
+        for future in as_completed(futures):
+            try:
+                fileHandle = future.result()
+            except Exception as e:
+                exceptionList.append(str(e))
+                continue
+            for loser in futures:
+                if loser is not future:
+                    loser.cancel()
+                    loser.add_done_callback(_closeLosingHandle)
+            return futures[future], fileHandle
+    finally:
+        # don't hold the request up waiting on the slow nodes.
+        executor.shutdown(wait=False)
+    return None, None
+
+
+def getFileHandle(codaId, codaPath, headers=None):
+    """
+    Attempt to get a file handle that we can read from based on a file
+    specification
+
+    The node that last served a file from the bag is tried first. If it
+    doesn't have the file, its location is forgotten and the nodes
+    recorded in coda_mdstore.replicas as holding the bag are probed, then
+    the rest of the active nodes. Nodes whose circuit is open in
+    coda_mdstore.health are left out, and the rest are probed quickest
+    first. Any headers given, such as Range, are sent along with the
+    request.
+
+    Nodes mounted on this server are read straight from disk before any
+    node is asked over HTTP. A local node that isn't mounted is asked over
+    HTTP like the rest.
+    """
+
+    bagPath = bagFilePath(codaId, codaPath)
+    # nodes created before the status field existed have a blank status,
+    # so only skip the ones explicitly marked inactive.
+    nodeList = list(Node.objects.exclude(status='0'))
+    localNodes = [node for node in nodeList if node.is_mounted]
+    for node in localNodes:
+        fileHandle = openLocalFile(node, bagPath, headers)
+        if fileHandle:
+            fileHandle.node = node
             return fileHandle
-        except Exception as e:
-            exceptionList.append(str(e))
-            pass
+    # leave out nodes that keep failing, and try the quickest first.
+    nodeList = health.available([node for node in nodeList if node not in localNodes])
+    exceptionList = []
+    cachedNodeId = locations.lookup(codaId)
+    cachedNodes = [node for node in nodeList if node.pk == cachedNodeId]
+    if cachedNodes:
+        nodeList = [node for node in nodeList if node.pk != cachedNodeId]
+        node, fileHandle = probeNodes(cachedNodes, bagPath, exceptionList, headers)
+        if fileHandle:
+            fileHandle.node = node
+            return fileHandle
+        locations.forget(codaId)
+    replicaIds = replicas.nodes(codaId)
+    replicaNodes = [node for node in nodeList if node.pk in replicaIds]
+    if replicaNodes:
+        nodeList = [node for node in nodeList if node.pk not in replicaIds]
+        node, fileHandle = probeNodes(replicaNodes, bagPath, exceptionList, headers)
+        if fileHandle:
+            locations.remember(codaId, node)
+            fileHandle.node = node
+            return fileHandle
+    node, fileHandle = probeNodes(nodeList, bagPath, exceptionList, headers)
+    if fileHandle:
+        locations.remember(codaId, node)
+        replicas.record(codaId, {node: True})
+        fileHandle.node = node
+        return fileHandle
     raise FileHandleError(
-        "Unable to get handle for id %s at path %s" % (codaId, codaPath)
+        "Unable to get handle for id %s at path %s (%s)" % (
+            codaId, codaPath, '; '.join(exceptionList) or 'no nodes to ask'
+        )
     )
 
 
-def generateBagFiles(identifier, proxyRoot, proxyMode):
+def bagNode(identifier):
     """
-    Return list of files in the bag
+    Return the node holding the bag, reading none of its files when the
+    bag is on a mounted node or its location is already known
+    """
+
+    bagPath = bagFilePath(identifier, "bagit.txt")
+    for node in mountedNodes():
+        path = nodeFilePath(node, bagPath)
+        if path and os.path.isfile(path):
+            return node
+    nodeId = locations.lookup(identifier)
+    if nodeId is not None:
+        node = Node.objects.exclude(status='0').filter(pk=nodeId).first()
+        if node is not None:
+            return node
+    handle = getFileHandle(identifier, "bagit.txt")
+    handle.close()
+    return handle.node
+
+
+def mountedCopies(bagPath, nodeList):
+    """
+    Return whether each of the nodes given that is mounted on this server
+    has the file at bagPath, by node. Nodes that aren't mounted are left
+    out.
+    """
+
+    found = {}
+    for node in nodeList:
+        if node.is_mounted:
+            path = nodeFilePath(node, bagPath)
+            found[node] = bool(path) and os.path.isfile(path)
+    return found
+
+
+def locateReplicas(identifier, nodeList=None):
+    """
+    Look for the bag on each of the nodes given, or every active node, and
+    record in coda_mdstore.replicas which of them hold it. Nodes that
+    couldn't be asked are left as they were. Returns the nodes that had
+    the bag.
+    """
+
+    bagPath = bagFilePath(identifier, "bagit.txt")
+    if nodeList is None:
+        nodeList = list(Node.objects.exclude(status='0'))
+    found = mountedCopies(bagPath, nodeList)
+    remoteNodes = [node for node in nodeList if node not in found]
+    if remoteNodes:
+        timeout = (
+            settings.CODA_NODE_CONNECT_TIMEOUT,
+            settings.CODA_NODE_TIMEOUT,
+        )
+        workers = settings.CODA_NODE_PROBE_WORKERS
+        with ThreadPoolExecutor(max_workers=min(workers, len(remoteNodes))) as executor:
+            futures = dict(
+                (executor.submit(probeNode, node, bagPath, timeout), node)
+                for node in remoteNodes
+            )
+            for future in as_completed(futures):
+                node = futures[future]
+                try:
+                    future.result().close()
+                except FileHandleError as e:
+                    # a node that answered without a server error doesn't
+                    # have the bag; one that didn't answer might.
+                    if e.status is not None and e.status < 500:
+                        found[node] = False
+                    continue
+                except Exception:
+                    continue
+                found[node] = True
+    replicas.record(identifier, found)
+    return [node for node in nodeList if found.get(node)]
+
+
+def recordKnownReplicas(identifier):
+    """
+    Record the copies of the bag that can be seen without asking a node
+    over HTTP: those on the nodes mounted on this server, and the one that
+    last served a file from it. The rest are left to the crawl_replicas
+    management command and to the probes of getFileHandle.
     """
-    pathList = []
-    transList = []
-    handle = getFileHandle(identifier, "manifest-md5.txt")
-    bag_root = handle.url.rsplit('/', 1)[0]
+
+    nodeList = list(Node.objects.exclude(status='0'))
+    found = mountedCopies(bagFilePath(identifier, "bagit.txt"), nodeList)
+    nodeId = locations.lookup(identifier)
+    for node in nodeList:
+        if node.pk == nodeId:
+            found[node] = True
+    replicas.record(identifier, found)
+
+
+def bagRoot(node, identifier):
+    """
+    Return the url of the bag's root on a node
+    """
+
+    return nodeFileURL(node, bagFilePath(identifier, "manifest-md5.txt")).rsplit('/', 1)[0]
+
+
+def decodePath(path):
+    """
+    Decode a path read from a node, which may not be utf-8
+    """
+
+    if isinstance(path, bytes):
+        try:
+            return path.decode()
+        except UnicodeDecodeError:
+            return path.decode('latin-1')
+    return path
+
+
+def readManifest(handle):
+    """
+    Return a (path, md5, None) tuple for each file listed in a manifest
+    """
+
+    files = []
     line = handle.readline()
-    # iterate over handle and append urls to pathlist
     while line:
-        line = line.strip()
-        parts = line.split(None, 1)
+        parts = line.strip().split(None, 1)
         if len(parts) == 2:
-            pathList.append(parts[1])
+            files.append((decodePath(parts[1]), decodePath(parts[0]).lower(), None))
         line = handle.readline()
-    # iterate top files and append to pathlist
+    return files
+
+
+def readNodeBagFiles(identifier, cached=None):
+    """
+    Read the bag's payload manifest and top-level listing from the node
+    holding it. Returns the url of the bag's root there, the node, and a
+    dict with the 'files' and the 'validators' they were sent with for
+    each of the manifest and the listing.
+
+    Given a cached file list from coda_mdstore.filelists, each part is
+    asked for with a conditional request, and kept as cached when the node
+    says it hasn't changed.
+    """
+
+    manifest = cached and cached['manifest']
+    handle = getFileHandle(
+        identifier, "manifest-md5.txt", headers=filelists.conditional_headers(manifest)
+    )
+    if handle.status != 304:
+        manifest = {'files': readManifest(handle), 'validators': filelists.validators(handle)}
+    handle.close()
+    listing = cached and cached['listing']
     try:
-        topFileHandle = getFileHandle(identifier, "")
-        topFiles = getFileList(topFileHandle.url)
-        for topFile in topFiles:
-            pathList.append(topFile)
+        topFileHandle = getFileHandle(
+            identifier, "", headers=filelists.conditional_headers(listing)
+        )
+        try:
+            if topFileHandle.status != 304:
+                listing = {
+                    'files': [
+                        (decodePath(topFile), '', None)
+                        for topFile in listBagDirectory(topFileHandle)
+                    ],
+                    'validators': filelists.validators(topFileHandle),
+                }
+        finally:
+            topFileHandle.close()
     except FileHandleError:
-        pass
-    # iterate pathlist and resolve a unicode path dependent on proxy mode
-    for path in pathList:
-        if isinstance(path, bytes):
-            try:
-                path = path.decode()
-            except UnicodeDecodeError:
-                path = path.decode('latin-1')
-
-        # CODA_PROXY_MODE is a settings variable
-        if proxyMode:
-            uni = '%sbag/%s/%s' % (
-                proxyRoot, identifier, path
-            )
+        listing = {'files': [], 'validators': {}}
+    return handle.url.rsplit('/', 1)[0], handle.node, manifest, listing
+
+
+def cachedBagFiles(identifier):
+    """
+    Return the url of the bag's root, the node holding it, and its files,
+    through the file list cache
+    """
+
+    cached = filelists.lookup(identifier)
+    if cached is not None and filelists.is_fresh(cached):
+        node = Node.objects.exclude(status='0').filter(pk=cached['node']).first()
+        if node is not None:
+            files = cached['manifest']['files'] + cached['listing']['files']
+            return cached['bag_root'], node, files
+    bag_root, node, manifest, listing = readNodeBagFiles(identifier, cached)
+    filelists.remember(identifier, {
+        'node': node.pk,
+        'bag_root': bag_root,
+        'manifest': manifest,
+        'listing': listing,
+    })
+    return bag_root, node, manifest['files'] + listing['files']
+
+
+def readBagFiles(identifier):
+    """
+    Return the url of the bag's root on the node holding it, that node, and
+    a (path, md5, size) tuple for each file in the bag: those in its
+    payload manifest followed by the ones at its top level
+
+    The files come from the Bag_File index when the bag has been indexed.
+    Otherwise they are read from the node and indexed, with no sizes. When
+    CODA_INDEX_BAG_FILES is off, they are read through the file list cache
+    instead.
+    """
+    if not settings.CODA_INDEX_BAG_FILES:
+        return cachedBagFiles(identifier)
+    files = manifests.lookup(identifier)
+    if files is not None:
+        node = bagNode(identifier)
+        return bagRoot(node, identifier), node, files
+    bag_root, node, manifest, listing = readNodeBagFiles(identifier)
+    files = manifest['files'] + listing['files']
+    manifests.remember(identifier, files)
+    return bag_root, node, files
+
+
+def bagFileSizes(identifier, node, files, probe=True):
+    """
+    Return the sizes of the given (path, md5, size) files in the bag,
+    finding the ones that aren't known yet on the node and storing them in
+    the index, or the file list cache when CODA_INDEX_BAG_FILES is off.
+    Returns None if any of them can't be found.
+
+    Finding sizes on a node that isn't mounted here takes a request for
+    each file. Without probe, None is returned instead of asking.
+    """
+
+    missing = [path for path, md5, size in files if size is None]
+    found = {}
+    if missing:
+        if not probe and not node.is_mounted:
+            return None
+        sizes = nodeFileSizes(node, [bagFilePath(identifier, path) for path in missing])
+        if sizes is None:
+            return None
+        found = dict(zip(missing, sizes))
+        if settings.CODA_INDEX_BAG_FILES:
+            manifests.remember_sizes(identifier, found)
         else:
-            uni = bag_root + "/" + path
-        # throw the final path into a list
-        transList.append(uni)
+            filelists.remember_sizes(identifier, found)
+    return [found[path] if size is None else size for path, md5, size in files]
+
+
+def bagMembers(identifier, meta_id, probe=False):
+    """
+    Return a (name, url, size) tuple for each file in the bag, named as
+    it goes in an archive of the bag, or None if the sizes of the files
+    can't all be found. Sizes that aren't known are only asked of the
+    node, a request per file, given probe.
+    """
+
+    bag_root, node, files = readBagFiles(identifier)
+    sizes = bagFileSizes(identifier, node, files, probe)
+    if sizes is None:
+        return None
+    paths = [path for path, md5, size in files]
+    return [
+        ('%s/%s' % (meta_id, path), nodeFileURL(node, bagFilePath(identifier, path)), size)
+        for path, size in zip(paths, sizes)
+    ]
+
+
+def bagFileURL(identifier, path, bag_root, proxyRoot, proxyMode):
+    """
+    Return the url a file in the bag is listed under: through this server
+    in proxy mode, or on the node holding it otherwise
+    """
+    # CODA_PROXY_MODE is a settings variable
+    if proxyMode:
+        return '%sbag/%s/%s' % (proxyRoot, identifier, path)
+    return bag_root + "/" + path
+
+
+def iterBagURLs(identifier, proxyRoot, proxyMode, reverse=False):
+    """
+    Return an iterator over the urls of the files in the bag, in the order
+    generateBagFiles lists them or in reverse
+
+    The paths of an indexed bag are read from the Bag_File table in batches
+    as the iterator is consumed. Anything that needs a node is looked up
+    before the iterator is returned, so FileHandleError is raised here.
+    """
+    indexed = settings.CODA_INDEX_BAG_FILES and \
+        manifests.is_indexed(identifier)
+    if indexed:
+        bag_root = None if proxyMode else bagRoot(bagNode(identifier), identifier)
+        paths = manifests.paths(identifier, reverse)
+    else:
+        bag_root, node, files = readBagFiles(identifier)
+        paths = [path for path, md5, size in files]
+        if reverse:
+            paths.reverse()
+    return (
+        bagFileURL(identifier, path, bag_root, proxyRoot, proxyMode) for path in paths
+    )
 
-    return transList
+
+def bagChecksums(identifier):
+    """
+    Return the md5 of each file in the bag's manifest, by the url it is
+    fetched from on the node holding the bag
+    """
+
+    bag_root, node, files = readBagFiles(identifier)
+    return dict(
+        (nodeFileURL(node, bagFilePath(identifier, path)), md5)
+        for path, md5, size in files if md5
+    )
+
+
+def generateBagFiles(identifier, proxyRoot, proxyMode):
+    """
+    Return list of files in the bag
+    """
+    return list(iterBagURLs(identifier, proxyRoot, proxyMode))
 
 
-def file_chunk_generator(url):
+def joinLines(lines):
     """
-    Download a file and stream it
+    Join lines of text with newlines as they are read, yielding them in
+    blocks of about CODA_STREAM_BUFFER_SIZE characters
     """
-    r = requests.get(url, stream=True)
-    if r.status_code != 200:
+
+    size = settings.CODA_STREAM_BUFFER_SIZE
+    block = []
+    length = 0
+    for line in lines:
+        if length:
+            block.append("\n")
+        block.append(line)
+        length += len(line) + 1
+        if length >= size:
+            yield "".join(block)
+            block = [""]
+            length = 1
+    text = "".join(block)
+    if text:
+        yield text
+
+
+def nodeFileSizes(node, bagPaths):
+    """
+    Return the sizes of the files at the given paths on a node, asking for
+    them concurrently when the node isn't mounted here. Returns None if any
+    of them can't be found.
+    """
+
+    if node.is_mounted:
+        try:
+            return [os.path.getsize(nodeFilePath(node, bagPath)) for bagPath in bagPaths]
+        except (OSError, TypeError):
+            return None
+
+    def head(bagPath):
+        response = nodeSessions.head(nodeFileURL(node, bagPath))
+        response.close()
+        if response.status_code != 200 or 'Content-Length' not in response.headers:
+            raise FileHandleError(bagPath)
+        return int(response.headers['Content-Length'])
+
+    workers = settings.CODA_NODE_PROBE_WORKERS
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            return list(executor.map(head, bagPaths))
+        except (FileHandleError, requests.RequestException):
+            return None
+
+
+def file_chunk_generator(url, localNodes=(), start=0):
+    """
+    Download a file and stream it, reading it from disk instead when it
+    lives on one of the given mounted nodes. Raises FileHandleError if
+    the file can't be fetched.
+
+    Given a start, the file is streamed from that byte on.
+    """
+    headers = {'Range': 'bytes=%d-' % start} if start else None
+    handle = localNodeFile(url, localNodes, headers)
+    if handle is None:
+        try:
+            handle = openNodeFile(url, headers=headers)
+        except (FileHandleError, requests.RequestException) as e:
+            logger.warning('Unable to fetch %s: %s', url, e)
+            raise
+    if handle.status == 416:
+        handle.close()
         return
-    for chunk in r.iter_content(1024):
-        yield chunk
+    if start and handle.status != 206:
+        # the node sent the whole file, so skip up to the start.
+        remaining = start
+        while remaining:
+            skipped = len(handle.read(min(remaining, settings.CODA_DOWNLOAD_CHUNK_SIZE)))
+            if not skipped:
+                break
+            remaining -= skipped
+    yield from streamFileHandle(
+        handle, downloadBufferPool(),
+        settings.CODA_STREAM_BUFFER_SIZE,
+    )
+
+
+class _PrefetchSlot(object):
+    """
+    The chunks fetched so far for one file in a PrefetchPipeline
+    """
+
+    def __init__(self):
+        self.chunks = collections.deque()
+        self.size = 0
+        self.done = False
+        self.abandoned = False
+        self.error = None
+
+
+class PrefetchPipeline(object):
+    """
+    Fetches the files of a zip download ahead of the one being zipped.
+
+    While file i is streamed to the client, files i+1 through i+lookahead
+    are fetched by a pool of threads. The chunks waiting to be zipped are
+    held to `budget` bytes in total, except that the file being zipped may
+    always hold one chunk so it can't be starved by the ones ahead of it.
+    chunks() hands each file back whole, so the order of the archive is
+    the order of the urls.
+    """
+
+    def __init__(self, urls, fetch, lookahead, budget):
+        self.urls = list(urls)
+        self.fetch = fetch
+        self.lookahead = lookahead
+        self.budget = budget
+        self.buffered = 0
+        self.head = 0
+        self.closed = False
+        self._slots = {}
+        self._submitted = 0
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=lookahead + 1)
+
+    def _submitThrough(self, index):
+        last = min(index + self.lookahead, len(self.urls) - 1)
+        while self._submitted <= last:
+            self._slots[self._submitted] = _PrefetchSlot()
+            self._executor.submit(self._fill, self._submitted)
+            self._submitted += 1
+
+    def _overBudget(self, index, slot, size):
+        if index == self.head and not slot.size:
+            return False
+        return self.buffered + size > self.budget
+
+    def _fill(self, index):
+        with self._cond:
+            slot = self._slots.get(index)
+        if slot is None:
+            return
+        chunks = self.fetch(self.urls[index])
+        try:
+            for chunk in chunks:
+                with self._cond:
+                    while not (self.closed or slot.abandoned) and \
+                            self._overBudget(index, slot, len(chunk)):
+                        self._cond.wait()
+                    if self.closed or slot.abandoned:
+                        return
+                    slot.chunks.append(chunk)
+                    slot.size += len(chunk)
+                    self.buffered += len(chunk)
+                    self._cond.notify_all()
+        except Exception as e:
+            slot.error = e
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+            with self._cond:
+                slot.done = True
+                self._cond.notify_all()
+
+    def chunks(self, index):
+        """
+        Yield the chunks of the file at the given index in the urls
+        """
+
+        with self._cond:
+            self.head = index
+            self._submitThrough(index)
+            slot = self._slots[index]
+            self._cond.notify_all()
+        try:
+            while True:
+                with self._cond:
+                    while not slot.chunks and not slot.done:
+                        self._cond.wait()
+                    if not slot.chunks:
+                        del self._slots[index]
+                        if slot.error is not None:
+                            raise slot.error
+                        return
+                    chunk = slot.chunks.popleft()
+                    slot.size -= len(chunk)
+                    self.buffered -= len(chunk)
+                    self._cond.notify_all()
+                yield chunk
+        finally:
+            # if the file wasn't read to the end, drop what's left of it.
+            with self._cond:
+                if self._slots.get(index) is slot:
+                    del self._slots[index]
+                    slot.abandoned = True
+                    self.buffered -= slot.size
+                    slot.chunks.clear()
+                    slot.size = 0
+                    self._cond.notify_all()
+
+    def close(self):
+        """
+        Stop fetching, e.g. when the client goes away
+        """
 
+        with self._cond:
+            self.closed = True
+            self._slots.clear()
+            self._cond.notify_all()
+        self._executor.shutdown(wait=False)
 
-def zip_file_streamer(urls, meta_id):
+
+def prefetchedFiles(urls, localNodes=(), fixity=None):
+    """
+    Return a lazy iterable of chunks for each of the urls, and a function
+    to call once done with them. The files are fetched ahead through a
+    PrefetchPipeline, unless CODA_ZIP_PREFETCH_FILES is 0. Given a
+    fixity.FixityCheck, each file is hashed as it is fetched.
+    """
+    fetch = functools.partial(file_chunk_generator, localNodes=localNodes)
+    if fixity is not None:
+        fetch = functools.partial(_checkedFile, fetch, fixity)
+    lookahead = settings.CODA_ZIP_PREFETCH_FILES
+    if not lookahead:
+        return [fetch(url) for url in urls], lambda: None
+    pipeline = PrefetchPipeline(
+        urls, fetch, lookahead,
+        settings.CODA_ZIP_PREFETCH_BYTES,
+    )
+    return [pipeline.chunks(index) for index in range(len(urls))], pipeline.close
+
+
+def _checkedFile(fetch, fixity, url):
+    return fixity.wrap(url, fetch(url))
+
+
+def zip_file_streamer(urls, meta_id, localNodes=()):
     """
     Stream zipped file using zipstream
     """
-    with zipstream.ZipFile(mode='w', allowZip64=True) as zip_obj:
-        for url in urls:
-            filename = '%s/%s' % (meta_id, url.split(meta_id, 1)[-1])
+    files, close = prefetchedFiles(urls, localNodes)
+    try:
+        with zipstream.ZipFile(mode='w', allowZip64=True) as zip_obj:
+            for url, chunks in zip(urls, files):
+                filename = '%s/%s' % (meta_id, url.split(meta_id, 1)[-1])
+
+                zip_obj.write_iter(filename, chunks)
 
-            zip_obj.write_iter(filename, file_chunk_generator(url))
+            # Each call will iterate the generator one at a time until all files are completed.
+            for chunk in zip_obj:
+                yield chunk
+    finally:
+        close()
 
-        # Each call will iterate the generator one at a time until all files are completed.
-        for chunk in zip_obj:
-            yield chunk
+
+def fixedLength(chunks, size, url=''):
+    """
+    Yield the chunks of a file that should be size bytes long. If it turns
+    out longer or shorter, that is logged and FileHandleError raised, so
+    the archive it is part of ends early instead of going out corrupt.
+    """
+
+    remaining = size
+    try:
+        for chunk in chunks:
+            if len(chunk) > remaining:
+                logger.warning('%s is longer than its %d bytes', url, size)
+                raise FileHandleError('%s is longer than its %d bytes' % (url, size))
+            remaining -= len(chunk)
+            if chunk:
+                yield chunk
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+    if remaining:
+        logger.warning('%s came back %d of its %d bytes short', url, remaining, size)
+        raise FileHandleError('%s came back short' % url)
 
 
 def bagSearch(bagString):
@@ -182,7 +1348,7 @@ def makeBagAtomFeed(bagObjectList, id, title):
     linkTag = etree.SubElement(feedTag, ATOM + "link")
     linkTag.set("rel", "self")
     linkTag.set("href", id)
-    for bagObject in bagObjectList:
+    for bagObject in prefetchBagInfo(bagObjectList):
         entryTag = wrapAtom(
             objectsToXML(bagObject), bagObject.name, bagObject.name,
             alt="/bag/" + bagObject.name
@@ -191,6 +1357,18 @@ def makeBagAtomFeed(bagObjectList, id, title):
     return feedTag
 
 
+def prefetchBagInfo(bagObjectList):
+    """
+    Fetch the Bag_Info of each of a page of bags in one query, so that
+    objectsToXML can serialize them without a query per bag. Returns the
+    bags as a list.
+    """
+
+    bagObjectList = list(bagObjectList)
+    prefetch_related_objects(bagObjectList, 'bag_info_set')
+    return bagObjectList
+
+
 def updateBag(request):
     """
     updates a bag record with new information from an xml file
@@ -199,26 +1377,26 @@ def updateBag(request):
     xmlText = request.body
     entryRoot = None
     entryRoot = etree.XML(xmlText)
-    contentElement = entryRoot.xpath("*[local-name() = 'content']")[0]
-    codaXML = contentElement.xpath("*[local-name() = 'codaXML']")[0]
-    bag_name = codaXML.xpath("*[local-name() = 'name']")[0].text.strip()
+    codaXML = codaxml.content(entryRoot, 'codaXML')
+    bag_name = codaxml.text(codaxml.children(codaXML), 'name')
 
     if bag_name not in request.path:
         raise exceptions.BadBagName('The bag name supplied in the URL does not match the XML')
 
     bag = Bag.objects.get(name=bag_name)
 
-    # delete old info objects
-    old_bag_infos = Bag_Info.objects.filter(bag_name=bag)
-    old_bag_infos.delete()
-    # delete old external id objects
-    old_ext_ids = External_Identifier.objects.filter(belong_to_bag=bag)
-    old_ext_ids.delete()
     # attempt to update a Bag object from the codaXML section
     bagObject, bagInfoObjectList, errorCode = xmlToBagObject(codaXML)
-    bagObject.save()
-    for bagInfoObject in bagInfoObjectList:
-        bagInfoObject.save()
+    bagObject.changes = reconcileBag(bag, bagObject, bagInfoObjectList)
+    if bagObject.changes['payload']:
+        # the bag's files have changed, so read them again when next asked
+        manifests.forget(bag_name)
+        filelists.forget(bag_name)
+    logger.info(
+        'Updated %s: %d rows inserted, %d updated, %d deleted',
+        bag_name, bagObject.changes['inserted'], bagObject.changes['updated'],
+        bagObject.changes['deleted'],
+    )
     return bagObject
 
 
@@ -231,102 +1409,368 @@ def createBag(xmlText):
     entryRoot = etree.XML(xmlText)
     if entryRoot is None:
         raise Exception("Unable to parse uploaded XML")
-    contentElement = entryRoot.xpath("*[local-name() = 'content']")[0]
-    if contentElement is None:
-        raise Exception("No content element located")
-    codaXML = contentElement.xpath("*[local-name() = 'codaXML']")[0]
-    codaName = codaXML.xpath("*[local-name() = 'name']")[0].text.strip()
-    oldBagInfoObjectList = Bag_Info.objects.filter(bag_name=codaName)
-    for oldBagInfoObject in oldBagInfoObjectList:
-        oldBagInfoObject.delete()
+    codaXML = codaxml.content(entryRoot, 'codaXML')
     # attempt to create a Bag object from the codaXML section
     bagObject, bagInfoObjectList, errorCode = xmlToBagObject(codaXML)
     if errorCode:
         raise Exception("codaXML issue, %s" % (errorCode,))
-    bagObject.save()
-    for bagInfoObject in bagInfoObjectList:
-        bagInfoObject.save()
+    saveBag(bagObject, bagInfoObjectList, replace=bagObject.name)
     return bagObject, bagInfoObjectList
 
 
+def saveBag(bagObject, bagInfoObjectList, replace=None):
+    """
+    Save a bag along with its Bag_Info objects and an External_Identifier
+    for each External-Identifier among them. The info and identifiers of
+    the bag given as replace are deleted first. The writes share a
+    transaction, but MyISAM tables ignore it: should one fail, the bag is
+    left with part of its info, and saving it again puts that right.
+    """
+
+    with transaction.atomic():
+        if replace is not None:
+            Bag_Info.objects.filter(bag_name=replace).delete()
+            External_Identifier.objects.filter(belong_to_bag=replace).delete()
+        bagObject.save()
+        Bag_Info.objects.bulk_create(bagInfoObjectList)
+        External_Identifier.objects.bulk_create(
+            _externalIdentifiers(bagObject, bagInfoObjectList)
+        )
+
+
+def _externalIdentifiers(bagObject, bagInfoObjectList):
+    """
+    Make an External_Identifier for each External-Identifier Bag_Info
+    """
+
+    return [
+        External_Identifier(value=info.field_body, belong_to_bag=bagObject)
+        for info in bagInfoObjectList
+        if info.field_name == 'External-Identifier'
+    ]
+
+
+def saveBags(bags):
+    """
+    Save many bags, given as (Bag, list of Bag_Info objects) pairs with
+    distinct names. New bags are inserted, with their info and identifiers,
+    in a few queries for the lot. Those already stored are brought in line
+    with reconcileBag one at a time, which costs a few queries a bag but
+    leaves the rows that didn't change, and so their full text index
+    entries, alone. Returns the names of the bags that were stored.
+
+    The writes share a transaction, but MyISAM tables ignore it, so should
+    they fail part way the rows already written stay. Saving the bags again
+    finds them stored and reconciles them, which writes what is missing
+    rather than inserting them twice.
+    """
+
+    names = [bagObject.name for bagObject, bagInfoObjectList in bags]
+    with transaction.atomic():
+        stored = Bag.objects.in_bulk(names)
+        newBags = [(bagObject, infos) for bagObject, infos in bags if bagObject.name not in stored]
+        Bag.objects.bulk_create([bagObject for bagObject, infos in newBags])
+        Bag_Info.objects.bulk_create(
+            [info for bagObject, infos in newBags for info in infos]
+        )
+        External_Identifier.objects.bulk_create(
+            [
+                identifier for bagObject, infos in newBags
+                for identifier in _externalIdentifiers(bagObject, infos)
+            ]
+        )
+        payloadChanged = []
+        for bagObject, infos in bags:
+            if bagObject.name in stored:
+                if reconcileBag(stored[bagObject.name], bagObject, infos)['payload']:
+                    payloadChanged.append(bagObject.name)
+    for name in payloadChanged:
+        # the bag's files have changed, so read them again when next asked
+        manifests.forget(name)
+        filelists.forget(name)
+    return set(stored)
+
+
+def ingestBagFeed(stream, batchSize=None):
+    """
+    Create or update the bags in an Atom feed of codaXML entries, read
+    from a file-like object. Entries are parsed one at a time and let go
+    of once read, so a feed of any length is held in memory a batch at a
+    time, and each batch of batchSize bags (CODA_INGEST_BATCH_SIZE by
+    default) is saved with saveBags. Should a batch fail to save, its bags
+    are saved one at a time to find the ones at fault. Whether a bag was
+    created or updated is judged by what was stored before the batch, as
+    the failed batch may have left rows behind.
+
+    Returns a report of the number of bags created, updated and failed,
+    and of the entries that failed, in the order given, each with its
+    position, bag name (when it could be read) and error. If the feed
+    can't be parsed to the end, the entries before the fault are saved
+    and the report has an 'error' too.
+    """
+
+    if batchSize is None:
+        batchSize = settings.CODA_INGEST_BATCH_SIZE
+    report = {'created': 0, 'updated': 0, 'failed': 0, 'failures': []}
+    batch = {}
+
+    def fail(result, error):
+        result['error'] = error
+        report['failures'].append(result)
+        report['failed'] += 1
+
+    def flush():
+        failed = set()
+        stored = set(Bag.objects.filter(name__in=list(batch)).values_list('name', flat=True))
+        try:
+            saveBags([(bagObject, infos) for bagObject, infos, result in batch.values()])
+        except DatabaseError:
+            # save the bags one at a time to find the ones at fault; those
+            # the batch wrote before failing are reconciled, not inserted
+            for bagObject, infos, result in batch.values():
+                try:
+                    saveBags([(bagObject, infos)])
+                except DatabaseError as e:
+                    fail(result, str(e))
+                    failed.add(bagObject.name)
+        for name in batch:
+            if name not in failed:
+                report['updated' if name in stored else 'created'] += 1
+        batch.clear()
+
+    try:
+        for position, (event, entry) in enumerate(
+            etree.iterparse(stream, tag='{*}entry'), 1
+        ):
+            result = {'entry': position}
+            try:
+                codaXML = codaxml.content(entry, 'codaXML')
+            except IndexError:
+                codaXML = None
+            if codaXML is None:
+                fail(result, 'No codaXML content')
+            else:
+                bagObject, bagInfoObjectList, errorCode = xmlToBagObject(codaXML)
+                if errorCode:
+                    fail(result, errorCode)
+                else:
+                    result['name'] = bagObject.name
+                    try:
+                        bagObject.clean_fields()
+                    except ValidationError as e:
+                        fail(result, '; '.join(e.messages))
+                    else:
+                        # the later of two entries for a bag wins
+                        if bagObject.name in batch or len(batch) >= batchSize:
+                            flush()
+                        batch[bagObject.name] = (bagObject, bagInfoObjectList, result)
+            # drop the entry, and those before it, from the parsed tree
+            entry.clear()
+            while entry.getprevious() is not None:
+                del entry.getparent()[0]
+    except etree.XMLSyntaxError as e:
+        report['error'] = str(e)
+    if batch:
+        flush()
+    # the bags of a batch that failed to save are reported as it is saved
+    report['failures'].sort(key=lambda result: result['entry'])
+    return report
+
+
+def deleteBags(names, batchSize=None, keepValidations=False):
+    """
+    Delete the named bags along with their Bag_Info, External_Identifier,
+    Bag_File and Bag_Replica rows, their Validate record (unless
+    keepValidations is set) and their recorded location. The names are taken batchSize at a time
+    (CODA_DELETE_BATCH_SIZE by default), and each batch is deleted with a
+    query or two per table, whatever the number of bags in it.
+
+    The deletes of a batch share a transaction, but MyISAM tables ignore
+    it, so the rows that hang off the bags go first and the Bag rows last.
+    Should a batch fail part way, its bags are still there to be deleted
+    again, which removes what is left.
+
+    Returns the names of the bags deleted, and the number of rows deleted
+    from each table by model label.
+    """
+
+    if batchSize is None:
+        batchSize = settings.CODA_DELETE_BATCH_SIZE
+    names = list(dict.fromkeys(names))
+    deleted = []
+    rows = collections.Counter()
+    for start in range(0, len(names), batchSize):
+        with transaction.atomic():
+            found = list(
+                Bag.objects.filter(name__in=names[start:start + batchSize])
+                .values_list('name', flat=True)
+            )
+            if not found:
+                continue
+            # the bags go last, so a batch that fails part way can be
+            # deleted again.
+            querysets = [
+                Bag_Location.objects.filter(bag_name__in=found),
+                Bag_Info.objects.filter(bag_name__in=found),
+                External_Identifier.objects.filter(belong_to_bag__in=found),
+                Bag_File.objects.filter(bag_name__in=found),
+                Bag_Replica.objects.filter(bag_name__in=found),
+                Bag.objects.filter(name__in=found),
+            ]
+            if not keepValidations:
+                querysets.insert(0, Validate.objects.filter(identifier__in=found))
+            for queryset in querysets:
+                rows.update(queryset.delete()[1])
+        for name in found:
+            locations.cache.discard(name)
+            filelists.forget(name)
+        deleted.extend(found)
+    return deleted, dict(rows)
+
+
+def reconcileBag(bag, bagObject, bagInfoObjectList):
+    """
+    Bring a stored bag, its Bag_Info and its External_Identifier rows in
+    line with a Bag and Bag_Info objects parsed from codaXML, writing only
+    what changed. Info items already stored as they are, and identifiers
+    already stored, are left alone, so their full text index entries are
+    too. A changed item with the name of a stored one that no longer
+    matches is written over it.
+
+    The writes share a transaction, but MyISAM tables ignore it. Only
+    what differs is written, so should they fail part way, reconciling the
+    bag again writes the rest.
+
+    Returns a dict with the number of rows inserted, updated and deleted,
+    and whether the bag's payload (its size, file count or Payload-Oxum)
+    changed.
+    """
+
+    changes = {'inserted': 0, 'updated': 0, 'deleted': 0}
+    changedFields = [
+        field.attname for field in Bag._meta.concrete_fields
+        if not field.primary_key and field.to_python(
+            getattr(bagObject, field.attname)
+        ) != getattr(bag, field.attname)
+    ]
+    storedInfo = list(Bag_Info.objects.filter(bag_name=bag).order_by('pk'))
+    # pair up the items that are stored as they are
+    unchanged = collections.defaultdict(list)
+    for info in storedInfo:
+        unchanged[(info.field_name, info.field_body)].append(info)
+    newInfo = []
+    for info in bagInfoObjectList:
+        if unchanged.get((info.field_name, info.field_body)):
+            unchanged[(info.field_name, info.field_body)].pop(0)
+        else:
+            newInfo.append(info)
+    # then write the rest over stored items of the same name
+    staleInfo = collections.defaultdict(list)
+    for info in sorted((i for rows in unchanged.values() for i in rows), key=lambda i: i.pk):
+        staleInfo[info.field_name].append(info)
+    updatedInfo = []
+    insertedInfo = []
+    for info in newInfo:
+        if staleInfo.get(info.field_name):
+            row = staleInfo[info.field_name].pop(0)
+            row.field_body = info.field_body
+            updatedInfo.append(row)
+        else:
+            insertedInfo.append(info)
+    deletedInfo = [info.pk for rows in staleInfo.values() for info in rows]
+    payloadChanged = 'size' in changedFields or 'files' in changedFields
+    if any(info.field_name == 'Payload-Oxum' for info in newInfo):
+        payloadChanged = True
+
+    # identifiers are only ever added or removed
+    incomingIds = collections.Counter(
+        info.field_body for info in bagInfoObjectList
+        if info.field_name == 'External-Identifier'
+    )
+    deletedIds = []
+    for pk, value in External_Identifier.objects.filter(
+        belong_to_bag=bag
+    ).order_by('pk').values_list('pk', 'value'):
+        if incomingIds[value]:
+            incomingIds[value] -= 1
+        else:
+            deletedIds.append(pk)
+    insertedIds = [
+        External_Identifier(value=value, belong_to_bag=bag)
+        for value in incomingIds.elements()
+    ]
+
+    with transaction.atomic():
+        if changedFields:
+            bagObject.save(update_fields=changedFields)
+            changes['updated'] += 1
+        if deletedInfo:
+            changes['deleted'] += Bag_Info.objects.filter(pk__in=deletedInfo).delete()[0]
+        changes['updated'] += Bag_Info.objects.bulk_update(updatedInfo, ['field_body'])
+        changes['inserted'] += len(Bag_Info.objects.bulk_create(insertedInfo))
+        if deletedIds:
+            changes['deleted'] += External_Identifier.objects.filter(
+                pk__in=deletedIds
+            ).delete()[0]
+        changes['inserted'] += len(External_Identifier.objects.bulk_create(insertedIds))
+    changes['payload'] = payloadChanged
+    return changes
+
+
 def xmlToBagObject(codaXML):
     """
     Take a codaXML element and turn it into a Bag object
     Returns (Bag object, list of Bag_Info objects, error code)
     """
 
+    fields = codaxml.children(codaXML)
     # first, let's get the bag name and see if it exists already
     try:
-        name = codaXML.xpath("*[local-name() = 'name']")[0].text.strip()
+        name = codaxml.text(fields, 'name')
         bagObject = Bag.objects.get(Bag, name=name)
     # if we can't get the object, then we're just making a new one.
     except Exception:
         bagObject = Bag()
     dateFormatString = "%Y-%m-%d"
     try:
-        bagObject.name = codaXML.xpath(
-            "*[local-name() = 'name']")[0].text.strip()
+        bagObject.name = codaxml.text(fields, 'name')
     except:
         return (None, None, "Unable to set 'name' attribute")
     try:
-        bagObject.files = codaXML.xpath(
-            "*[local-name() = 'fileCount']")[0].text.strip()
+        bagObject.files = codaxml.text(fields, 'fileCount')
     except:
         return (None, None, "Unable to set 'files' attribute")
     try:
-        bagObject.size = int(codaXML.xpath(
-            "*[local-name() = 'payloadSize']")[0].text.strip())
+        bagObject.size = int(codaxml.text(fields, 'payloadSize'))
     except Exception as e:
         return (None, None, "Unable to set 'size' attribute: %s" % (e,))
     try:
-        bagObject.bagit_version = codaXML.xpath(
-            "*[local-name()='bagitVersion']")[0].text.strip()
+        bagObject.bagit_version = codaxml.text(fields, 'bagitVersion')
     except:
         pass
     try:
         bagObject.last_verified_date = datetime.strptime(
-            codaXML.xpath(
-                "*[local-name() = 'lastVerified']"
-            )[0].text.strip(), dateFormatString
+            codaxml.text(fields, 'lastVerified'), dateFormatString
         )
     except:
         bagObject.last_verified_date = datetime.now()
     try:
-        bagObject.last_verified_status = codaXML.xpath(
-            "*[local-name() = 'lastStatus']")[0].text.strip()
+        bagObject.last_verified_status = codaxml.text(fields, 'lastStatus')
     except:
         bagObject.last_verified_status = "pass"
     try:
         bagObject.bagging_date = datetime.strptime(
-            codaXML.xpath(
-                "*[local-name() = 'baggingDate']"
-            )[0].text.strip(), dateFormatString
+            codaxml.text(fields, 'baggingDate'), dateFormatString
         )
     except:
         bagObject.bagging_date = datetime.now()
-    bagInfo = codaXML.xpath("*[local-name() = 'bagInfo']")[0]
-    if len(bagInfo):
-        items = bagInfo.xpath("*[local-name() = 'item']")
     # make a list to store all the bag_info objects
     bagInfoObjects = []
-    # iterate through items
-    for item in items:
-        bagInfoObject = Bag_Info()
-        bagInfoObject.bag_name = bagObject
-        try:
-            bagInfoObject.field_name = item.xpath(
-                "*[local-name() = 'name']")[0].text.strip()
-            bagInfoObject.field_body = item.xpath(
-                "*[local-name() = 'body']")[0].text.strip()
-            if bagInfoObject.field_name == 'External-Identifier':
-                extID = External_Identifier(
-                    value=bagInfoObject.field_body,
-                    belong_to_bag=bagInfoObject.bag_name,
-                )
-                extID.save()
-        except:
-            continue
-        bagInfoObjects.append(bagInfoObject)
+    if 'bagInfo' in fields:
+        for fieldName, fieldBody in codaxml.items(fields['bagInfo']):
+            bagInfoObjects.append(
+                Bag_Info(bag_name=bagObject, field_name=fieldName, field_body=fieldBody)
+            )
     return (bagObject, bagInfoObjects, None)
 
 
@@ -334,7 +1778,8 @@ def objectsToXML(bagObject):
     """
     This is the reverse of xmlToObjects.  Given a "Bag" object, and a list of
     Bag_Info objects, it generates an XML object representative of such in the
-    'codaXML' format.
+    'codaXML' format. The bag's Bag_Info is read from a prefetch where there
+    is one; see prefetchBagInfo.
     """
 
     codaXML = etree.Element(BAG + "codaXML", nsmap=BAG_NSMAP)
@@ -354,8 +1799,7 @@ def objectsToXML(bagObject):
     except:
         pass
     bagInfo = etree.SubElement(codaXML, BAG + "bagInfo")
-    bagInfoObjectList = Bag_Info.objects.filter(bag_name=bagObject)
-    for bagInfoObject in bagInfoObjectList:
+    for bagInfoObject in bagObject.bag_info_set.all():
         item = etree.SubElement(bagInfo, BAG + "item")
         nameTag = etree.SubElement(item, BAG + "name")
         nameTag.text = bagInfoObject.field_name
@@ -401,9 +1845,8 @@ def updateNode(request):
 
     nodeXML = request.body
     entryRoot = etree.fromstring(nodeXML)
-    contentElement = entryRoot.xpath("*[local-name() = 'content']")[0]
-    nodeXML = contentElement.xpath("*[local-name() = 'node']")[0]
-    node_name = nodeXML.xpath("*[local-name() = 'name']")[0].text.strip()
+    fields = codaxml.children(codaxml.content(entryRoot, 'node'))
+    node_name = codaxml.text(fields, 'name')
 
     if node_name not in request.path:
         raise exceptions.BadNodeName('The node name supplied in the URL does not match the XML')
@@ -411,12 +1854,10 @@ def updateNode(request):
     node = Node.objects.get(node_name=node_name)
 
     # we need capacity and size
-    node_capacity = nodeXML.xpath(
-        "*[local-name() = 'capacity']"
-    )[0].text.strip()
-    node_size = nodeXML.xpath("*[local-name() = 'size']")[0].text.strip()
-    node_path = nodeXML.xpath("*[local-name() = 'path']")[0].text.strip()
-    node_url = nodeXML.xpath("*[local-name() = 'url']")[0].text.strip()
+    node_capacity = codaxml.text(fields, 'capacity')
+    node_size = codaxml.text(fields, 'size')
+    node_path = codaxml.text(fields, 'path')
+    node_url = codaxml.text(fields, 'url')
     node.node_capacity = int(node_capacity)
     node.node_size = int(node_size)
     node.node_path = node_path
@@ -435,15 +1876,12 @@ def createNode(request):
 
     nodeXML = request.body
     entryRoot = etree.fromstring(nodeXML)
-    contentElement = entryRoot.xpath("*[local-name() = 'content']")[0]
-    nodeXML = contentElement.xpath("*[local-name() = 'node']")[0]
-    node_name = nodeXML.xpath("*[local-name() = 'name']")[0].text.strip()
-    node_capacity = nodeXML.xpath(
-        "*[local-name() = 'capacity']"
-    )[0].text.strip()
-    node_size = nodeXML.xpath("*[local-name() = 'size']")[0].text.strip()
-    node_path = nodeXML.xpath("*[local-name() = 'path']")[0].text.strip()
-    node_url = nodeXML.xpath("*[local-name() = 'url']")[0].text.strip()
+    fields = codaxml.children(codaxml.content(entryRoot, 'node'))
+    node_name = codaxml.text(fields, 'name')
+    node_capacity = codaxml.text(fields, 'capacity')
+    node_size = codaxml.text(fields, 'size')
+    node_path = codaxml.text(fields, 'path')
+    node_url = codaxml.text(fields, 'url')
     node = Node()
     node.node_capacity = int(node_capacity)
     node.node_size = int(node_size)
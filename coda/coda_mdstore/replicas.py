@@ -0,0 +1,130 @@
+"""
+Which nodes hold a copy of each bag.
+
+The Bag_Replica table has a row for each node a bag has been looked for on,
+saying whether it was there and when that was checked. When a bag is
+ingested or its replication completes, only the copies that can be seen
+without asking a node over HTTP are recorded: those on nodes mounted on
+this server, and the one on the node that last served it. The rest are
+found by the probes of getFileHandle, which record a node that turns out
+to hold a bag no one knew about, and by the crawl_replicas management
+command, which goes through the whole archive.
+
+With it, getFileHandle can go straight to the nodes known to hold a bag,
+the node status page can count the bags on each node, and the bags with
+fewer than CODA_REPLICA_COUNT copies can be listed with a single query.
+That query goes through the whole archive, so the number of them shown on
+the node status page is kept in the cache for CODA_REPLICA_REPORT_TTL
+seconds, and the replica_report management command stores the number it
+finds.
+"""
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from coda_replication.models import QueueEntry
+from .models import Bag, Bag_Replica
+
+PRESENT = '1'
+MISSING = '0'
+
+UNDER_REPLICATED_KEY = 'coda_mdstore.replicas:under_replicated'
+
+
+def nodes(bag_name):
+    """
+    Return the ids of the nodes last found to hold a copy of the bag
+    """
+
+    return set(
+        Bag_Replica.objects.filter(
+            bag_name_id=bag_name, status=PRESENT
+        ).values_list('node_id', flat=True)
+    )
+
+
+def record(bag_name, found):
+    """
+    Record which nodes were checked for the bag just now, given a dict of
+    whether each node had it. Nothing is stored for a bag that has no
+    record.
+    """
+
+    if not found or not Bag.objects.filter(name=bag_name).exists():
+        return
+    now = datetime.now()
+    for node, present in found.items():
+        Bag_Replica.objects.update_or_create(
+            bag_name_id=bag_name, node=node,
+            defaults={'status': PRESENT if present else MISSING, 'verified': now},
+        )
+
+
+def counts(nodes=None):
+    """
+    Return the number of bags on each node, or on each of the nodes given,
+    by node id
+    """
+
+    replicas = Bag_Replica.objects.filter(status=PRESENT)
+    if nodes is not None:
+        replicas = replicas.filter(node__in=nodes)
+    return dict(
+        replicas.values_list('node_id').annotate(bags=Count('id')).order_by()
+    )
+
+
+def under_replicated(copies=None):
+    """
+    Return the bags with fewer than the given number of copies on active
+    nodes (CODA_REPLICA_COUNT by default), fewest first, each annotated
+    with its number of copies
+    """
+
+    if copies is None:
+        copies = settings.CODA_REPLICA_COUNT
+    return Bag.objects.annotate(
+        copies=Count(
+            'bag_replica',
+            filter=Q(bag_replica__status=PRESENT) & ~Q(bag_replica__node__status='0'),
+        )
+    ).filter(copies__lt=copies).order_by('copies', 'name')
+
+
+def under_replicated_count():
+    """
+    Return the number of bags with fewer than CODA_REPLICA_COUNT copies,
+    from the cache when it has been counted lately
+    """
+
+    count = cache.get(UNDER_REPLICATED_KEY)
+    if count is None:
+        count = under_replicated().count()
+        remember_under_replicated(count)
+    return count
+
+
+def remember_under_replicated(count):
+    """
+    Store the number of bags with fewer than CODA_REPLICA_COUNT copies
+    """
+
+    cache.set(UNDER_REPLICATED_KEY, count, settings.CODA_REPLICA_REPORT_TTL)
+
+
+@receiver(post_save, sender=QueueEntry)
+def replication_saved(sender, instance, **kwargs):
+    """
+    Record the copies of a bag that are already known once its replication
+    has completed
+    """
+
+    # presentation imports this module, so it can't be imported above.
+    from .presentation import recordKnownReplicas
+
+    if instance.status == '3' and Bag.objects.filter(name=instance.ark).exists():
+        recordKnownReplicas(instance.ark)
@@ -0,0 +1,318 @@
+"""
+Stored (uncompressed) zip archives of bags, laid out before any file is
+read.
+
+With the name and size of every file known up front, so are the offsets of
+each local header, file and data descriptor, of the central directory, and
+the length of the whole archive. That lets a zip be sent with a
+Content-Length, and any range of it be produced on its own by seeking to
+the right entry and fetching the file from there.
+
+The only part that depends on the files' contents is their CRC-32s, which
+go in the data descriptors and the central directory. They are worked out
+as the files stream by and handed to a store, such as
+manifests.MemberCRCs, which keeps them for resumed downloads. A range
+that needs CRCs nobody has worked out yet can't be produced without
+fetching those files first, so canResume() tells when to send the whole
+archive instead.
+"""
+import hashlib
+import struct
+import time
+import zipfile
+import zlib
+
+from . import presentation
+
+ZIP64_LIMIT = zipfile.ZIP64_LIMIT
+
+# General purpose flags: sizes and CRC in a data descriptor, UTF-8 names.
+FLAGS = 0x08 | 0x800
+
+LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+CENTRAL_HEADER = struct.Struct('<4s4B4HL2L5H2L')
+DESCRIPTOR = struct.Struct('<4sLLL')
+DESCRIPTOR64 = struct.Struct('<4sLQQ')
+END_RECORD = struct.Struct('<4s4H2LH')
+END_RECORD64 = struct.Struct('<4sQ2H2L4Q')
+END_LOCATOR64 = struct.Struct('<4sLQL')
+
+
+def dosDateTime(mtime):
+    """
+    Return the DOS date and time for seconds since the epoch, in UTC.
+    DOS dates start in 1980, so anything earlier is moved up to then.
+    """
+
+    year, month, day, hour, minute, second = time.gmtime(mtime)[:6]
+    if year < 1980:
+        year, month, day, hour, minute, second = 1980, 1, 1, 0, 0, 0
+    return (
+        (year - 1980) << 9 | month << 5 | day,
+        hour << 11 | minute << 5 | second // 2,
+    )
+
+
+class Entry(object):
+    """
+    The place of one file in a StoredZip
+    """
+
+    def __init__(self, name, url, size, offset, dosdate, dostime):
+        self.name = name.encode('utf-8')
+        self.url = url
+        self.size = size
+        self.offset = offset
+        self.zip64 = size >= ZIP64_LIMIT or offset >= ZIP64_LIMIT
+        self.header = self._localHeader(dosdate, dostime)
+        self.data_offset = offset + len(self.header)
+        self.descriptor_offset = self.data_offset + size
+        descriptor = DESCRIPTOR64 if self.zip64 else DESCRIPTOR
+        self.end = self.descriptor_offset + descriptor.size
+
+    def _localHeader(self, dosdate, dostime):
+        # the sizes and CRC follow the file, in its data descriptor.
+        extra = b''
+        size = 0
+        if self.zip64:
+            extra = struct.pack('<HHQQ', 1, 16, 0, 0)
+            size = 0xFFFFFFFF
+        return LOCAL_HEADER.pack(
+            b'PK\x03\x04', 45 if self.zip64 else 20, 0, FLAGS, zipfile.ZIP_STORED,
+            dostime, dosdate, 0, size, size, len(self.name), len(extra),
+        ) + self.name + extra
+
+    def descriptor(self, crc):
+        if self.zip64:
+            return DESCRIPTOR64.pack(b'PK\x07\x08', crc, self.size, self.size)
+        return DESCRIPTOR.pack(b'PK\x07\x08', crc, self.size, self.size)
+
+    def centralHeader(self, crc, dosdate, dostime):
+        fields = []
+        size = offset = None
+        if self.size >= ZIP64_LIMIT:
+            fields += [self.size, self.size]
+            size = 0xFFFFFFFF
+        if self.offset >= ZIP64_LIMIT:
+            fields.append(self.offset)
+            offset = 0xFFFFFFFF
+        extra = b''
+        if fields:
+            extra = struct.pack('<HH%dQ' % len(fields), 1, 8 * len(fields), *fields)
+        version = 45 if self.zip64 else 20
+        return CENTRAL_HEADER.pack(
+            b'PK\x01\x02', version, 3, version, 0, FLAGS, zipfile.ZIP_STORED,
+            dostime, dosdate, crc,
+            self.size if size is None else size, self.size if size is None else size,
+            len(self.name), len(extra), 0, 0, 0, 0o100644 << 16,
+            self.offset if offset is None else offset,
+        ) + self.name + extra
+
+    def centralSize(self):
+        return len(self.centralHeader(0, 0, 0))
+
+
+class StoredZip(object):
+    """
+    A stored zip of files on the nodes, with a layout known up front
+    """
+
+    def __init__(self, members, mtime=0, localNodes=(), fixity=None, crcs=None):
+        """
+        members is a list of (name, url, size) tuples, in archive order.
+        Given a fixity.FixityCheck, the files read whole are checked as
+        they go. Given a store of CRC-32s, with a lookup() method that
+        returns the known ones by member name and a remember() method that
+        is passed those worked out, they are read from and kept in it.
+        """
+
+        self.localNodes = localNodes
+        self.fixity = fixity
+        self.store = crcs
+        self.dosdate, self.dostime = dosDateTime(mtime)
+        self.entries = []
+        self.names = []
+        offset = 0
+        for name, url, size in members:
+            entry = Entry(name, url, size, offset, self.dosdate, self.dostime)
+            self.entries.append(entry)
+            self.names.append(name)
+            offset = entry.end
+        known = crcs.lookup() if crcs is not None else {}
+        self.crcs = [
+            known.get(name) if entry.size else 0
+            for name, entry in zip(self.names, self.entries)
+        ]
+        self.found = {}
+        self.cd_start = offset
+        self.cd_size = sum(entry.centralSize() for entry in self.entries)
+        self.zip64 = len(self.entries) >= 0xFFFF or \
+            max(self.cd_start, self.cd_size) >= ZIP64_LIMIT
+        self.size = self.cd_start + self.cd_size + END_RECORD.size
+        if self.zip64:
+            self.size += END_RECORD64.size + END_LOCATOR64.size
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def etag(self):
+        """
+        A quoted ETag for the archive, which changes with its layout
+        """
+
+        digest = hashlib.md5()
+        for entry in self.entries:
+            digest.update(b'%s\0%d\0' % (entry.name, entry.size))
+        digest.update(b'%d %d' % (self.dosdate, self.dostime))
+        return '"%s"' % digest.hexdigest()
+
+    def _setCrc(self, index, crc):
+        if self.crcs[index] is None:
+            self.found[self.names[index]] = crc
+        self.crcs[index] = crc
+
+    def _saveCrcs(self):
+        if self.found and self.store is not None:
+            self.store.remember(self.found)
+        self.found = {}
+
+    def crc(self, index):
+        """
+        Return the CRC-32 of a file, fetching the file to work it out if
+        it isn't known yet
+        """
+
+        if self.crcs[index] is None:
+            entry = self.entries[index]
+            crc = 0
+            chunks = presentation.file_chunk_generator(entry.url, self.localNodes)
+            for chunk in presentation.fixedLength(chunks, entry.size, entry.url):
+                crc = zlib.crc32(chunk, crc)
+            self._setCrc(index, crc)
+        return self.crcs[index]
+
+    def canResume(self, first, last):
+        """
+        Check whether the bytes from first to last can be streamed without
+        fetching files that lie before them just for their CRC-32s. Files
+        the range reads from their start, or starts partway through, are
+        read anyway.
+        """
+
+        if last >= self.cd_start:
+            needed = range(len(self.entries))
+        else:
+            needed = [
+                index for index, entry in enumerate(self.entries)
+                if entry.descriptor_offset <= last and entry.end > first
+            ]
+        return all(
+            self.crcs[index] is not None or self.entries[index].descriptor_offset >= first
+            for index in needed
+        )
+
+    def _endRecords(self):
+        count = len(self.entries)
+        records = b''
+        if self.zip64:
+            records += END_RECORD64.pack(
+                b'PK\x06\x06', END_RECORD64.size - 12, 45, 45, 0, 0,
+                count, count, self.cd_size, self.cd_start,
+            )
+            records += END_LOCATOR64.pack(
+                b'PK\x06\x07', 0, self.cd_start + self.cd_size, 1
+            )
+        records += END_RECORD.pack(
+            b'PK\x05\x06', 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+            min(self.cd_size, 0xFFFFFFFF), min(self.cd_start, 0xFFFFFFFF), 0,
+        )
+        return records
+
+    def _slice(self, data, offset, first, last):
+        """
+        Yield the part of data, which starts at offset in the archive, that
+        falls between first and last
+        """
+
+        start = max(first - offset, 0)
+        stop = min(last + 1 - offset, len(data))
+        if start < stop:
+            yield data[start:stop]
+
+    def _data(self, index, first, last, chunks):
+        """
+        Yield the part of a file that falls between first and last, working
+        out its CRC on the way when the file is read from its start
+        """
+
+        entry = self.entries[index]
+        start = max(first - entry.data_offset, 0)
+        stop = min(last + 1 - entry.data_offset, entry.size)
+        fetchedFrom = 0
+        if chunks is None:
+            # the range starts partway through the file. Its CRC is needed
+            # if the range runs past it, and reading the file from its
+            # start is the only way to work that out.
+            if stop < entry.size or self.crcs[index] is not None:
+                fetchedFrom = start
+            chunks = presentation.file_chunk_generator(
+                entry.url, self.localNodes, fetchedFrom
+            )
+        position = fetchedFrom
+        crc = 0
+        for chunk in presentation.fixedLength(chunks, entry.size - fetchedFrom, entry.url):
+            if not fetchedFrom:
+                crc = zlib.crc32(chunk, crc)
+            yield from self._slice(chunk, position, start, stop - 1)
+            position += len(chunk)
+            if position >= stop and stop < entry.size:
+                break
+        if not fetchedFrom and position == entry.size:
+            self._setCrc(index, crc)
+
+    def stream(self, first=0, last=None):
+        """
+        Yield the bytes of the archive from first to last, inclusive
+        """
+
+        if last is None:
+            last = self.size - 1
+        # files read from their start go through the prefetch pipeline.
+        fresh = [
+            index for index, entry in enumerate(self.entries)
+            if entry.size and first <= entry.data_offset <= last
+        ]
+        files, close = presentation.prefetchedFiles(
+            [self.entries[index].url for index in fresh], self.localNodes, self.fixity
+        )
+        files = dict(zip(fresh, files))
+        try:
+            for index, entry in enumerate(self.entries):
+                if entry.end <= first:
+                    continue
+                if entry.offset > last:
+                    break
+                yield from self._slice(entry.header, entry.offset, first, last)
+                if entry.size and entry.data_offset <= last and \
+                        entry.descriptor_offset > first:
+                    yield from self._data(index, first, last, files.pop(index, None))
+                if entry.descriptor_offset <= last:
+                    descriptor = entry.descriptor(self.crc(index))
+                    yield from self._slice(descriptor, entry.descriptor_offset, first, last)
+            if last >= self.cd_start:
+                central = b''.join(
+                    entry.centralHeader(self.crc(index), self.dosdate, self.dostime)
+                    for index, entry in enumerate(self.entries)
+                ) + self._endRecords()
+                yield from self._slice(central, self.cd_start, first, last)
+        finally:
+            for chunks in files.values():
+                chunks.close()
+            close()
+            self._saveCrcs()
+            if self.fixity is not None:
+                self.fixity.record()
+
+    def __iter__(self):
+        return self.stream()
@@ -0,0 +1,72 @@
+"""
+Tar archives of bags, streamed with a length known up front.
+
+Every member's size is given before any file is read, so the headers and
+the length of the whole archive are too, and the tar can be sent with a
+Content-Length. A file that doesn't come back at the size it was given
+ends the stream early, so the client sees a cut-off transfer rather than
+an archive that looks whole but isn't.
+"""
+import tarfile
+
+from . import presentation
+
+
+def tarHeader(name, size, mtime=0):
+    """
+    Return the header blocks for a regular file in a pax tar archive
+    """
+
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = mtime
+    info.mode = 0o644
+    return info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+
+
+def tarPadding(size):
+    """
+    Return the number of zero bytes that fill out a file's last tar block
+    """
+
+    return -size % tarfile.BLOCKSIZE
+
+
+class TarStream(object):
+    """
+    A tar archive of files on the nodes, streamed as it is read
+    """
+
+    def __init__(self, members, mtime=0, localNodes=(), fixity=None):
+        """
+        members is a list of (name, url, size) tuples, in archive order.
+        Given a fixity.FixityCheck, the files are checked as they go.
+        """
+
+        self.members = members
+        self.localNodes = localNodes
+        self.fixity = fixity
+        self.headers = [tarHeader(name, size, mtime) for name, url, size in members]
+        self.size = sum(
+            len(header) + size + tarPadding(size)
+            for header, (name, url, size) in zip(self.headers, members)
+        ) + 2 * tarfile.BLOCKSIZE
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        files, close = presentation.prefetchedFiles(
+            [url for name, url, size in self.members], self.localNodes, self.fixity
+        )
+        try:
+            for header, (name, url, size), chunks in zip(self.headers, self.members, files):
+                yield header
+                yield from presentation.fixedLength(chunks, size, url)
+                if tarPadding(size):
+                    yield bytes(tarPadding(size))
+            yield bytes(2 * tarfile.BLOCKSIZE)
+        finally:
+            close()
+            if self.fixity is not None:
+                self.fixity.record()
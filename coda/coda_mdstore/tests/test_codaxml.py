@@ -0,0 +1,99 @@
+from lxml import etree, objectify
+import pytest
+
+from coda_mdstore import codaxml
+
+ENTRY = b"""<?xml version="1.0"?>
+<entry xmlns="http://www.w3.org/2005/Atom">
+    <title>ark:/67531/coda2</title>
+    <content type="application/xml">
+        <bag:codaXML xmlns:bag="http://digital2.library.unt.edu/coda/bagxml/">
+        <bag:name> ark:/67531/coda2 </bag:name>
+        <!-- a comment -->
+        <bag:fileCount>43</bag:fileCount>
+        <fileCount>44</fileCount>
+        <bag:lastStatus/>
+        <bag:bagInfo>
+            <bag:item>
+                <bag:name>Bag-Size</bag:name>
+                <bag:body>51.26M</bag:body>
+            </bag:item>
+            <bag:item>
+                <bag:name>No-Body</bag:name>
+            </bag:item>
+            <bag:other>
+                <bag:name>Not-An-Item</bag:name>
+                <bag:body>value</bag:body>
+            </bag:other>
+            <item>
+                <name>Payload-Oxum</name>
+                <body>46259062.43</body>
+            </item>
+        </bag:bagInfo>
+        </bag:codaXML>
+    </content>
+</entry>
+"""
+
+
+@pytest.fixture
+def entry():
+    return etree.fromstring(ENTRY)
+
+
+class TestContent:
+    """
+    Tests for coda_mdstore.codaxml.content.
+    """
+
+    def test_returns_content_element(self, entry):
+        assert codaxml.localName(codaxml.content(entry, 'codaXML')) == 'codaXML'
+
+    def test_raises_index_error(self, entry):
+        with pytest.raises(IndexError):
+            codaxml.content(entry, 'node')
+
+
+class TestChildren:
+    """
+    Tests for coda_mdstore.codaxml.children.
+    """
+
+    def test_keyed_by_local_name(self, entry):
+        fields = codaxml.children(codaxml.content(entry, 'codaXML'))
+        assert sorted(fields) == ['bagInfo', 'fileCount', 'lastStatus', 'name']
+
+    def test_keeps_first_of_a_name(self, entry):
+        fields = codaxml.children(codaxml.content(entry, 'codaXML'))
+        assert fields['fileCount'].text == '43'
+
+    def test_objectified_element(self):
+        fields = codaxml.children(objectify.fromstring(ENTRY))
+        assert sorted(fields) == ['content', 'title']
+
+
+class TestText:
+    """
+    Tests for coda_mdstore.codaxml.text.
+    """
+
+    def test_strips_text(self, entry):
+        fields = codaxml.children(codaxml.content(entry, 'codaXML'))
+        assert codaxml.text(fields, 'name') == 'ark:/67531/coda2'
+
+    def test_missing_field(self, entry):
+        fields = codaxml.children(codaxml.content(entry, 'codaXML'))
+        with pytest.raises(KeyError):
+            codaxml.text(fields, 'payloadSize')
+
+    def test_empty_field(self, entry):
+        fields = codaxml.children(codaxml.content(entry, 'codaXML'))
+        with pytest.raises(AttributeError):
+            codaxml.text(fields, 'lastStatus')
+
+
+def test_items(entry):
+    fields = codaxml.children(codaxml.content(entry, 'codaXML'))
+    assert codaxml.items(fields['bagInfo']) == [
+        ('Bag-Size', '51.26M'), ('Payload-Oxum', '46259062.43')
+    ]
@@ -1,5 +1,7 @@
 from lxml import objectify
 import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from coda_mdstore import factories
 
 
@@ -21,6 +23,21 @@ class TestAtomSiteNewsFeed:
         feed = objectify.fromstring(response.content)
         assert len(feed.entry) == 20
 
+    def test_queries_do_not_grow_with_bags(self, client):
+        factories.FullBagFactory.create_batch(2)
+        # the first request also looks up the current site
+        client.get('/feed/')
+        with CaptureQueriesContext(connection) as few:
+            client.get('/feed/')
+
+        factories.FullBagFactory.create_batch(10)
+        with CaptureQueriesContext(connection) as many:
+            response = client.get('/feed/')
+
+        feed = objectify.fromstring(response.content)
+        assert len(feed.entry) == 12
+        assert len(many) == len(few)
+
     def test_has_pagination_links(self, client):
         factories.BagFactory.create_batch(50)
         response = client.get('/feed/')
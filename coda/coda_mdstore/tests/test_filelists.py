@@ -0,0 +1,179 @@
+import io
+from unittest import mock
+
+import pytest
+from django.conf import settings
+
+from coda_mdstore import factories, filelists, health, locations, presentation
+
+
+@pytest.fixture(autouse=True)
+def clear_file_lists():
+    filelists.memory.clear()
+    filelists._cache().clear()
+
+
+def entry(**kwargs):
+    entry = {
+        'node': 1,
+        'bag_root': 'http://example.com/node/1/bag',
+        'manifest': {'files': [('data/a.txt', 'abc', None)], 'validators': {'ETag': '"m1"'}},
+        'listing': {'files': [('bagit.txt', '', None)], 'validators': {}},
+    }
+    entry.update(kwargs)
+    return entry
+
+
+class TestFileLists:
+    """
+    Tests for the coda_mdstore.filelists cache functions.
+    """
+
+    def test_lookup_missing(self):
+        assert filelists.lookup('ark:/00001/id1') is None
+
+    def test_remember_and_lookup(self):
+        filelists.remember('ark:/00001/id1', entry())
+        found = filelists.lookup('ark:/00001/id1')
+
+        assert found['manifest']['files'] == [('data/a.txt', 'abc', None)]
+        assert filelists.is_fresh(found)
+
+    def test_lookup_falls_back_to_shared_cache(self):
+        filelists.remember('ark:/00001/id1', entry())
+        filelists.memory.clear()
+
+        assert filelists.lookup('ark:/00001/id1')['bag_root'] == 'http://example.com/node/1/bag'
+        assert filelists.memory.get('ark:/00001/id1') is not None
+
+    def test_remember_sizes(self):
+        filelists.remember('ark:/00001/id1', entry())
+        checked = filelists.lookup('ark:/00001/id1')['checked']
+        filelists.remember_sizes('ark:/00001/id1', {'data/a.txt': 3, 'bagit.txt': 4})
+        filelists.memory.clear()
+        found = filelists.lookup('ark:/00001/id1')
+
+        assert found['manifest']['files'] == [('data/a.txt', 'abc', 3)]
+        assert found['listing']['files'] == [('bagit.txt', '', 4)]
+        assert found['manifest']['validators'] == {'ETag': '"m1"'}
+        assert found['checked'] == checked
+
+    def test_remember_sizes_of_missing_list(self):
+        filelists.remember_sizes('ark:/00001/id1', {'data/a.txt': 3})
+        assert filelists.lookup('ark:/00001/id1') is None
+
+    def test_forget(self):
+        filelists.remember('ark:/00001/id1', entry())
+        filelists.forget('ark:/00001/id1')
+
+        assert filelists.lookup('ark:/00001/id1') is None
+
+    @mock.patch.object(settings, 'CODA_FILE_LIST_TTL', 0)
+    def test_stale_after_ttl(self):
+        filelists.remember('ark:/00001/id1', entry())
+        assert not filelists.is_fresh(filelists.lookup('ark:/00001/id1'))
+
+    def test_conditional_headers(self):
+        part = {'validators': {'ETag': '"m1"', 'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT'}}
+        assert filelists.conditional_headers(part) == {
+            'If-None-Match': '"m1"',
+            'If-Modified-Since': 'Wed, 21 Oct 2015 07:28:00 GMT',
+        }
+        assert filelists.conditional_headers({'validators': {}}) is None
+        assert filelists.conditional_headers(None) is None
+
+
+@pytest.mark.django_db
+@mock.patch.object(settings, 'CODA_INDEX_BAG_FILES', False)
+class TestCachedBagFiles:
+    """
+    Tests for reading bag files through coda_mdstore.filelists.
+    """
+
+    @pytest.fixture
+    def node(self):
+        return factories.NodeFactory.create(status='1', node_url='http://example.com/node/1')
+
+    def handles(self, node, status=200):
+        manifest = mock.Mock(url='http://example.com/node/1/bag/manifest-md5.txt', node=node)
+        manifest.status = status
+        manifest.info.return_value = {'ETag': '"m1"'}
+        manifest.readline.side_effect = [b'abc  data/a.txt\n', b'']
+        listing = mock.Mock(node=node)
+        listing.status = status
+        listing.info.return_value = {'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT'}
+        return [manifest, listing]
+
+    def test_listing_is_read_from_one_request(self, node, monkeypatch):
+        locations.cache.clear()
+        health._cache().clear()
+        bodies = {
+            'manifest-md5.txt': b'abc  data/a.txt\n',
+            '': b'<table><tr><td><a href="bagit.txt">bagit.txt</a></td></tr></table>',
+        }
+        requested = []
+
+        def get(url, **kwargs):
+            requested.append(url)
+            body = bodies[url.rsplit('/', 1)[1]]
+            return mock.Mock(url=url, status_code=200, headers={}, raw=io.BytesIO(body))
+
+        monkeypatch.setattr('coda_mdstore.presentation.nodeSessions.get', get)
+        bag_root, found, files = presentation.readBagFiles('ark:/00001/id1')
+
+        assert files == [('data/a.txt', 'abc', None), ('bagit.txt', '', None)]
+        assert len(requested) == 2
+
+    @mock.patch('coda_mdstore.presentation.iterFileLinks', return_value=['bagit.txt'])
+    @mock.patch('coda_mdstore.presentation.getFileHandle')
+    def test_reads_node_once_while_fresh(self, mock_handle, mock_list, node):
+        mock_handle.side_effect = self.handles(node)
+        first = presentation.readBagFiles('ark:/00001/id1')
+        second = presentation.readBagFiles('ark:/00001/id1')
+
+        assert first == second == (
+            'http://example.com/node/1/bag', node,
+            [('data/a.txt', 'abc', None), ('bagit.txt', '', None)],
+        )
+        assert mock_handle.call_count == 2
+        assert mock_list.call_count == 1
+
+    @mock.patch('coda_mdstore.presentation.iterFileLinks', return_value=['bagit.txt'])
+    @mock.patch('coda_mdstore.presentation.getFileHandle')
+    def test_revalidates_when_stale(self, mock_handle, mock_list, node):
+        mock_handle.side_effect = self.handles(node) + self.handles(node, status=304)
+        presentation.readBagFiles('ark:/00001/id1')
+        with mock.patch.object(settings, 'CODA_FILE_LIST_TTL', 0):
+            bag_root, found, files = presentation.readBagFiles('ark:/00001/id1')
+
+        assert files == [('data/a.txt', 'abc', None), ('bagit.txt', '', None)]
+        assert mock_handle.call_args_list[2] == mock.call(
+            'ark:/00001/id1', 'manifest-md5.txt', headers={'If-None-Match': '"m1"'})
+        assert mock_handle.call_args_list[3] == mock.call(
+            'ark:/00001/id1', '',
+            headers={'If-Modified-Since': 'Wed, 21 Oct 2015 07:28:00 GMT'})
+        assert mock_list.call_count == 1
+
+    @mock.patch('coda_mdstore.presentation.iterFileLinks', return_value=['bagit.txt'])
+    @mock.patch('coda_mdstore.presentation.getFileHandle')
+    def test_rereads_changed_manifest(self, mock_handle, mock_list, node):
+        changed = self.handles(node)
+        changed[0].readline.side_effect = [b'def  data/b.txt\n', b'']
+        mock_handle.side_effect = self.handles(node) + changed
+        presentation.readBagFiles('ark:/00001/id1')
+        with mock.patch.object(settings, 'CODA_FILE_LIST_TTL', 0):
+            bag_root, found, files = presentation.readBagFiles('ark:/00001/id1')
+
+        assert files[0] == ('data/b.txt', 'def', None)
+
+    @mock.patch('coda_mdstore.presentation.nodeFileSizes', return_value=[3, 4])
+    @mock.patch('coda_mdstore.presentation.iterFileLinks', return_value=['bagit.txt'])
+    @mock.patch('coda_mdstore.presentation.getFileHandle')
+    def test_sizes_are_found_once(self, mock_handle, mock_list, mock_sizes, node):
+        mock_handle.side_effect = self.handles(node)
+        for attempt in range(2):
+            bag_root, found, files = presentation.readBagFiles('ark:/00001/id1')
+            sizes = presentation.bagFileSizes('ark:/00001/id1', found, files)
+
+        assert sizes == [3, 4]
+        assert mock_sizes.call_count == 1
@@ -0,0 +1,173 @@
+import hashlib
+import io
+import tarfile
+from unittest import mock
+
+import pytest
+from django.conf import settings
+
+from coda_mdstore import fixity, presentation, views
+from coda_mdstore.factories import FullBagFactory, NodeFactory
+from coda_mdstore.models import Bag_File
+from coda_validate.factories import ValidateFactory
+from coda_validate.models import Validate
+
+pytestmark = pytest.mark.django_db
+
+CONTENTS = {
+    'http://example.com/node/1/a.txt': b'abc',
+    'http://example.com/node/1/b.txt': b'hello',
+}
+CHECKSUMS = dict(
+    (url, hashlib.md5(data).hexdigest()) for url, data in CONTENTS.items()
+)
+
+
+file_chunk_generator = presentation.file_chunk_generator
+
+
+def status(identifier):
+    return Validate.objects.get(identifier=identifier).last_verified_status
+
+
+class TestFixityCheck:
+    """
+    Tests for coda_mdstore.fixity.FixityCheck.
+    """
+
+    def test_matching_file(self):
+        check = fixity.FixityCheck('ark:/00001/id1', CHECKSUMS)
+        url = 'http://example.com/node/1/a.txt'
+        assert b''.join(check.wrap(url, iter([b'a', b'bc']))) == b'abc'
+
+        assert check.results == {url: True}
+        assert not check.failed
+
+    def test_file_without_checksum_is_not_wrapped(self):
+        check = fixity.FixityCheck('ark:/00001/id1', CHECKSUMS)
+        chunks = iter([b'abc'])
+        assert check.wrap('http://example.com/node/1/bagit.txt', chunks) is chunks
+
+    def test_file_that_fails_to_fetch_is_not_judged(self):
+        def chunks():
+            yield b'ab'
+            raise presentation.FileHandleError('timed out')
+
+        check = fixity.FixityCheck('ark:/00001/id1', CHECKSUMS)
+        with pytest.raises(presentation.FileHandleError):
+            b''.join(check.wrap('http://example.com/node/1/a.txt', chunks()))
+
+        assert check.results == {}
+
+    def test_partly_read_file_is_not_judged(self):
+        check = fixity.FixityCheck('ark:/00001/id1', CHECKSUMS)
+        chunks = check.wrap('http://example.com/node/1/a.txt', iter([b'x', b'y']))
+        next(chunks)
+        chunks.close()
+
+        assert check.results == {}
+
+    def test_mismatch_marks_bag_failed(self):
+        validate = ValidateFactory.create(last_verified_status='Passed')
+        verified = Validate.objects.get().last_verified
+        check = fixity.FixityCheck(validate.identifier, CHECKSUMS)
+        url = 'http://example.com/node/1/a.txt'
+        b''.join(check.stream(url, iter([b'abd'])))
+
+        assert check.failed == [url]
+        assert status(validate.identifier) == 'Failed'
+        assert Validate.objects.get().last_verified == verified
+
+    def test_single_match_leaves_status(self):
+        validate = ValidateFactory.create(last_verified_status='Unverified')
+        check = fixity.FixityCheck(validate.identifier, CHECKSUMS)
+        b''.join(check.stream('http://example.com/node/1/a.txt', iter([b'abc'])))
+
+        assert status(validate.identifier) == 'Unverified'
+
+    def test_whole_bag_match_leaves_status(self):
+        validate = ValidateFactory.create(last_verified_status='Unverified')
+        verified = Validate.objects.get().last_verified
+        check = fixity.FixityCheck(validate.identifier, CHECKSUMS)
+        for url, data in CONTENTS.items():
+            b''.join(check.wrap(url, iter([data])))
+        check.record()
+
+        assert status(validate.identifier) == 'Unverified'
+        assert Validate.objects.get().last_verified == verified
+
+
+@mock.patch.object(settings, 'CODA_VERIFY_DOWNLOADS', True)
+class TestVerifiedDownloads:
+    """
+    Tests for the fixity checks made by the download views.
+    """
+
+    @pytest.fixture(autouse=True)
+    def bag(self, monkeypatch):
+        self.bag = FullBagFactory.create()
+        self.validate = ValidateFactory.create(
+            identifier=self.bag.name, last_verified_status='Unverified')
+        node = NodeFactory.build(node_url='http://example.com/node/1')
+        files = [('a.txt', CHECKSUMS['http://example.com/node/1/a.txt'], 3),
+                 ('b.txt', CHECKSUMS['http://example.com/node/1/b.txt'], 5)]
+        monkeypatch.setattr(
+            'coda_mdstore.presentation.readBagFiles', mock.Mock(return_value=('', node, files)))
+        monkeypatch.setattr(
+            'coda_mdstore.presentation.nodeFileURL', lambda node, path: (
+                'http://example.com/node/1/' + path.rsplit('/', 1)[-1]))
+        self.contents = dict(CONTENTS)
+        monkeypatch.setattr(
+            'coda_mdstore.presentation.file_chunk_generator',
+            lambda url, localNodes=(), start=0: iter([self.contents[url][start:]]))
+
+    def test_tar_download_leaves_status(self, rf):
+        response = views.bagTarDownload(rf.get('/'), self.bag.name)
+        data = b''.join(response.streaming_content)
+
+        assert tarfile.open(fileobj=io.BytesIO(data)).getnames()
+        assert status(self.bag.name) == 'Unverified'
+
+    def test_zip_download_fails_on_mismatch(self, rf):
+        self.contents['http://example.com/node/1/b.txt'] = b'jello'
+        response = views.bagDownload(rf.get('/'), self.bag.name)
+        b''.join(response.streaming_content)
+
+        assert status(self.bag.name) == 'Failed'
+
+    def test_range_request_is_not_judged(self, rf):
+        response = views.bagDownload(rf.get('/', HTTP_RANGE='bytes=0-10'), self.bag.name)
+        b''.join(response.streaming_content)
+
+        assert status(self.bag.name) == 'Unverified'
+
+    def test_bag_proxy_fails_on_mismatch(self, rf, monkeypatch):
+        Bag_File.objects.create(
+            bag_name=self.bag, path='data/a.txt',
+            md5=CHECKSUMS['http://example.com/node/1/a.txt'])
+        handle = mock.Mock(status=200, url='http://example.com/node/1/a.txt')
+        handle.geturl.return_value = handle.url
+        handle.info.return_value = {'Content-Type': 'text/plain', 'Content-Length': '3'}
+        handle.readinto.side_effect = io.BytesIO(b'abd').readinto
+        monkeypatch.setattr('coda_mdstore.views.getFileHandle', mock.Mock(return_value=handle))
+
+        response = views.bagProxy(rf.get('/'), self.bag.name, 'data/a.txt')
+        assert b''.join(response.streaming_content) == b'abd'
+        assert status(self.bag.name) == 'Failed'
+
+    @pytest.mark.parametrize('view', [views.bagDownload, views.bagTarDownload])
+    def test_node_error_is_not_a_fixity_failure(self, view, rf, monkeypatch, caplog):
+        def get(url, **kwargs):
+            response = mock.Mock(status_code=200, raw=io.BytesIO(self.contents[url]))
+            if url.endswith('b.txt'):
+                response.status_code = 503
+            return response
+
+        monkeypatch.setattr('coda_mdstore.presentation.file_chunk_generator', file_chunk_generator)
+        monkeypatch.setattr('coda_mdstore.presentation.nodeSessions.get', get)
+        response = view(rf.get('/'), self.bag.name)
+        with pytest.raises(presentation.FileHandleError):
+            b''.join(response.streaming_content)
+
+        assert status(self.bag.name) == 'Unverified'
+        assert 'Unable to fetch http://example.com/node/1/b.txt' in caplog.text
@@ -0,0 +1,195 @@
+import time
+from unittest import mock
+
+import pytest
+import requests
+from django.conf import settings
+
+from coda_mdstore import factories, health, locations, presentation, views
+
+
+@pytest.fixture(autouse=True)
+def clear_health():
+    health._cache().clear()
+    locations.cache.clear()
+
+
+def node(name):
+    return factories.NodeFactory.build(node_name=name)
+
+
+class TestNodeHealth:
+    """
+    Tests for coda_mdstore.health.NodeHealth.
+    """
+
+    def test_starts_closed(self):
+        assert health.NodeHealth().state == 'closed'
+
+    def test_latency_is_averaged(self):
+        state = health.NodeHealth()
+        state.succeeded(1.0)
+        state.succeeded(2.0)
+        assert state.latency == pytest.approx(1.2)
+        assert state.latency_ms == 1200
+
+    @mock.patch.object(settings, 'CODA_NODE_FAILURE_THRESHOLD', 3)
+    def test_opens_after_failures_in_a_row(self):
+        state = health.NodeHealth()
+        state.failed('timed out')
+        state.failed('timed out')
+        state.succeeded(0.1)
+        state.failed('timed out')
+        state.failed('timed out')
+        assert state.state == 'closed'
+        state.failed('timed out')
+        assert state.state == 'open'
+        assert state.last_error == 'timed out'
+
+    @mock.patch.object(settings, 'CODA_NODE_CIRCUIT_RESET', 60)
+    def test_half_open_after_reset(self):
+        state = health.NodeHealth(opened=time.time() - 61)
+        assert state.state == 'half-open'
+
+    def test_failed_probe_keeps_circuit_open(self):
+        state = health.NodeHealth(opened=time.time() - 3600)
+        state.failed('refused')
+        assert state.state == 'open'
+
+    def test_success_closes_circuit(self):
+        state = health.NodeHealth(opened=time.time() - 3600, failures=5)
+        state.succeeded(0.1)
+        assert state.state == 'closed'
+        assert state.failures == 0
+
+
+class TestAvailable:
+    """
+    Tests for coda_mdstore.health.available.
+    """
+
+    def test_orders_by_latency(self):
+        slow, fast, new = node('slow'), node('fast'), node('new')
+        health.record_success(slow, 2.0)
+        health.record_success(fast, 0.1)
+
+        assert health.available([slow, fast, new]) == [new, fast, slow]
+
+    @mock.patch.object(settings, 'CODA_NODE_FAILURE_THRESHOLD', 1)
+    def test_leaves_out_open_circuits(self):
+        bad, good = node('bad'), node('good')
+        health.record_failure(bad, 'refused')
+
+        assert health.available([bad, good]) == [good]
+
+    @mock.patch.object(settings, 'CODA_NODE_FAILURE_THRESHOLD', 1)
+    def test_tries_every_node_when_all_are_open(self):
+        nodes = [node('a'), node('b')]
+        for each in nodes:
+            health.record_failure(each, 'refused')
+
+        assert health.available(nodes) == nodes
+
+    @mock.patch.object(settings, 'CODA_NODE_CIRCUIT_RESET', 60)
+    def test_lets_one_probe_through_half_open_circuit(self):
+        recovering, good = node('recovering'), node('good')
+        health._save(recovering, health.NodeHealth(opened=time.time() - 61))
+
+        assert recovering in health.available([recovering, good])
+        assert recovering not in health.available([recovering, good])
+
+
+class TestProbeNode:
+    """
+    Tests for coda_mdstore.presentation.probeNode.
+    """
+
+    @mock.patch('coda_mdstore.presentation.openNodeFile')
+    def test_records_success(self, mock_open):
+        each = node('a')
+        presentation.probeNode(each, 'bagit.txt', 5)
+
+        assert health.get(each).latency is not None
+        assert health.get(each).failures == 0
+
+    @mock.patch('coda_mdstore.presentation.openNodeFile')
+    def test_missing_file_is_not_a_failure(self, mock_open):
+        each = node('a')
+        mock_open.side_effect = presentation.FileHandleError('missing', status=404)
+        with pytest.raises(presentation.FileHandleError):
+            presentation.probeNode(each, 'bagit.txt', 5)
+
+        assert health.get(each).failures == 0
+
+    @mock.patch('coda_mdstore.presentation.openNodeFile')
+    def test_server_error_is_a_failure(self, mock_open):
+        each = node('a')
+        mock_open.side_effect = presentation.FileHandleError('broken', status=503)
+        with pytest.raises(presentation.FileHandleError):
+            presentation.probeNode(each, 'bagit.txt', 5)
+
+        assert health.get(each).failures == 1
+
+    @mock.patch('coda_mdstore.presentation.openNodeFile')
+    def test_timeout_is_a_failure(self, mock_open):
+        each = node('a')
+        mock_open.side_effect = requests.Timeout('timed out')
+        with pytest.raises(requests.Timeout):
+            presentation.probeNode(each, 'bagit.txt', 5)
+
+        assert health.get(each).last_error == 'timed out'
+
+
+@pytest.mark.django_db
+class TestGetFileHandleHealth:
+    """
+    Tests for the circuit breaker in coda_mdstore.presentation.getFileHandle.
+    """
+
+    @mock.patch.object(settings, 'CODA_NODE_FAILURE_THRESHOLD', 1)
+    @mock.patch('coda_mdstore.presentation.openNodeFile')
+    def test_skips_node_with_open_circuit(self, mock_open):
+        bad = factories.NodeFactory.create(status='1', node_url='http://bad.example.com')
+        factories.NodeFactory.create(status='1', node_url='http://good.example.com')
+        health.record_failure(bad, 'refused')
+
+        presentation.getFileHandle('ark:/67531/coda1s9ns', 'bagit.txt')
+        assert mock_open.call_count == 1
+        assert mock_open.call_args[0][0].startswith('http://good.example.com/')
+
+    @mock.patch.object(settings, 'CODA_NODE_FAILURE_THRESHOLD', 1)
+    @mock.patch('coda_mdstore.presentation.openNodeFile')
+    def test_keeps_location_of_node_with_open_circuit(self, mock_open):
+        bad = factories.NodeFactory.create(status='1')
+        locations.remember('ark:/67531/coda1s9ns', bad)
+        health.record_failure(bad, 'refused')
+        mock_open.side_effect = presentation.FileHandleError('missing', status=404)
+        factories.NodeFactory.create(status='1')
+
+        with pytest.raises(presentation.FileHandleError) as exc:
+            presentation.getFileHandle('ark:/67531/coda1s9ns', 'bagit.txt')
+        assert 'missing' in str(exc.value)
+        assert locations.lookup('ark:/67531/coda1s9ns') == bad.pk
+
+
+@pytest.mark.django_db
+class TestNodeStatusHealth:
+    """
+    Tests for the node health shown by coda_mdstore.views.showNodeStatus.
+    """
+
+    @mock.patch.object(settings, 'CODA_NODE_FAILURE_THRESHOLD', 1)
+    def test_single_node_shows_circuit(self, rf):
+        each = factories.NodeFactory.create()
+        health.record_failure(each, 'connection refused')
+
+        response = views.showNodeStatus(rf.get('/'), each.node_name)
+        assert b'connection refused' in response.content
+        assert b'>open<' in response.content
+
+    def test_node_list_shows_latency(self, rf):
+        each = factories.NodeFactory.create()
+        health.record_success(each, 0.25)
+
+        response = views.showNodeStatus(rf.get('/'))
+        assert b'250 ms' in response.content
@@ -0,0 +1,93 @@
+from unittest import mock
+
+import pytest
+from django.conf import settings
+
+from coda_mdstore import factories, locations, models
+
+
+@pytest.fixture(autouse=True)
+def clear_location_cache():
+    locations.cache.clear()
+
+
+class TestLocationCache:
+    """
+    Tests for coda_mdstore.locations.LocationCache.
+    """
+
+    @mock.patch.object(settings, 'CODA_LOCATION_CACHE_SIZE', 1)
+    def test_size_follows_setting(self):
+        cache = locations.LocationCache()
+        cache.set('ark:/00001/id1', 1)
+        cache.set('ark:/00001/id2', 2)
+
+        assert len(cache) == 1
+
+    def test_discard_node(self):
+        cache = locations.LocationCache()
+        cache.set('ark:/00001/id1', 1)
+        cache.set('ark:/00001/id2', 2)
+        cache.set('ark:/00001/id3', 1)
+        cache.discard_node(1)
+
+        assert len(cache) == 1
+        assert cache.get('ark:/00001/id2') == 2
+
+
+@pytest.mark.django_db
+class TestLocations:
+    """
+    Tests for the coda_mdstore.locations lookup functions.
+    """
+
+    def test_lookup_missing_bag(self):
+        assert locations.lookup('ark:/00001/id1') is None
+
+    def test_lookup_reads_table(self):
+        node = factories.NodeFactory.create(status='1')
+        models.Bag_Location.objects.create(bag_name='ark:/00001/id1', node=node)
+
+        assert locations.lookup('ark:/00001/id1') == node.pk
+        assert locations.cache.get('ark:/00001/id1') == node.pk
+
+    def test_remember_stores_location(self):
+        node = factories.NodeFactory.create(status='1')
+        locations.remember('ark:/00001/id1', node)
+
+        assert models.Bag_Location.objects.get(bag_name='ark:/00001/id1').node == node
+        assert locations.cache.get('ark:/00001/id1') == node.pk
+
+    def test_remember_replaces_location(self):
+        old_node, new_node = factories.NodeFactory.create_batch(2, status='1')
+        locations.remember('ark:/00001/id1', old_node)
+        locations.remember('ark:/00001/id1', new_node)
+
+        assert models.Bag_Location.objects.get(bag_name='ark:/00001/id1').node == new_node
+
+    def test_forget(self):
+        node = factories.NodeFactory.create(status='1')
+        locations.remember('ark:/00001/id1', node)
+        locations.forget('ark:/00001/id1')
+
+        assert not models.Bag_Location.objects.exists()
+        assert locations.lookup('ark:/00001/id1') is None
+
+    def test_deactivating_node_drops_locations(self):
+        node = factories.NodeFactory.create(status='1')
+        locations.remember('ark:/00001/id1', node)
+
+        node.status = '0'
+        node.save()
+
+        assert not models.Bag_Location.objects.exists()
+        assert locations.cache.get('ark:/00001/id1') is None
+
+    def test_deleting_node_drops_locations(self):
+        node = factories.NodeFactory.create(status='1')
+        locations.remember('ark:/00001/id1', node)
+
+        node.delete()
+
+        assert not models.Bag_Location.objects.exists()
+        assert locations.cache.get('ark:/00001/id1') is None
@@ -0,0 +1,49 @@
+from unittest import mock
+
+from django.conf import settings
+
+from coda_mdstore import lru
+
+
+class TestLRUCache:
+    """
+    Tests for coda_mdstore.lru.LRUCache.
+    """
+
+    def test_get_returns_none_when_missing(self):
+        cache = lru.LRUCache(10)
+        assert cache.get('ark:/00001/id1') is None
+
+    def test_set_and_get(self):
+        cache = lru.LRUCache(10)
+        cache.set('ark:/00001/id1', 3)
+        assert cache.get('ark:/00001/id1') == 3
+
+    def test_evicts_least_recently_used(self):
+        cache = lru.LRUCache(maxsize=2)
+        cache.set('ark:/00001/id1', 1)
+        cache.set('ark:/00001/id2', 2)
+        # Touch the first entry so the second one is the oldest.
+        cache.get('ark:/00001/id1')
+        cache.set('ark:/00001/id3', 3)
+
+        assert len(cache) == 2
+        assert cache.get('ark:/00001/id1') == 1
+        assert cache.get('ark:/00001/id2') is None
+
+    def test_discard(self):
+        cache = lru.LRUCache(10)
+        cache.set('ark:/00001/id1', 1)
+        cache.discard('ark:/00001/id1')
+        cache.discard('ark:/00001/id2')
+
+        assert len(cache) == 0
+
+    @mock.patch.object(settings, 'CODA_FILE_LIST_CACHE_SIZE', 1)
+    def test_size_from_setting(self):
+        cache = lru.LRUCache(setting='CODA_FILE_LIST_CACHE_SIZE')
+        cache.set('ark:/00001/id1', 1)
+        cache.set('ark:/00001/id2', 2)
+
+        assert len(cache) == 1
+        assert cache.get('ark:/00001/id2') == 2
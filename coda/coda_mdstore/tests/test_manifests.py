@@ -0,0 +1,218 @@
+from unittest import mock
+
+import pytest
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from coda_mdstore import factories, locations, manifests, models, presentation
+
+pytestmark = pytest.mark.django_db
+
+FILES = [
+    ('data/file01.txt', '192e635b17a9c2aea6181f0f87cab05d', None),
+    ('data/file02.txt', '18b7c500ef8bacf7b2151f83d28e7ca1', 12),
+    ('bagit.txt', '', None),
+]
+
+
+@pytest.fixture(autouse=True)
+def clear_location_cache():
+    locations.cache.clear()
+
+
+class TestManifests:
+    """
+    Tests for the coda_mdstore.manifests index functions.
+    """
+
+    def test_lookup_missing_bag(self):
+        bag = factories.BagFactory.create()
+        assert manifests.lookup(bag.name) is None
+
+    def test_remember_and_lookup(self):
+        bag = factories.BagFactory.create()
+        manifests.remember(bag.name, FILES)
+
+        assert manifests.lookup(bag.name) == FILES
+
+    def test_remember_replaces_index(self):
+        bag = factories.BagFactory.create()
+        manifests.remember(bag.name, FILES)
+        manifests.remember(bag.name, FILES[2:])
+
+        assert manifests.lookup(bag.name) == FILES[2:]
+
+    def test_remember_skips_unknown_bag(self):
+        manifests.remember('ark:/00001/missing', FILES)
+        assert not models.Bag_File.objects.exists()
+
+    def test_remember_sizes(self):
+        bag = factories.BagFactory.create()
+        manifests.remember(bag.name, FILES)
+        manifests.remember_sizes(bag.name, {'data/file01.txt': 3, 'bagit.txt': 4})
+
+        assert [size for path, md5, size in manifests.lookup(bag.name)] == [3, 12, 4]
+
+    def test_crcs(self):
+        bag = factories.BagFactory.create()
+        manifests.remember(bag.name, FILES)
+        manifests.remember_crcs(bag.name, {'bagit.txt': 0xFFFFFFFF, 'missing.txt': 1})
+
+        assert manifests.crcs(bag.name) == {'bagit.txt': 0xFFFFFFFF}
+
+    def test_member_crcs(self):
+        bag = factories.BagFactory.create()
+        manifests.remember(bag.name, FILES)
+        store = manifests.MemberCRCs(bag.name, 'coda1/')
+        store.remember({'coda1/data/file01.txt': 5, 'other/bagit.txt': 6})
+
+        assert store.lookup() == {'coda1/data/file01.txt': 5}
+
+    def test_checksum(self):
+        bag = factories.BagFactory.create()
+        manifests.remember(bag.name, FILES)
+
+        assert manifests.checksum(bag.name, 'data/file02.txt') == FILES[1][1]
+        assert manifests.checksum(bag.name, 'bagit.txt') is None
+        assert manifests.checksum(bag.name, 'data/missing.txt') is None
+
+    def test_checksum_looks_up_path_hash(self):
+        bag = factories.BagFactory.create()
+        manifests.remember(bag.name, FILES)
+        row = models.Bag_File.objects.get(path='data/file02.txt')
+
+        assert row.path_hash == models.Bag_File.hash_path('data/file02.txt')
+        with CaptureQueriesContext(connection) as queries:
+            manifests.checksum(bag.name, 'data/file02.txt')
+        assert row.path_hash in queries[0]['sql']
+
+    def test_saved_file_has_path_hash(self):
+        bag = factories.BagFactory.create()
+        models.Bag_File.objects.create(bag_name=bag, path='data/a.txt', md5='abc')
+
+        assert manifests.checksum(bag.name, 'data/a.txt') == 'abc'
+
+    def test_forget(self):
+        bag = factories.BagFactory.create()
+        manifests.remember(bag.name, FILES)
+        manifests.forget(bag.name)
+
+        assert manifests.lookup(bag.name) is None
+
+    def test_index_goes_with_bag(self):
+        bag = factories.BagFactory.create()
+        manifests.remember(bag.name, FILES)
+        bag.delete()
+
+        assert not models.Bag_File.objects.exists()
+
+
+class TestReadBagFiles:
+    """
+    Tests for coda_mdstore.presentation.readBagFiles.
+    """
+
+    @pytest.fixture
+    def handles(self):
+        manifest = mock.Mock(url='https://coda/testurl/manifest-md5.txt')
+        manifest.readline.side_effect = [
+            b'192E635B17A9C2AEA6181F0F87CAB05D  data/file01.txt\n',
+            b'18b7c500ef8bacf7b2151f83d28e7ca1  data/file02.txt\n',
+            b'',
+        ]
+        with mock.patch('coda_mdstore.presentation.getFileHandle') as getFileHandle, \
+                mock.patch('coda_mdstore.presentation.iterFileLinks') as iterFileLinks:
+            getFileHandle.side_effect = [manifest, mock.Mock()]
+            iterFileLinks.return_value = ['bagit.txt']
+            yield getFileHandle
+
+    def test_indexes_manifest_when_first_read(self, handles):
+        bag = factories.BagFactory.create()
+        bag_root, node, files = presentation.readBagFiles(bag.name)
+
+        assert bag_root == 'https://coda/testurl'
+        assert files == [
+            ('data/file01.txt', '192e635b17a9c2aea6181f0f87cab05d', None),
+            ('data/file02.txt', '18b7c500ef8bacf7b2151f83d28e7ca1', None),
+            ('bagit.txt', '', None),
+        ]
+        assert manifests.lookup(bag.name) == files
+
+    def test_reads_index_without_reading_manifest(self, handles):
+        bag = factories.BagFactory.create()
+        node = factories.NodeFactory.create(status='1', node_url='http://example.com/node/1')
+        locations.remember(bag.name, node)
+        manifests.remember(bag.name, FILES)
+
+        bag_root, found, files = presentation.readBagFiles(bag.name)
+
+        assert files == FILES
+        assert found == node
+        assert bag_root == presentation.nodeFileURL(
+            node, presentation.bagFilePath(bag.name, '')).rstrip('/')
+        assert not handles.called
+
+    def test_bag_members_stores_sizes(self):
+        bag = factories.BagFactory.create()
+        node = factories.NodeFactory.create(status='1', node_url='http://example.com/node/1')
+        locations.remember(bag.name, node)
+        manifests.remember(bag.name, FILES)
+
+        with mock.patch('coda_mdstore.presentation.nodeFileSizes') as nodeFileSizes:
+            nodeFileSizes.return_value = [3, 4]
+            members = presentation.bagMembers(bag.name, 'id', probe=True)
+            assert [size for name, url, size in members] == [3, 12, 4]
+            assert nodeFileSizes.call_args[0][1] == [
+                presentation.bagFilePath(bag.name, 'data/file01.txt'),
+                presentation.bagFilePath(bag.name, 'bagit.txt'),
+            ]
+
+            nodeFileSizes.reset_mock()
+            presentation.bagMembers(bag.name, 'id')
+            assert not nodeFileSizes.called
+
+    @mock.patch('coda_mdstore.presentation.nodeFileSizes')
+    def test_bag_members_does_not_probe_for_sizes(self, nodeFileSizes):
+        bag = factories.BagFactory.create()
+        node = factories.NodeFactory.create(status='1', node_url='http://example.com/node/1')
+        locations.remember(bag.name, node)
+        manifests.remember(bag.name, FILES)
+
+        assert presentation.bagMembers(bag.name, 'id') is None
+        assert not nodeFileSizes.called
+
+
+class TestIndexBagFilesCommand:
+    """
+    Tests for the index_bag_files management command.
+    """
+
+    @mock.patch('coda_mdstore.presentation.readBagFiles')
+    def test_indexes_bags_not_yet_indexed(self, mock_read):
+        indexed, unindexed = factories.BagFactory.create_batch(2)
+        manifests.remember(indexed.name, FILES)
+        mock_read.return_value = ('', None, FILES)
+
+        call_command('index_bag_files', stdout=mock.Mock())
+        mock_read.assert_called_once_with(unindexed.name)
+
+    @mock.patch('coda_mdstore.presentation.readBagFiles')
+    def test_refresh(self, mock_read):
+        bag = factories.BagFactory.create()
+        manifests.remember(bag.name, FILES)
+        mock_read.return_value = ('', None, FILES)
+
+        call_command('index_bag_files', bag.name, refresh=True, stdout=mock.Mock())
+        mock_read.assert_called_once_with(bag.name)
+        assert manifests.lookup(bag.name) is None
+
+    @mock.patch('coda_mdstore.presentation.readBagFiles')
+    def test_reports_unreadable_bags(self, mock_read, capsys):
+        factories.BagFactory.create()
+        mock_read.side_effect = presentation.FileHandleError()
+
+        call_command('index_bag_files')
+        out, err = capsys.readouterr()
+        assert 'Indexed 0 bags, 1 failed.' in out
+        assert 'Unable to read the manifest' in err
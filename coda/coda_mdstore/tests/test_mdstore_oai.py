@@ -1,5 +1,7 @@
 from datetime import datetime
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from lxml import etree
 from oaipmh import common, error
 import pytest
@@ -93,6 +95,22 @@ class TestOAIInterface:
         assert len(records) == 10
         assert all(map(lambda r: len(r) == 3, records))
 
+    def test_listRecords_queries_do_not_grow_with_bags(self):
+        """Test listRecords and the coda_bag writer read the Bag_Info of
+        a page of bags at once."""
+        factories.FullBagFactory.create_batch(30)
+        md = oai.OAIInterface()
+
+        def list_records(batch_size):
+            with CaptureQueriesContext(connection) as queries:
+                for header, metadata, about in md.listRecords(
+                    CODA_BAG, batch_size=batch_size
+                ):
+                    oai.coda_bag_writer(etree.Element('root'), metadata)
+            return len(queries)
+
+        assert list_records(20) == list_records(2)
+
     def test_makeList_raises_CannotDisseminateFormatError(self):
         """Test makeList will raise a CannotDisseminateFormatError
         when given an invalid prefix.
@@ -0,0 +1,123 @@
+from unittest import mock
+
+import pytest
+from django.conf import settings
+
+from coda_mdstore import factories, offload, presentation
+
+
+class TestGetBackend:
+    """
+    Tests for coda_mdstore.offload.get_backend.
+    """
+
+    @mock.patch.object(settings, 'REPROXY', False)
+    @mock.patch.object(settings, 'CODA_OFFLOAD', None)
+    def test_default_offloads_nothing(self):
+        backend = offload.get_backend()
+        assert type(backend) is offload.Offload
+        assert backend.serve(mock.Mock(), 'text/plain') is None
+        assert backend.serve_bag('ark:/67531/coda1', 'coda1') is None
+
+    @mock.patch.object(settings, 'REPROXY', True)
+    @mock.patch.object(settings, 'CODA_OFFLOAD', None)
+    def test_reproxy_setting(self):
+        assert isinstance(offload.get_backend(), offload.ReproxyOffload)
+
+    @mock.patch.object(settings, 'CODA_OFFLOAD', 'sendfile')
+    def test_named_backend(self):
+        assert isinstance(offload.get_backend(), offload.SendfileOffload)
+
+    @mock.patch.object(settings, 'CODA_OFFLOAD', 'coda_mdstore.offload.AccelRedirectOffload')
+    def test_dotted_path(self):
+        assert isinstance(offload.get_backend(), offload.AccelRedirectOffload)
+
+
+class TestReproxyOffload:
+    """
+    Tests for coda_mdstore.offload.ReproxyOffload.
+    """
+
+    def handle(self, headers):
+        handle = mock.Mock(spec=presentation.NodeFileHandle)
+        handle.geturl.return_value = 'http://example.com/bagit.txt'
+        handle.info.return_value = headers
+        return handle
+
+    def test_etag_is_stable(self):
+        handle = self.handle({'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT'})
+        first = offload.ReproxyOffload().serve(handle, 'text/plain')
+        second = offload.ReproxyOffload().serve(handle, 'text/plain')
+
+        assert first['X-REPROXY-URL'] == 'http://example.com/bagit.txt'
+        assert first['ETag'] == second['ETag'] == presentation.fileETag(handle)
+
+    def test_no_etag_without_validators(self):
+        response = offload.ReproxyOffload().serve(self.handle({}), 'text/plain')
+        assert 'ETag' not in response
+
+
+class TestSendfileOffload:
+    """
+    Tests for coda_mdstore.offload.SendfileOffload.
+    """
+
+    def test_serves_local_file(self, tmp_path):
+        path = tmp_path / 'bagit.txt'
+        path.write_bytes(b'')
+        handle = presentation.LocalFileHandle(str(path), 'http://example.com/bagit.txt')
+        response = offload.SendfileOffload().serve(handle, 'text/plain')
+
+        assert response['X-Sendfile'] == str(path)
+
+    def test_leaves_remote_file_to_django(self):
+        handle = mock.Mock(spec=presentation.NodeFileHandle)
+        assert offload.SendfileOffload().serve(handle, 'text/plain') is None
+
+
+class TestAccelRedirectOffload:
+    """
+    Tests for coda_mdstore.offload.AccelRedirectOffload.
+    """
+
+    @pytest.fixture
+    def node(self):
+        return factories.NodeFactory.build(
+            node_name='coda-1', node_url='http://example.com/node/1')
+
+    def test_serve(self, node):
+        handle = mock.Mock(node=node)
+        handle.geturl.return_value = 'http://example.com/node/1/store/pairtree_root/a%20b.txt'
+        response = offload.AccelRedirectOffload('/internal/').serve(handle, 'text/plain')
+
+        assert response['X-Accel-Redirect'] == '/internal/coda-1/store/pairtree_root/a%20b.txt'
+
+    def test_serve_without_node(self):
+        handle = mock.Mock(node=None)
+        assert offload.AccelRedirectOffload().serve(handle, 'text/plain') is None
+
+    @pytest.mark.django_db
+    @mock.patch('coda_mdstore.presentation.nodeFileSizes')
+    @mock.patch('coda_mdstore.presentation.readBagFiles')
+    def test_serve_bag(self, mock_list, mock_sizes, node):
+        mock_list.return_value = (
+            '', node, [('data/file 01.txt', 'abc', None), ('bagit.txt', '', None)])
+        mock_sizes.return_value = [10, 20]
+        response = offload.AccelRedirectOffload().serve_bag('ark:/67531/coda1s9ns', 'coda1s9ns')
+
+        assert response['X-Archive-Files'] == 'zip'
+        assert response.content.decode().splitlines() == [
+            '- 10 /_node/coda-1/store/pairtree_root/co/da/1s/9n/s/coda1s9ns/data/file%2001.txt '
+            'coda1s9ns/data/file 01.txt',
+            '- 20 /_node/coda-1/store/pairtree_root/co/da/1s/9n/s/coda1s9ns/bagit.txt '
+            'coda1s9ns/bagit.txt',
+        ]
+
+    @mock.patch('coda_mdstore.presentation.nodeFileSizes')
+    @mock.patch('coda_mdstore.presentation.readBagFiles')
+    def test_serve_bag_without_sizes(self, mock_list, mock_sizes, node):
+        mock_list.return_value = ('', node, [('bagit.txt', '', None)])
+        mock_sizes.return_value = None
+        backend = offload.AccelRedirectOffload()
+
+        assert backend.serve_bag('ark:/67531/coda1s9ns', 'coda1s9ns') is None
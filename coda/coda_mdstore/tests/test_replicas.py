@@ -0,0 +1,275 @@
+from unittest import mock
+
+import pytest
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+
+from coda_mdstore import factories, health, locations, models, presentation, replicas
+from coda_replication.factories import QueueEntryFactory
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    health._cache().clear()
+    locations.cache.clear()
+    cache.delete(replicas.UNDER_REPLICATED_KEY)
+
+
+def found_on(*nodes):
+    """
+    Return an openNodeFile stand-in that finds files only on the nodes given
+    """
+
+    def urlopen(url, timeout=None, headers=None):
+        if any(url.startswith(node.node_url + '/') for node in nodes):
+            return mock.Mock()
+        raise presentation.FileHandleError('Not Found', status=404)
+    return urlopen
+
+
+class TestReplicas:
+    """
+    Tests for the coda_mdstore.replicas functions.
+    """
+
+    def test_record_and_nodes(self):
+        bag = factories.BagFactory.create()
+        holder, missing = factories.NodeFactory.create_batch(2, status='1')
+        replicas.record(bag.name, {holder: True, missing: False})
+
+        assert replicas.nodes(bag.name) == {holder.pk}
+        assert models.Bag_Replica.objects.get(node=missing).status == replicas.MISSING
+
+    def test_record_updates_existing_rows(self):
+        bag = factories.BagFactory.create()
+        node = factories.NodeFactory.create(status='1')
+        replicas.record(bag.name, {node: True})
+        replicas.record(bag.name, {node: False})
+
+        assert models.Bag_Replica.objects.count() == 1
+        assert replicas.nodes(bag.name) == set()
+
+    def test_record_skips_unknown_bags(self):
+        node = factories.NodeFactory.create(status='1')
+        replicas.record('ark:/00001/unknown', {node: True})
+
+        assert not models.Bag_Replica.objects.exists()
+
+    def test_counts(self):
+        bags = factories.BagFactory.create_batch(3)
+        first, second = factories.NodeFactory.create_batch(2, status='1')
+        for bag in bags:
+            replicas.record(bag.name, {first: True, second: bag is bags[0]})
+
+        assert replicas.counts() == {first.pk: 3, second.pk: 1}
+        assert replicas.counts([second]) == {second.pk: 1}
+
+    def test_under_replicated(self):
+        single, double, none = factories.BagFactory.create_batch(3)
+        first, second = factories.NodeFactory.create_batch(2, status='1')
+        inactive = factories.NodeFactory.create(status='0')
+        replicas.record(single.name, {first: True, second: False, inactive: True})
+        replicas.record(double.name, {first: True, second: True})
+
+        bags = replicas.under_replicated(2)
+        assert [(bag.name, bag.copies) for bag in bags] == [(none.name, 0), (single.name, 1)]
+
+    @mock.patch.object(settings, 'CODA_REPLICA_COUNT', 1)
+    def test_under_replicated_count_is_cached(self):
+        single, none = factories.BagFactory.create_batch(2)
+        node = factories.NodeFactory.create(status='1')
+        replicas.record(single.name, {node: True})
+
+        assert replicas.under_replicated_count() == 1
+        replicas.record(none.name, {node: True})
+        assert replicas.under_replicated_count() == 1
+
+        cache.delete(replicas.UNDER_REPLICATED_KEY)
+        assert replicas.under_replicated_count() == 0
+
+    @mock.patch('coda_mdstore.presentation.openNodeFile')
+    def test_replication_completed(self, mock_urlopen):
+        bag = factories.BagFactory.create()
+        holder, other = factories.NodeFactory.create_batch(2, status='1')
+        locations.remember(bag.name, holder)
+        entry = QueueEntryFactory.create(ark=bag.name, status='2')
+        assert not models.Bag_Replica.objects.exists()
+
+        entry.status = '3'
+        entry.save()
+        assert replicas.nodes(bag.name) == {holder.pk}
+        assert not models.Bag_Replica.objects.filter(node=other).exists()
+        assert not mock_urlopen.called
+
+    def test_replication_completed_before_ingest(self):
+        node = factories.NodeFactory.create(status='1')
+        locations.cache.set('ark:/00001/unknown', node.pk)
+        QueueEntryFactory.create(ark='ark:/00001/unknown', status='3')
+
+        assert not models.Bag_Replica.objects.exists()
+
+
+class TestRecordKnownReplicas:
+    """
+    Tests for coda_mdstore.presentation.recordKnownReplicas.
+    """
+
+    @mock.patch('coda_mdstore.presentation.openNodeFile')
+    def test_does_not_probe_remote_nodes(self, mock_urlopen):
+        bag = factories.BagFactory.create()
+        factories.NodeFactory.create(status='1')
+
+        presentation.recordKnownReplicas(bag.name)
+        assert not mock_urlopen.called
+        assert not models.Bag_Replica.objects.exists()
+
+    def test_mounted_node(self, tmp_path):
+        bag = factories.BagFactory.create(name='ark:/67531/coda1s9ns')
+        bag_dir = tmp_path / 'store/pairtree_root/co/da/1s/9n/s/coda1s9ns'
+        bag_dir.mkdir(parents=True)
+        (bag_dir / 'bagit.txt').write_text('BagIt-Version: 0.96\n')
+        holder = factories.NodeFactory.create(
+            status='1', access_mode='local', node_path=str(tmp_path))
+        (tmp_path / 'empty/store/pairtree_root').mkdir(parents=True)
+        missing = factories.NodeFactory.create(
+            status='1', access_mode='local', node_path=str(tmp_path / 'empty'))
+
+        presentation.recordKnownReplicas(bag.name)
+        assert replicas.nodes(bag.name) == {holder.pk}
+        assert models.Bag_Replica.objects.get(node=missing).status == replicas.MISSING
+
+
+class TestLocateReplicas:
+    """
+    Tests for coda_mdstore.presentation.locateReplicas.
+    """
+
+    @mock.patch('coda_mdstore.presentation.openNodeFile')
+    def test_records_each_node(self, mock_urlopen):
+        bag = factories.BagFactory.create()
+        holder, missing = factories.NodeFactory.create_batch(2, status='1')
+        factories.NodeFactory.create(status='0')
+        mock_urlopen.side_effect = found_on(holder)
+
+        assert presentation.locateReplicas(bag.name) == [holder]
+        assert mock_urlopen.call_count == 2
+        assert dict(
+            models.Bag_Replica.objects.values_list('node_id', 'status')
+        ) == {holder.pk: replicas.PRESENT, missing.pk: replicas.MISSING}
+
+    @mock.patch('coda_mdstore.presentation.openNodeFile')
+    def test_unreachable_node_is_left_alone(self, mock_urlopen):
+        bag = factories.BagFactory.create()
+        node = factories.NodeFactory.create(status='1')
+        replicas.record(bag.name, {node: True})
+        mock_urlopen.side_effect = presentation.FileHandleError('Bad Gateway', status=502)
+
+        assert presentation.locateReplicas(bag.name) == []
+        assert replicas.nodes(bag.name) == {node.pk}
+
+    def test_mounted_node(self, tmp_path):
+        bag = factories.BagFactory.create(name='ark:/67531/coda1s9ns')
+        bag_dir = tmp_path / 'store/pairtree_root/co/da/1s/9n/s/coda1s9ns'
+        bag_dir.mkdir(parents=True)
+        (bag_dir / 'bagit.txt').write_text('BagIt-Version: 0.96\n')
+        node = factories.NodeFactory.create(
+            status='1', access_mode='local', node_path=str(tmp_path))
+
+        assert presentation.locateReplicas(bag.name) == [node]
+
+
+class TestGetFileHandleReplicas:
+    """
+    Tests for the use of coda_mdstore.replicas by
+    coda_mdstore.presentation.getFileHandle.
+    """
+
+    @mock.patch('coda_mdstore.presentation.openNodeFile')
+    def test_probes_replica_nodes_first(self, mock_urlopen):
+        bag = factories.BagFactory.create()
+        factories.NodeFactory.create_batch(3, status='1')
+        holder = factories.NodeFactory.create(status='1')
+        replicas.record(bag.name, {holder: True})
+        mock_urlopen.side_effect = found_on(holder)
+
+        handle = presentation.getFileHandle(bag.name, 'bagit.txt')
+        assert handle.node == holder
+        assert mock_urlopen.call_count == 1
+        assert locations.lookup(bag.name) == holder.pk
+
+    @mock.patch('coda_mdstore.presentation.openNodeFile')
+    def test_falls_back_to_other_nodes(self, mock_urlopen):
+        bag = factories.BagFactory.create()
+        stale, holder = factories.NodeFactory.create_batch(2, status='1')
+        replicas.record(bag.name, {stale: True})
+        mock_urlopen.side_effect = found_on(holder)
+
+        handle = presentation.getFileHandle(bag.name, 'bagit.txt')
+        assert handle.node == holder
+        assert replicas.nodes(bag.name) == {stale.pk, holder.pk}
+
+
+class TestCrawlReplicasCommand:
+    """
+    Tests for the crawl_replicas management command.
+    """
+
+    @mock.patch('coda_mdstore.presentation.openNodeFile')
+    def test_crawls_every_bag(self, mock_urlopen, capsys):
+        found, lost = factories.BagFactory.create_batch(2)
+        node = factories.NodeFactory.create(status='1')
+
+        def urlopen(url, timeout=None, headers=None):
+            if found.name.split('/')[-1] in url:
+                return mock.Mock()
+            raise presentation.FileHandleError('Not Found', status=404)
+        mock_urlopen.side_effect = urlopen
+
+        call_command('crawl_replicas')
+        out, err = capsys.readouterr()
+        assert 'Checked 2 bags, 1 not found.' in out
+        assert lost.name in err
+        assert replicas.nodes(found.name) == {node.pk}
+
+    @mock.patch('coda_mdstore.presentation.locateReplicas')
+    def test_stale(self, mock_locate):
+        checked, unchecked = factories.BagFactory.create_batch(2)
+        node = factories.NodeFactory.create(status='1')
+        replicas.record(checked.name, {node: True})
+        mock_locate.return_value = [node]
+
+        call_command('crawl_replicas', stale=1, stdout=mock.Mock())
+        mock_locate.assert_called_once_with(unchecked.name, [node])
+
+
+class TestReplicaReportCommand:
+    """
+    Tests for the replica_report management command.
+    """
+
+    def test_lists_under_replicated_bags(self, capsys):
+        single, double = factories.BagFactory.create_batch(2)
+        first, second = factories.NodeFactory.create_batch(2, status='1')
+        replicas.record(single.name, {first: True})
+        replicas.record(double.name, {first: True, second: True})
+
+        call_command('replica_report', copies=2)
+        out, err = capsys.readouterr()
+        assert '%s\t1' % single.name in out
+        assert double.name not in out
+        assert '1 bags with fewer than 2 copies.' in out
+
+    @mock.patch.object(settings, 'CODA_REPLICA_COUNT', 2)
+    def test_stores_count_for_status_page(self):
+        bag = factories.BagFactory.create()
+        replicas.remember_under_replicated(5)
+
+        call_command('replica_report', copies=3, stdout=mock.Mock())
+        assert replicas.under_replicated_count() == 5
+        call_command('replica_report', stdout=mock.Mock())
+        assert replicas.under_replicated_count() == 1
+        bag.delete()
+        assert replicas.under_replicated_count() == 1
@@ -0,0 +1,175 @@
+import io
+import zipfile
+import zlib
+from unittest import mock
+
+import pytest
+
+from coda_mdstore import presentation, storedzip
+
+FILES = {
+    'http://example.com/node/1/a.txt': b'hello world\n' * 10,
+    'http://example.com/node/1/empty.txt': b'',
+    'http://example.com/node/1/b.bin': bytes(range(256)) * 3,
+}
+MEMBERS = [
+    ('coda1/data/a.txt', 'http://example.com/node/1/a.txt', 120),
+    ('coda1/data/empty.txt', 'http://example.com/node/1/empty.txt', 0),
+    ('coda1/data/bé.bin', 'http://example.com/node/1/b.bin', 768),
+]
+
+
+def fake_chunks(url, localNodes=(), start=0):
+    data = FILES[url][start:]
+    for i in range(0, len(data), 50):
+        yield data[i:i + 50]
+
+
+class FakeStore(object):
+
+    def __init__(self, crcs=None):
+        self.crcs = dict(crcs or {})
+        self.remembered = []
+
+    def lookup(self):
+        return dict(self.crcs)
+
+    def remember(self, found):
+        self.remembered.append(dict(found))
+        self.crcs.update(found)
+
+
+@pytest.fixture(autouse=True)
+def fake_nodes():
+    with mock.patch(
+        'coda_mdstore.presentation.file_chunk_generator', side_effect=fake_chunks
+    ) as fetch:
+        yield fetch
+
+
+def read_zip(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        return dict((name, archive.read(name)) for name in archive.namelist())
+
+
+class TestStoredZip:
+    """
+    Tests for coda_mdstore.storedzip.StoredZip.
+    """
+
+    def test_streams_valid_zip_of_known_length(self):
+        archive = storedzip.StoredZip(MEMBERS, mtime=1445412480)
+        data = b''.join(archive)
+
+        assert len(data) == len(archive)
+        assert read_zip(data) == {
+            'coda1/data/a.txt': FILES['http://example.com/node/1/a.txt'],
+            'coda1/data/empty.txt': b'',
+            'coda1/data/bé.bin': FILES['http://example.com/node/1/b.bin'],
+        }
+
+    def test_entries_have_modification_date(self):
+        archive = storedzip.StoredZip(MEMBERS, mtime=1445412480)
+        with zipfile.ZipFile(io.BytesIO(b''.join(archive))) as zipped:
+            assert zipped.getinfo('coda1/data/a.txt').date_time == (2015, 10, 21, 7, 28, 0)
+
+    def test_ranges_join_up_to_whole_archive(self):
+        whole = b''.join(storedzip.StoredZip(MEMBERS))
+        for split in range(1, len(whole), 7):
+            archive = storedzip.StoredZip(MEMBERS)
+            head = b''.join(archive.stream(0, split - 1))
+            archive = storedzip.StoredZip(MEMBERS)
+            tail = b''.join(archive.stream(split))
+            assert head + tail == whole, split
+
+    def test_range_within_archive(self):
+        whole = b''.join(storedzip.StoredZip(MEMBERS))
+        archive = storedzip.StoredZip(MEMBERS)
+        assert b''.join(archive.stream(100, 400)) == whole[100:401]
+
+    def test_stores_crcs_of_files_streamed_whole(self):
+        store = FakeStore()
+        b''.join(storedzip.StoredZip(MEMBERS, crcs=store))
+
+        assert store.remembered == [{
+            'coda1/data/a.txt': zlib.crc32(FILES['http://example.com/node/1/a.txt']),
+            'coda1/data/bé.bin': zlib.crc32(FILES['http://example.com/node/1/b.bin']),
+        }]
+
+    def test_stored_crcs_are_not_stored_again(self):
+        store = FakeStore()
+        b''.join(storedzip.StoredZip(MEMBERS, crcs=store))
+        b''.join(storedzip.StoredZip(MEMBERS, crcs=store))
+
+        assert len(store.remembered) == 1
+
+    def test_resume_fetches_file_from_offset_when_crc_is_stored(self, fake_nodes):
+        store = FakeStore()
+        archive = storedzip.StoredZip(MEMBERS, crcs=store)
+        b''.join(archive)
+        entry = archive.entries[2]
+        fake_nodes.reset_mock()
+
+        resumed = storedzip.StoredZip(MEMBERS, crcs=store)
+        assert resumed.canResume(entry.data_offset + 100, len(resumed) - 1)
+        b''.join(resumed.stream(entry.data_offset + 100))
+        assert fake_nodes.call_args_list == [
+            mock.call('http://example.com/node/1/b.bin', (), 100),
+        ]
+
+    def test_resume_reads_file_from_start_for_missing_crc(self, fake_nodes):
+        archive = storedzip.StoredZip(MEMBERS)
+        entry = archive.entries[2]
+        b''.join(archive.stream(entry.data_offset + 100))
+
+        fetched = [c[0][0] for c in fake_nodes.call_args_list]
+        assert fetched.count('http://example.com/node/1/b.bin') == 1
+        assert mock.call('http://example.com/node/1/b.bin', (), 0) in fake_nodes.call_args_list
+        # The first file's CRC is needed for the central directory.
+        assert 'http://example.com/node/1/a.txt' in fetched
+
+    def test_cannot_resume_past_files_without_crcs(self):
+        archive = storedzip.StoredZip(MEMBERS)
+        entry = archive.entries[2]
+
+        assert not archive.canResume(entry.data_offset + 100, len(archive) - 1)
+        assert not archive.canResume(len(archive) - 10, len(archive) - 1)
+
+    def test_can_resume_where_crcs_are_read_anyway(self):
+        archive = storedzip.StoredZip(MEMBERS)
+        entry = archive.entries[2]
+
+        # the range starts in the first file, or ends before the central
+        # directory and only needs the CRC of the file it starts in.
+        assert archive.canResume(10, len(archive) - 1)
+        assert archive.canResume(entry.data_offset + 100, entry.end - 1)
+        assert archive.canResume(0, entry.data_offset + 100)
+
+    def test_ends_early_when_file_is_short(self):
+        members = [
+            ('coda1/short.txt', 'http://example.com/node/1/a.txt', 130),
+            ('coda1/b.bin', 'http://example.com/node/1/b.bin', 768),
+        ]
+        archive = storedzip.StoredZip(members)
+        with pytest.raises(presentation.FileHandleError):
+            b''.join(archive)
+
+    def test_ends_early_when_file_is_long(self):
+        members = [('coda1/long.txt', 'http://example.com/node/1/b.bin', 10)]
+        archive = storedzip.StoredZip(members)
+        with pytest.raises(presentation.FileHandleError):
+            b''.join(archive)
+
+    @mock.patch.object(storedzip, 'ZIP64_LIMIT', 100)
+    def test_zip64(self):
+        archive = storedzip.StoredZip(MEMBERS)
+        data = b''.join(archive)
+
+        assert archive.zip64
+        assert len(data) == len(archive)
+        assert read_zip(data)['coda1/data/bé.bin'] == FILES['http://example.com/node/1/b.bin']
+
+    def test_etag_follows_layout(self):
+        assert storedzip.StoredZip(MEMBERS).etag == storedzip.StoredZip(MEMBERS).etag
+        assert storedzip.StoredZip(MEMBERS).etag != storedzip.StoredZip(MEMBERS[:2]).etag
@@ -0,0 +1,80 @@
+import io
+import tarfile
+from unittest import mock
+
+import pytest
+
+from coda_mdstore import presentation, tarstream
+
+
+def read_tar(data):
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        return dict(
+            (member.name, tar.extractfile(member).read()) for member in tar.getmembers()
+        )
+
+
+def test_tar_padding():
+    assert tarstream.tarPadding(0) == 0
+    assert tarstream.tarPadding(1) == 511
+    assert tarstream.tarPadding(512) == 0
+
+
+class TestTarStream:
+    """
+    Tests for coda_mdstore.tarstream.TarStream.
+    """
+
+    @mock.patch('coda_mdstore.presentation.file_chunk_generator')
+    def test_streams_valid_tar_of_known_length(self, mock_gen):
+        files = {
+            'http://example.com/a': [b'hello ', b'world'],
+            'http://example.com/b': [],
+            'http://example.com/c': [b'x' * 1000],
+        }
+        mock_gen.side_effect = lambda url, localNodes: iter(files[url])
+        long_name = 'coda1/data/' + 'd' * 120 + '.txt'
+        stream = tarstream.TarStream([
+            ('coda1/a.txt', 'http://example.com/a', 11),
+            ('coda1/b.txt', 'http://example.com/b', 0),
+            (long_name, 'http://example.com/c', 1000),
+        ])
+        data = b''.join(stream)
+
+        assert len(data) == len(stream)
+        assert read_tar(data) == {
+            'coda1/a.txt': b'hello world',
+            'coda1/b.txt': b'',
+            long_name: b'x' * 1000,
+        }
+
+    @mock.patch('coda_mdstore.presentation.file_chunk_generator')
+    def test_ends_early_when_file_is_short(self, mock_gen, caplog):
+        files = {
+            'http://example.com/short': [b'abc'],
+            'http://example.com/b': [b'abcd'],
+        }
+        mock_gen.side_effect = lambda url, localNodes: iter(files[url])
+        stream = tarstream.TarStream([
+            ('coda1/short.txt', 'http://example.com/short', 5),
+            ('coda1/b.txt', 'http://example.com/b', 4),
+        ])
+        data = b''
+        with pytest.raises(presentation.FileHandleError):
+            for chunk in stream:
+                data += chunk
+
+        assert len(data) < len(stream)
+        assert data.endswith(b'abc')
+        assert 'http://example.com/short came back 2 of its 5 bytes short' in caplog.text
+
+    @mock.patch('coda_mdstore.presentation.file_chunk_generator')
+    def test_ends_early_when_file_is_missing(self, mock_gen):
+        def fetch(url, localNodes):
+            raise presentation.FileHandleError('%s returned 503' % url, status=503)
+            yield
+
+        mock_gen.side_effect = fetch
+        stream = tarstream.TarStream([('coda1/a.txt', 'http://example.com/a', 5)])
+        with pytest.raises(presentation.FileHandleError):
+            b''.join(stream)
@@ -24,6 +24,14 @@ def test_app_with_parameters():
     assert resolve('/APP/bag/ark:/%d/coda2/' % settings.ARK_NAAN).func == views.app_bag
 
 
+def test_app_bag_batch():
+    assert resolve('/APP/bag/batch/').func == views.app_bag_batch
+
+
+def test_app_bag_delete():
+    assert resolve('/APP/bag/delete/').func == views.app_bag_delete
+
+
 def test_bagHTML():
     assert resolve('/bag/ark:/%d/coda2/' % settings.ARK_NAAN).func == views.bagHTML
 
@@ -36,10 +44,24 @@ def test_bag_zip_download():
     assert resolve('/bag/ark:/%d/coda2.zip' % settings.ARK_NAAN).func == views.bagDownload
 
 
+def test_bag_tar_download():
+    assert resolve('/bag/ark:/%d/coda2.tar' % settings.ARK_NAAN).func == views.bagTarDownload
+
+
 def test_bag_links():
     assert resolve('/bag/ark:/%d/coda2/links/' % settings.ARK_NAAN).func == views.bagURLLinks
 
 
+def test_bag_events():
+    assert resolve('/bag/ark:/%d/coda2/events/' % settings.ARK_NAAN).func == views.bagEvents
+
+
+def test_bag_events_json():
+    match = resolve('/bag/ark:/%d/coda2/events.json' % settings.ARK_NAAN)
+    assert match.func == views.bagEvents
+    assert match.kwargs['as_json']
+
+
 def test_bagProxy():
     assert resolve('/bag/ark:/%d/foo/bar' % settings.ARK_NAAN).func == views.bagProxy
 
@@ -1,15 +1,26 @@
+import contextlib
 from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import threading
+import time
 
 from django.core.paginator import Page
 from django.conf import settings
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test.utils import CaptureQueriesContext
 from lxml import etree, objectify
 from codalib import bagatom
 from unittest import mock
 import pytest
+import urllib3
 from urllib.error import URLError
 
-from coda_mdstore import factories, models, presentation, views, exceptions
+from coda_mdstore import factories, models, presentation, views, exceptions, locations, health
 from coda_mdstore.tests import CODA_XML
+from coda_validate.factories import ValidateFactory
+from coda_validate.models import Validate
 
 
 def convert_etree(tree):
@@ -121,6 +132,17 @@ class TestMakeBagAtomFeed:
         assert feed.link.get('rel') == 'self'
         assert feed.countchildren() == 4
 
+    def test_queries_do_not_grow_with_bags(self):
+        few = factories.FullBagFactory.create_batch(2)
+        many = factories.FullBagFactory.create_batch(10)
+
+        with CaptureQueriesContext(connection) as few_queries:
+            presentation.makeBagAtomFeed(few, 'test-id', 'test title')
+        with CaptureQueriesContext(connection) as many_queries:
+            presentation.makeBagAtomFeed(many, 'test-id', 'test title')
+
+        assert len(many_queries) == len(few_queries) == 1
+
 
 @pytest.mark.django_db
 class TestObjectsToXML:
@@ -150,6 +172,16 @@ class TestObjectsToXML:
             assert bag_info_xml.body.text == bag_info.field_body
             assert bag_info_xml.countchildren() == 2
 
+    def test_prefetched_bag_info(self):
+        factories.FullBagFactory.create_batch(3)
+        bags = presentation.prefetchBagInfo(models.Bag.objects.all())
+
+        with CaptureQueriesContext(connection) as queries:
+            trees = [convert_etree(presentation.objectsToXML(bag)) for bag in bags]
+
+        assert len(queries) == 0
+        assert all(len(tree.bagInfo.item) == 2 for tree in trees)
+
 
 class TestNodeEntry:
     """
@@ -447,6 +479,17 @@ def bag_xml():
     return objectify.fromstring(xml)
 
 
+def add_bag_info(bag_xml, name, body):
+    """
+    Add an item to the bagInfo of the codaXML in the bag_xml fixture
+    """
+
+    bag_info = bag_xml.content[CODA_XML].bagInfo
+    item = etree.SubElement(bag_info, bag_info.tag.replace('bagInfo', 'item'))
+    item.name = name
+    item.body = body
+
+
 @pytest.mark.django_db
 @pytest.mark.usefixture('bag_xml')
 class TestCreateBag:
@@ -509,6 +552,34 @@ class TestCreateBag:
         assert old_bag_info1.field_name not in [b.field_name for b in created_bag_infos]
         assert old_bag_info2.field_name not in [b.field_name for b in created_bag_infos]
 
+    def test_external_identifiers_are_saved(self, bag_xml):
+        add_bag_info(bag_xml, 'External-Identifier', 'ark:/67531/metapth1')
+        xml_str = etree.tostring(bag_xml)
+        created_bag, created_bag_infos = presentation.createBag(xml_str)
+
+        assert [
+            e.value for e in created_bag.external_identifier_set.all()
+        ] == ['ark:/67531/metapth1']
+
+    def test_existing_external_identifiers_are_replaced(self, bag_xml):
+        add_bag_info(bag_xml, 'External-Identifier', 'ark:/67531/metapth1')
+        xml_str = etree.tostring(bag_xml)
+        presentation.createBag(xml_str)
+        created_bag, created_bag_infos = presentation.createBag(xml_str)
+
+        assert created_bag.external_identifier_set.count() == 1
+
+    def test_queries_do_not_grow_with_bag_info(self, bag_xml):
+        with CaptureQueriesContext(connection) as few:
+            presentation.createBag(etree.tostring(bag_xml))
+        for i in range(30):
+            add_bag_info(bag_xml, 'Internal-Sender-Description', 'Part %d' % i)
+        with CaptureQueriesContext(connection) as many:
+            created_bag, created_bag_infos = presentation.createBag(etree.tostring(bag_xml))
+
+        assert len(many) <= len(few)
+        assert created_bag.bag_info_set.count() == 32
+
 
 @pytest.mark.django_db
 @pytest.mark.usefixture('bag_xml')
@@ -545,6 +616,18 @@ class TestUpdateBag:
         assert updated_bag.bag_info_set.count() == 2
         assert updated_bag.external_identifier_set.count() == 0
 
+    def test_external_identifiers_are_replaced(self, bag_xml, rf):
+        bag = factories.FullBagFactory.create(name='ark:/%d/coda2' % settings.ARK_NAAN)
+        factories.ExternalIdentifierFactory.create(belong_to_bag=bag, value='old')
+        add_bag_info(bag_xml, 'External-Identifier', 'new')
+        xml_str = etree.tostring(bag_xml)
+
+        uri = '/APP/bag/{0}/'.format(bag.name)
+        request = rf.post(uri, xml_str, 'application/xml')
+        updated_bag = presentation.updateBag(request)
+
+        assert [e.value for e in updated_bag.external_identifier_set.all()] == ['new']
+
     def test_raises_bad_bag_name_exception(self, bag_xml, rf):
         factories.FullBagFactory.create(name='ark:/%d/coda2' % settings.ARK_NAAN)
         xml_str = etree.tostring(bag_xml)
@@ -595,7 +678,349 @@ class TestUpdateBag:
         assert old_bag_info2.field_name not in [b.field_name for b in update_bag_infos]
 
 
-@mock.patch('coda_mdstore.presentation.urllib.request.urlopen')
+@pytest.mark.django_db
+class TestReconcileBag:
+    """
+    Tests for coda_mdstore.presentation.reconcileBag, through updateBag.
+    """
+
+    def update(self, bag_xml, rf):
+        uri = '/APP/bag/ark:/%d/coda2/' % settings.ARK_NAAN
+        request = rf.put(uri, etree.tostring(bag_xml), 'application/xml')
+        return presentation.updateBag(request)
+
+    def test_unchanged_bag_is_not_written(self, bag_xml, rf):
+        add_bag_info(bag_xml, 'External-Identifier', 'ark:/67531/metapth1')
+        presentation.createBag(etree.tostring(bag_xml))
+
+        with CaptureQueriesContext(connection) as queries:
+            updated_bag = self.update(bag_xml, rf)
+
+        assert updated_bag.changes == {
+            'inserted': 0, 'updated': 0, 'deleted': 0, 'payload': False
+        }
+        assert not [
+            q for q in queries if q['sql'].split()[0] in ('INSERT', 'UPDATE', 'DELETE')
+        ]
+
+    def test_changed_body_is_updated_in_place(self, bag_xml, rf):
+        presentation.createBag(etree.tostring(bag_xml))
+        ids = dict(models.Bag_Info.objects.values_list('field_name', 'pk'))
+        bag_xml.content[CODA_XML].bagInfo.item[0].body = '52M'
+
+        updated_bag = self.update(bag_xml, rf)
+
+        assert updated_bag.changes['updated'] == 1
+        assert updated_bag.changes['inserted'] == updated_bag.changes['deleted'] == 0
+        assert dict(models.Bag_Info.objects.values_list('field_name', 'pk')) == ids
+        assert models.Bag_Info.objects.get(pk=ids['Bag-Size']).field_body == '52M'
+
+    def test_items_are_added_and_removed(self, bag_xml, rf):
+        add_bag_info(bag_xml, 'External-Identifier', 'old')
+        presentation.createBag(etree.tostring(bag_xml))
+        bag_info = bag_xml.content[CODA_XML].bagInfo
+        bag_info.remove(bag_info.item[2])
+        add_bag_info(bag_xml, 'Contact-Name', 'Someone')
+
+        updated_bag = self.update(bag_xml, rf)
+
+        # the identifier's Bag_Info row and External_Identifier row go,
+        # and the new item is added.
+        assert updated_bag.changes['deleted'] == 2
+        assert updated_bag.changes['inserted'] == 1
+        assert not updated_bag.external_identifier_set.exists()
+        assert updated_bag.bag_info_set.filter(field_name='Contact-Name').exists()
+
+    @mock.patch('coda_mdstore.presentation.manifests.forget')
+    def test_file_index_kept_unless_payload_changes(self, mock_forget, bag_xml, rf):
+        presentation.createBag(etree.tostring(bag_xml))
+        bag_xml.content[CODA_XML].lastStatus = 'fail'
+        self.update(bag_xml, rf)
+        assert not mock_forget.called
+
+        bag_xml.content[CODA_XML].payloadSize = 46259063
+        updated_bag = self.update(bag_xml, rf)
+        assert updated_bag.changes['payload']
+        mock_forget.assert_called_once_with(updated_bag.name)
+
+
+def bag_feed(*bags):
+    """
+    Return an Atom feed with an entry for each (name, payload size) given
+    """
+
+    entries = ''.join(
+        """<entry>
+        <content type="application/xml">
+            <bag:codaXML xmlns:bag="http://digital2.library.unt.edu/coda/bagxml/">
+            <bag:name>{0}</bag:name>
+            <bag:fileCount>43</bag:fileCount>
+            <bag:payloadSize>{1}</bag:payloadSize>
+            <bag:bagitVersion>0.96</bag:bagitVersion>
+            <bag:bagInfo>
+                <bag:item>
+                    <bag:name>External-Identifier</bag:name>
+                    <bag:body>{0}-id</bag:body>
+                </bag:item>
+            </bag:bagInfo>
+            </bag:codaXML>
+        </content>
+        </entry>""".format(name, size)
+        for name, size in bags
+    )
+    return io.BytesIO(
+        ('<feed xmlns="http://www.w3.org/2005/Atom">%s</feed>' % entries).encode()
+    )
+
+
+@pytest.mark.django_db
+class TestIngestBagFeed:
+    """
+    Tests for coda_mdstore.presentation.ingestBagFeed.
+    """
+
+    def test_creates_and_updates_bags(self):
+        bag = factories.FullBagFactory.create(name='ark:/00001/stored')
+        factories.ExternalIdentifierFactory.create(belong_to_bag=bag, value='old')
+
+        report = presentation.ingestBagFeed(
+            bag_feed(('ark:/00001/new', 10), ('ark:/00001/stored', 20))
+        )
+
+        assert report == {'created': 1, 'updated': 1, 'failed': 0, 'failures': []}
+        bag.refresh_from_db()
+        assert bag.size == 20
+        assert list(bag.bag_info_set.values_list('field_body', flat=True)) == [
+            'ark:/00001/stored-id'
+        ]
+        assert list(bag.external_identifier_set.values_list('value', flat=True)) == [
+            'ark:/00001/stored-id'
+        ]
+
+    @mock.patch('coda_mdstore.presentation.manifests.forget')
+    def test_stored_bags_are_reconciled(self, mock_forget):
+        presentation.ingestBagFeed(bag_feed(('ark:/00001/stored', 10)))
+        info = models.Bag_Info.objects.get()
+        identifier = models.External_Identifier.objects.get()
+
+        report = presentation.ingestBagFeed(bag_feed(('ark:/00001/stored', 10)))
+        assert report['updated'] == 1
+        assert models.Bag_Info.objects.get().pk == info.pk
+        assert models.External_Identifier.objects.get().pk == identifier.pk
+        assert not mock_forget.called
+
+        presentation.ingestBagFeed(bag_feed(('ark:/00001/stored', 20)))
+        mock_forget.assert_called_once_with('ark:/00001/stored')
+
+    def test_saves_in_batches(self):
+        feed = bag_feed(*[('ark:/00001/bag%d' % i, i) for i in range(5)])
+        with mock.patch(
+            'coda_mdstore.presentation.saveBags', wraps=presentation.saveBags
+        ) as mock_save:
+            report = presentation.ingestBagFeed(feed, batchSize=2)
+
+        assert [len(call.args[0]) for call in mock_save.call_args_list] == [2, 2, 1]
+        assert report['created'] == models.Bag.objects.count() == 5
+
+    def test_batch_size_setting(self, settings):
+        settings.CODA_INGEST_BATCH_SIZE = 1
+        feed = bag_feed(('ark:/00001/one', 1), ('ark:/00001/two', 2))
+        with mock.patch(
+            'coda_mdstore.presentation.saveBags', wraps=presentation.saveBags
+        ) as mock_save:
+            presentation.ingestBagFeed(feed)
+
+        assert mock_save.call_count == 2
+
+    def test_later_entry_for_a_bag_wins(self):
+        report = presentation.ingestBagFeed(
+            bag_feed(('ark:/00001/twice', 1), ('ark:/00001/twice', 2))
+        )
+
+        assert report['created'] == report['updated'] == 1
+        assert models.Bag.objects.get(name='ark:/00001/twice').size == 2
+        assert models.External_Identifier.objects.count() == 1
+
+    def test_reports_bad_entries(self):
+        report = presentation.ingestBagFeed(
+            bag_feed(('ark:/00001/good', 1), ('ark:/00001/bad', 'big'))
+        )
+
+        assert report['created'] == report['failed'] == 1
+        [failure] = report['failures']
+        assert failure['entry'] == 2
+        assert 'size' in failure['error']
+        assert not models.Bag.objects.filter(name='ark:/00001/bad').exists()
+
+    def test_entry_without_codaxml(self):
+        feed = io.BytesIO(b'<feed xmlns="http://www.w3.org/2005/Atom"><entry/></feed>')
+        report = presentation.ingestBagFeed(feed)
+
+        assert report['failures'] == [{'entry': 1, 'error': 'No codaXML content'}]
+
+    def test_failed_batch_is_saved_one_bag_at_a_time(self):
+        feed = bag_feed(('ark:/00001/one', 1), ('ark:/00001/two', 2), ('ark:/00001/bad', 'big'))
+        with mock.patch(
+            'coda_mdstore.presentation.saveBags',
+            side_effect=[DatabaseError, set(), DatabaseError('bad')],
+        ):
+            report = presentation.ingestBagFeed(feed, batchSize=2)
+
+        assert report['created'] == 1
+        assert report['failed'] == 2
+        assert [failure['entry'] for failure in report['failures']] == [2, 3]
+        assert report['failures'][0] == {
+            'entry': 2, 'name': 'ark:/00001/two', 'error': 'bad'
+        }
+
+    def test_retry_after_failed_batch_without_rollback(self):
+        presentation.ingestBagFeed(bag_feed(('ark:/00001/stored', 1)))
+        feed = bag_feed(('ark:/00001/stored', 2), ('ark:/00001/one', 1), ('ark:/00001/two', 2))
+        bulk_create = models.External_Identifier.objects.bulk_create
+
+        # fail the batch once its bags and info are written; MyISAM
+        # ignores the transaction, so they stay
+        def bulk_create_after_first(*args, **kwargs):
+            if failing.call_count == 1:
+                raise DatabaseError
+            return bulk_create(*args, **kwargs)
+
+        failing = mock.Mock(side_effect=bulk_create_after_first)
+        no_rollback = mock.Mock(atomic=contextlib.nullcontext)
+
+        with mock.patch.object(presentation, 'transaction', no_rollback), \
+                mock.patch.object(models.External_Identifier.objects, 'bulk_create', failing):
+            report = presentation.ingestBagFeed(feed)
+
+        assert report == {'created': 2, 'updated': 1, 'failed': 0, 'failures': []}
+        assert models.Bag.objects.count() == 3
+        for name in ['ark:/00001/one', 'ark:/00001/two']:
+            assert models.Bag_Info.objects.filter(bag_name=name).count() == 1
+            assert models.External_Identifier.objects.filter(belong_to_bag=name).count() == 1
+
+    def test_malformed_feed_keeps_earlier_entries(self):
+        feed = bag_feed(('ark:/00001/one', 1)).getvalue()[:-len('</feed>')]
+        report = presentation.ingestBagFeed(io.BytesIO(feed + b'<entry>'))
+
+        assert 'error' in report
+        assert report['created'] == 1
+        assert models.Bag.objects.filter(name='ark:/00001/one').exists()
+
+
+@pytest.mark.django_db
+class TestDeleteBags:
+    """
+    Tests for coda_mdstore.presentation.deleteBags.
+    """
+
+    def make_bag(self):
+        bag = factories.FullBagFactory.create()
+        factories.ExternalIdentifierFactory.create(belong_to_bag=bag)
+        ValidateFactory.create(identifier=bag.name)
+        node = factories.NodeFactory.create(status='1')
+        locations.remember(bag.name, node)
+        return bag
+
+    def test_deletes_bags_and_their_rows(self):
+        bag, kept = self.make_bag(), self.make_bag()
+        identifiers = bag.external_identifier_set.count()
+        kept_identifiers = kept.external_identifier_set.count()
+
+        deleted, rows = presentation.deleteBags([bag.name, 'ark:/00001/unknown'])
+
+        assert deleted == [bag.name]
+        assert rows['coda_mdstore.Bag'] == 1
+        assert rows['coda_mdstore.External_Identifier'] == identifiers
+        assert rows['coda_validate.Validate'] == 1
+        assert not models.Bag_Info.objects.filter(bag_name=bag.name).exists()
+        assert not models.Bag_Location.objects.filter(bag_name=bag.name).exists()
+        assert locations.lookup(bag.name) is None
+
+        assert models.Bag.objects.filter(name=kept.name).exists()
+        assert kept.external_identifier_set.count() == kept_identifiers
+        assert kept.bag_info_set.exists()
+        assert Validate.objects.filter(identifier=kept.name).exists()
+
+    def test_keeps_validations(self):
+        bag = self.make_bag()
+
+        deleted, rows = presentation.deleteBags([bag.name], keepValidations=True)
+
+        assert deleted == [bag.name]
+        assert 'coda_validate.Validate' not in rows
+        assert Validate.objects.filter(identifier=bag.name).exists()
+        assert not models.Bag.objects.filter(name=bag.name).exists()
+
+    def test_queries_do_not_grow_with_bags(self):
+        few = [self.make_bag().name for i in range(2)]
+        many = [self.make_bag().name for i in range(10)]
+
+        with CaptureQueriesContext(connection) as few_queries:
+            presentation.deleteBags(few)
+        with CaptureQueriesContext(connection) as many_queries:
+            presentation.deleteBags(many)
+
+        assert len(many_queries) == len(few_queries)
+        assert not models.Bag.objects.exists()
+
+    def test_deletes_in_batches(self):
+        batched = [self.make_bag().name for i in range(6)]
+        whole = [self.make_bag().name for i in range(6)]
+
+        with CaptureQueriesContext(connection) as batched_queries:
+            deleted, rows = presentation.deleteBags(batched, batchSize=2)
+        with CaptureQueriesContext(connection) as whole_queries:
+            presentation.deleteBags(whole, batchSize=6)
+
+        assert len(batched_queries) == 3 * len(whole_queries)
+        assert sorted(deleted) == sorted(batched)
+
+    def test_failed_batch_can_be_deleted_again(self):
+        bag = self.make_bag()
+        failing = mock.Mock()
+        failing.return_value.delete.side_effect = DatabaseError
+        no_rollback = mock.Mock(atomic=contextlib.nullcontext)
+
+        # MyISAM ignores the transaction, so nothing is rolled back.
+        with mock.patch.object(presentation, 'transaction', no_rollback), \
+                mock.patch.object(models.Bag_Replica.objects, 'filter', failing):
+            with pytest.raises(DatabaseError):
+                presentation.deleteBags([bag.name])
+
+        assert models.Bag.objects.filter(name=bag.name).exists()
+        assert not models.Bag_Info.objects.filter(bag_name=bag.name).exists()
+
+        deleted, rows = presentation.deleteBags([bag.name])
+
+        assert deleted == [bag.name]
+        assert not models.Bag.objects.filter(name=bag.name).exists()
+
+
+@pytest.mark.django_db
+class TestDeleteBagsCommand:
+    """
+    Tests for the delete_bags management command.
+    """
+
+    def test_deletes_named_bags(self, capsys):
+        bag, kept = factories.BagFactory.create_batch(2)
+
+        call_command('delete_bags', bag.name, 'ark:/00001/unknown')
+        out, err = capsys.readouterr()
+        assert 'Deleted 1 bags.' in out
+        assert 'ark:/00001/unknown was not found' in err
+        assert list(models.Bag.objects.values_list('name', flat=True)) == [kept.name]
+
+    def test_reads_names_from_file(self, tmp_path):
+        bags = factories.BagFactory.create_batch(3)
+        names = tmp_path / 'names.txt'
+        names.write_text('\n'.join(bag.name for bag in bags) + '\n\n')
+
+        call_command('delete_bags', file=str(names), batch_size=2, stdout=mock.Mock())
+        assert not models.Bag.objects.exists()
+
+
+@mock.patch('coda_mdstore.presentation.openNodeFile')
 def test_getFileList(mock_urlopen):
     """Test all attribute values are extracted as files."""
     text = b"""<html>
@@ -609,31 +1034,593 @@ def test_getFileList(mock_urlopen):
                  </td> </tr>
                  </body>
               </html>"""
-    mock_urlopen.return_value = text
+    mock_urlopen.return_value = io.BytesIO(text)
     filelist = presentation.getFileList('https://coda/testurl')
     assert ['bag-info.txt', 'manifest-md5.txt', 'bagit.txt'] == filelist
+    assert mock_urlopen.return_value.closed
+
 
+@mock.patch.object(settings, 'CODA_STREAM_BUFFER_SIZE', 7)
+def test_iter_file_links_skips_directories_and_links_outside_cells():
+    text = b"""<html><body><a href="/">Parent</a><table>
+                <tr><th><a href="?C=N;O=D">Name</a></th></tr>
+                <tr><td><a href="data/">data/</a></td><td>-</td></tr>
+                <tr><td><a href="bag-info.txt">bag-info.txt</a></td><td>1K</td></tr>
+                <tr><td><a name="anchor">no href</a></td></tr>
+                <tr><td><a href="caf%C3%A9.txt">caf\xc3\xa9.txt</a></td></tr>
+              </table></body></html>"""
+    links = list(presentation.iterFileLinks(io.BytesIO(text)))
+    assert links == ['bag-info.txt', 'caf%C3%A9.txt']
 
-@mock.patch('requests.get')
+
+@mock.patch.object(settings, 'CODA_STREAM_BUFFER_SIZE', 4)
+@mock.patch('coda_mdstore.presentation.nodeSessions.get')
 def test_file_chunk_generator(mock_get):
     """Test chunks of data is generated."""
     url = 'www.example.com'
-    mock_data = ['This', 'is', 'to', 'test', 'streaming', 'data.']
     mock_get.return_value.status_code = 200
-    mock_get.return_value.iter_content.return_value = mock_data
+    mock_get.return_value.raw = io.BytesIO(b'This is to test streaming data.')
     chunk = list(presentation.file_chunk_generator(url))
-    assert chunk == mock_data
-    mock_get.assert_called_once_with(url, stream=True)
+    # Chunks start small and grow while the file keeps coming.
+    assert chunk == [b'This', b' is to t', b'est streaming da', b'ta.']
+    mock_get.assert_called_once_with(url, stream=True, headers=None)
+    assert mock_get.return_value.close.called
 
 
-@mock.patch('requests.get')
+@mock.patch('coda_mdstore.presentation.nodeSessions.get')
 def test_file_chunk_generator_with_bad_url(mock_get):
-    """Test empty generator is returned when a bad url is given."""
+    """Test FileHandleError is raised when a bad url is given."""
     url = 'www.example.com'
     mock_get.return_value.status_code = 404
-    chunk = list(presentation.file_chunk_generator(url))
+    with pytest.raises(presentation.FileHandleError):
+        list(presentation.file_chunk_generator(url))
+    mock_get.assert_called_once_with(url, stream=True, headers=None)
+
+
+@mock.patch('coda_mdstore.presentation.nodeSessions.get')
+def test_file_chunk_generator_from_start(mock_get):
+    """Test a start offset is asked of the node with a Range header."""
+    url = 'www.example.com'
+    mock_get.return_value.status_code = 206
+    mock_get.return_value.raw = io.BytesIO(b'streaming data.')
+    chunk = list(presentation.file_chunk_generator(url, start=15))
+    assert b''.join(chunk) == b'streaming data.'
+    mock_get.assert_called_once_with(url, stream=True, headers={'Range': 'bytes=15-'})
+
+
+@mock.patch('coda_mdstore.presentation.nodeSessions.get')
+def test_file_chunk_generator_skips_to_start(mock_get):
+    """Test the start is skipped to when the node ignores the Range."""
+    mock_get.return_value.status_code = 200
+    mock_get.return_value.raw = io.BytesIO(b'This is to test streaming data.')
+    chunk = list(presentation.file_chunk_generator('www.example.com', start=16))
+    assert b''.join(chunk) == b'streaming data.'
+
+
+@mock.patch('coda_mdstore.presentation.nodeSessions.get')
+def test_file_chunk_generator_start_past_end(mock_get):
+    """Test nothing is streamed when the start is past the end."""
+    mock_get.return_value.status_code = 416
+    mock_get.return_value.raw = io.BytesIO(b'')
+    chunk = list(presentation.file_chunk_generator('www.example.com', start=100))
     assert chunk == []
-    mock_get.assert_called_once_with(url, stream=True)
+    assert mock_get.return_value.close.called
+
+
+def test_fixed_length_yields_chunks():
+    chunks = presentation.fixedLength(iter([b'abc', b'def']), 6)
+    assert b''.join(chunks) == b'abcdef'
+
+
+def test_fixed_length_raises_on_long_file():
+    chunks = presentation.fixedLength(iter([b'abc', b'def']), 4, 'http://example.com/a')
+    assert next(chunks) == b'abc'
+    with pytest.raises(presentation.FileHandleError):
+        next(chunks)
+
+
+def test_fixed_length_raises_on_short_file(caplog):
+    chunks = presentation.fixedLength(iter([b'abc']), 5, 'http://example.com/a')
+    assert next(chunks) == b'abc'
+    with pytest.raises(presentation.FileHandleError):
+        next(chunks)
+    assert 'http://example.com/a came back 2 of its 5 bytes short' in caplog.text
+
+
+@mock.patch.object(settings, 'CODA_ZIP_PREFETCH_FILES', 0)
+@mock.patch('coda_mdstore.presentation.file_chunk_generator')
+def test_zip_file_streamer_without_prefetch(mock_gen):
+    """Test files are fetched one at a time when prefetching is off."""
+    urls = ['http://www.example.com/coda123/bagit.txt']
+    mock_gen.return_value = iter([b'bagit'])
+    chunk = list(presentation.zip_file_streamer(urls, 'coda123'))
+    assert b'bagit' in chunk
+    mock_gen.assert_called_once_with(urls[0], localNodes=())
+
+
+class TestPrefetchPipeline:
+    """
+    Tests for coda_mdstore.presentation.PrefetchPipeline.
+    """
+
+    def test_files_come_back_in_order(self):
+        delays = {'a': 0.05, 'b': 0, 'c': 0.02, 'd': 0}
+
+        def fetch(url):
+            time.sleep(delays[url])
+            yield url.encode()
+            yield url.encode()
+
+        pipeline = presentation.PrefetchPipeline(list('abcd'), fetch, lookahead=3, budget=1024)
+        try:
+            files = [b''.join(pipeline.chunks(i)) for i in range(4)]
+        finally:
+            pipeline.close()
+        assert files == [b'aa', b'bb', b'cc', b'dd']
+
+    def test_fetches_ahead(self):
+        started = []
+        both_started = threading.Event()
+
+        def fetch(url):
+            started.append(url)
+            if len(started) == 2:
+                both_started.set()
+            # The first file can't finish until the second one is underway.
+            both_started.wait(5)
+            yield url.encode()
+
+        pipeline = presentation.PrefetchPipeline(['a', 'b'], fetch, lookahead=1, budget=1024)
+        try:
+            assert list(pipeline.chunks(0)) == [b'a']
+        finally:
+            pipeline.close()
+        assert sorted(started) == ['a', 'b']
+
+    def test_buffered_bytes_stay_within_budget(self):
+        peak = []
+
+        def fetch(url):
+            for _ in range(20):
+                peak.append(pipeline.buffered)
+                yield b'x' * 10
+
+        pipeline = presentation.PrefetchPipeline(list('abcdef'), fetch, lookahead=5, budget=50)
+        try:
+            for i in range(6):
+                for chunk in pipeline.chunks(i):
+                    time.sleep(0.001)
+        finally:
+            pipeline.close()
+        # The file being zipped may go one chunk over.
+        assert max(peak) <= 60
+
+    def test_fetch_errors_are_raised_in_order(self):
+        def fetch(url):
+            if url == 'b':
+                raise FileNotFoundError(url)
+            yield url.encode()
+
+        pipeline = presentation.PrefetchPipeline(['a', 'b'], fetch, lookahead=1, budget=1024)
+        try:
+            assert list(pipeline.chunks(0)) == [b'a']
+            with pytest.raises(FileNotFoundError):
+                list(pipeline.chunks(1))
+        finally:
+            pipeline.close()
+
+    def test_unread_file_is_dropped(self):
+        def fetch(url):
+            for _ in range(5):
+                yield b'x' * 10
+
+        pipeline = presentation.PrefetchPipeline(['a', 'b'], fetch, lookahead=1, budget=30)
+        try:
+            chunks = pipeline.chunks(0)
+            next(chunks)
+            chunks.close()
+            assert list(pipeline.chunks(1)) == [b'x' * 10] * 5
+            assert pipeline.buffered == 0
+        finally:
+            pipeline.close()
+
+    def test_close_stops_fetching(self):
+        closed = threading.Event()
+
+        def fetch(url):
+            try:
+                while True:
+                    yield b'x' * 10
+            finally:
+                closed.set()
+
+        pipeline = presentation.PrefetchPipeline(['a'], fetch, lookahead=1, budget=20)
+        next(pipeline.chunks(0))
+        pipeline.close()
+        assert closed.wait(5)
+
+
+class TestNodeFileSizes:
+    """
+    Tests for coda_mdstore.presentation.nodeFileSizes.
+    """
+
+    @mock.patch('coda_mdstore.presentation.nodeSessions.head')
+    def test_asks_node(self, mock_head):
+        node = factories.NodeFactory.build(node_url='http://example.com/node/1')
+        mock_head.return_value.status_code = 200
+        mock_head.return_value.headers = {'Content-Length': '42'}
+
+        sizes = presentation.nodeFileSizes(node, ['store/a.txt', 'store/b.txt'])
+        assert sizes == [42, 42]
+        assert mock_head.call_count == 2
+
+    @mock.patch('coda_mdstore.presentation.nodeSessions.head')
+    def test_missing_file(self, mock_head):
+        node = factories.NodeFactory.build(node_url='http://example.com/node/1')
+        mock_head.return_value.status_code = 404
+
+        assert presentation.nodeFileSizes(node, ['store/a.txt']) is None
+
+    def test_mounted_node(self, tmp_path):
+        node = factories.NodeFactory.build(node_path=str(tmp_path), access_mode='local')
+        (tmp_path / 'store' / 'pairtree_root').mkdir(parents=True)
+        (tmp_path / 'store' / 'pairtree_root' / 'a.txt').write_bytes(b'12345')
+
+        sizes = presentation.nodeFileSizes(node, ['store/pairtree_root/a.txt'])
+        assert sizes == [5]
+
+
+@mock.patch('coda_mdstore.presentation.nodeSessions.get')
+def test_file_chunk_generator_reads_mounted_node(mock_get, tmp_path):
+    """Test files on a mounted node are read from disk."""
+    node = factories.NodeFactory.build(
+        node_url='http://example.com/node/1', node_path=str(tmp_path), access_mode='local')
+    bag_file = tmp_path / 'store' / 'pairtree_root' / 'bagit.txt'
+    bag_file.parent.mkdir(parents=True)
+    bag_file.write_bytes(b'BagIt-Version: 0.96\n')
+
+    url = 'http://example.com/node/1/store/pairtree_root/bagit.txt'
+    chunk = list(presentation.file_chunk_generator(url, [node]))
+    assert b''.join(chunk) == b'BagIt-Version: 0.96\n'
+    assert not mock_get.called
+
+
+class TestNodeSessionPool:
+    """
+    Tests for coda_mdstore.presentation.NodeSessionPool.
+    """
+
+    def test_one_session_per_node(self):
+        pool = presentation.NodeSessionPool()
+        session = pool.session('http://node1.example.com/store/a.txt')
+
+        assert pool.session('http://node1.example.com/store/b.txt') is session
+        assert pool.session('http://node2.example.com/store/a.txt') is not session
+
+    @mock.patch.object(settings, 'CODA_NODE_POOL_SIZE', 3)
+    def test_pool_size(self):
+        pool = presentation.NodeSessionPool()
+        session = pool.session('http://node1.example.com/')
+        adapter = session.get_adapter('http://node1.example.com/')
+        assert adapter._pool_maxsize == 3
+
+    @mock.patch.object(settings, 'CODA_NODE_TIMEOUT', 7)
+    @mock.patch.object(settings, 'CODA_NODE_CONNECT_TIMEOUT', 2)
+    def test_get_uses_node_timeouts(self):
+        pool = presentation.NodeSessionPool()
+        session = pool.session('http://node1.example.com/')
+        with mock.patch.object(session, 'request') as mock_request:
+            pool.get('http://node1.example.com/a.txt', stream=True)
+        mock_request.assert_called_once_with(
+            'GET', 'http://node1.example.com/a.txt', stream=True, timeout=(2, 7))
+
+    def test_stats_for_unused_node(self):
+        pool = presentation.NodeSessionPool()
+        pool.session('http://node1.example.com/')
+        assert pool.stats() == {
+            'http://node1.example.com': {'requests': 0, 'reused': 0, 'connections': 0}
+        }
+
+    @pytest.fixture
+    def node_server(self):
+        """
+        Serve every GET with a short body over keep-alive connections, and
+        note the client port of each request.
+        """
+
+        ports = []
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                ports.append(self.client_address[1])
+                self.send_response(200)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'ok')
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield 'http://127.0.0.1:%d' % server.server_port, ports
+        server.shutdown()
+        server.server_close()
+
+    def test_reuses_connection_to_node(self, node_server):
+        url, ports = node_server
+        pool = presentation.NodeSessionPool()
+        try:
+            assert pool.get(url + '/store/a.txt').content == b'ok'
+            assert pool.get(url + '/store/b.txt').content == b'ok'
+            assert pool.stats() == {url: {'requests': 2, 'reused': 1, 'connections': 1}}
+        finally:
+            pool.clear()
+        assert len(ports) == 2
+        assert len(set(ports)) == 1
+
+
+class TestBufferPool:
+    """
+    Tests for coda_mdstore.presentation.BufferPool.
+    """
+
+    def test_reuses_released_buffers(self):
+        pool = presentation.BufferPool(16, 2)
+        buffer = pool.acquire()
+        pool.release(buffer)
+        assert pool.acquire() is buffer
+
+    def test_hands_out_extra_buffers_when_empty(self):
+        pool = presentation.BufferPool(16, 1)
+        first = pool.acquire()
+        second = pool.acquire()
+
+        assert first is not second
+        assert len(second) == 16
+
+    def test_keeps_at_most_count_buffers(self):
+        pool = presentation.BufferPool(16, 1)
+        first, second = pool.acquire(), pool.acquire()
+        pool.release(first)
+        pool.release(second)
+
+        assert pool.acquire() is first
+        assert pool.acquire() is not second
+
+
+class TestStreamFileHandle:
+    """
+    Tests for coda_mdstore.presentation.streamFileHandle.
+    """
+
+    def test_streams_whole_file_in_buffer_sized_chunks(self):
+        handle = mock.Mock()
+        handle.readinto.side_effect = io.BytesIO(b'x' * 40).readinto
+        pool = presentation.BufferPool(16, 1)
+
+        chunks = list(presentation.streamFileHandle(handle, pool))
+        assert [len(c) for c in chunks] == [16, 16, 8]
+        assert handle.close.called
+
+    def test_chunks_grow_from_minimum(self):
+        handle = mock.Mock()
+        handle.readinto.side_effect = io.BytesIO(b'x' * 100).readinto
+        pool = presentation.BufferPool(32, 1)
+
+        chunks = list(presentation.streamFileHandle(handle, pool, minimum=4))
+        assert [len(c) for c in chunks] == [4, 8, 16, 32, 32, 8]
+
+    def test_closing_stream_closes_handle_and_returns_buffer(self):
+        handle = mock.Mock()
+        handle.readinto.side_effect = io.BytesIO(b'x' * 40).readinto
+        pool = presentation.BufferPool(16, 1)
+
+        stream = presentation.streamFileHandle(handle, pool)
+        next(stream)
+        stream.close()
+
+        assert handle.close.called
+        assert pool._free.qsize() == 1
+
+    def test_default_pool_follows_settings(self):
+        handle = mock.Mock()
+        handle.readinto.side_effect = io.BytesIO(b'x' * 40).readinto
+
+        with mock.patch.object(settings, 'CODA_STREAM_BUFFER_SIZE', 24):
+            chunks = list(presentation.streamFileHandle(handle))
+        assert [len(c) for c in chunks] == [24, 16]
+
+
+class TestOpenNodeFile:
+    """
+    Tests for coda_mdstore.presentation.openNodeFile.
+    """
+
+    @mock.patch('coda_mdstore.presentation.nodeSessions.get')
+    def test_returns_file_handle(self, mock_get):
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.url = 'http://node1.example.com/bagit.txt'
+        mock_get.return_value.headers = {'Content-Type': 'text/plain'}
+        mock_get.return_value.raw = io.BytesIO(b'line one\nline two\n')
+
+        handle = presentation.openNodeFile('http://node1.example.com/bagit.txt')
+        assert handle.geturl() == 'http://node1.example.com/bagit.txt'
+        assert handle.info().get('Content-Type') == 'text/plain'
+        assert handle.readline() == b'line one\n'
+        assert handle.read() == b'line two\n'
+
+    @mock.patch('coda_mdstore.presentation.nodeSessions.get')
+    def test_raises_on_error_status(self, mock_get):
+        mock_get.return_value.status_code = 404
+
+        with pytest.raises(presentation.FileHandleError):
+            presentation.openNodeFile('http://node1.example.com/bagit.txt')
+        assert mock_get.return_value.close.called
+
+    @mock.patch('coda_mdstore.presentation.nodeSessions.get')
+    def test_reads_to_end_of_body(self, mock_get):
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.raw = urllib3.HTTPResponse(
+            body=io.BytesIO(b'file contents'), preload_content=False)
+
+        handle = presentation.openNodeFile('http://node1.example.com/bagit.txt')
+        buffer = bytearray(64)
+        assert handle.readinto(buffer) == 13
+        assert handle.readinto(buffer) == 0
+
+    @mock.patch('coda_mdstore.presentation.nodeSessions.get')
+    def test_accepts_unsatisfiable_range(self, mock_get):
+        mock_get.return_value.status_code = 416
+        mock_get.return_value.raw = io.BytesIO(b'')
+
+        handle = presentation.openNodeFile(
+            'http://node1.example.com/bagit.txt', headers={'Range': 'bytes=500-'})
+        assert handle.status == 416
+
+    @mock.patch('coda_mdstore.presentation.nodeSessions.get')
+    def test_raises_on_416_without_range(self, mock_get):
+        mock_get.return_value.status_code = 416
+
+        with pytest.raises(presentation.FileHandleError):
+            presentation.openNodeFile('http://node1.example.com/bagit.txt')
+
+    @mock.patch('coda_mdstore.presentation.nodeSessions.get')
+    def test_accepts_not_modified(self, mock_get):
+        mock_get.return_value.status_code = 304
+        mock_get.return_value.raw = io.BytesIO(b'')
+
+        handle = presentation.openNodeFile(
+            'http://node1.example.com/bagit.txt', headers={'If-None-Match': '"abc"'})
+        assert handle.status == 304
+
+    @mock.patch('coda_mdstore.presentation.nodeSessions.get')
+    def test_raises_on_304_without_condition(self, mock_get):
+        mock_get.return_value.status_code = 304
+
+        with pytest.raises(presentation.FileHandleError):
+            presentation.openNodeFile('http://node1.example.com/bagit.txt')
+
+
+class TestParseByteRange:
+    """
+    Tests for coda_mdstore.presentation.parseByteRange.
+    """
+
+    @pytest.mark.parametrize('header,expected', [
+        ('bytes=0-9', (0, 9)),
+        ('bytes=10-', (10, 99)),
+        ('bytes=-10', (90, 99)),
+        ('bytes=50-500', (50, 99)),
+        ('bytes=-500', (0, 99)),
+        ('bytes=100-', False),
+        ('bytes=-0', False),
+        ('bytes=9-0', None),
+        ('bytes=0-1,5-6', None),
+        ('lines=0-9', None),
+        ('', None),
+    ])
+    def test_parseByteRange(self, header, expected):
+        assert presentation.parseByteRange(header, 100) == expected
+
+
+class TestLocalFileHandle:
+    """
+    Tests for coda_mdstore.presentation.LocalFileHandle.
+    """
+
+    @pytest.fixture
+    def path(self, tmp_path):
+        path = tmp_path / 'manifest-md5.txt'
+        path.write_bytes(b'line one\nline two\n')
+        return str(path)
+
+    def test_reads_whole_file(self, path):
+        handle = presentation.LocalFileHandle(path, 'http://example.com/manifest-md5.txt')
+
+        assert handle.status == 200
+        assert handle.geturl() == 'http://example.com/manifest-md5.txt'
+        assert handle.info().get('Content-Length') == '18'
+        assert handle.info().get('Content-Type') == 'text/plain'
+        assert handle.info().get('Last-Modified')
+        assert handle.readline() == b'line one\n'
+        assert handle.read() == b'line two\n'
+
+    def test_reads_range(self, path):
+        handle = presentation.LocalFileHandle(
+            path, 'http://example.com/manifest-md5.txt', {'Range': 'bytes=5-7'})
+        buffer = bytearray(64)
+
+        assert handle.status == 206
+        assert handle.info().get('Content-Range') == 'bytes 5-7/18'
+        assert handle.info().get('Content-Length') == '3'
+        assert handle.readinto(buffer) == 3
+        assert bytes(buffer[:3]) == b'one'
+        assert handle.readinto(buffer) == 0
+
+    def test_unsatisfiable_range(self, path):
+        handle = presentation.LocalFileHandle(
+            path, 'http://example.com/manifest-md5.txt', {'Range': 'bytes=100-'})
+
+        assert handle.status == 416
+        assert handle.info().get('Content-Range') == 'bytes */18'
+        assert handle.read() == b''
+
+
+class TestFileETag:
+    """
+    Tests for coda_mdstore.presentation.fileETag.
+    """
+
+    def make_handle(self, headers):
+        handle = mock.Mock()
+        handle.info.return_value = headers
+        handle.geturl.return_value = 'http://node1.example.com/bagit.txt'
+        return handle
+
+    def test_prefers_checksum(self):
+        handle = self.make_handle({'ETag': '"node-etag"'})
+        assert presentation.fileETag(handle, 'abc123') == '"abc123"'
+
+    def test_uses_node_etag(self):
+        handle = self.make_handle({'ETag': '"node-etag"'})
+        assert presentation.fileETag(handle) == '"node-etag"'
+
+    def test_derived_from_last_modified(self):
+        handle = self.make_handle({'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT'})
+        etag = presentation.fileETag(handle)
+        assert etag.startswith('"') and etag.endswith('"')
+        assert presentation.fileETag(handle) == etag
+
+    def test_none_without_validators(self):
+        assert presentation.fileETag(self.make_handle({})) is None
+
+
+class TestIfRangeMatches:
+    """
+    Tests for coda_mdstore.presentation.ifRangeMatches.
+    """
+
+    def test_matching_etag(self):
+        assert presentation.ifRangeMatches('"abc"', '"abc"', None)
+
+    def test_different_etag(self):
+        assert not presentation.ifRangeMatches('"abc"', '"def"', None)
+
+    def test_weak_etag_never_matches(self):
+        assert not presentation.ifRangeMatches('W/"abc"', 'W/"abc"', None)
+
+    def test_matching_date(self):
+        assert presentation.ifRangeMatches(
+            'Wed, 21 Oct 2015 07:28:00 GMT', None, 1445412480)
+
+    def test_different_date(self):
+        assert not presentation.ifRangeMatches(
+            'Wed, 21 Oct 2015 07:28:00 GMT', None, 1445412481)
 
 
 @mock.patch('coda_mdstore.presentation.file_chunk_generator')
@@ -656,6 +1643,7 @@ def test_zip_file_streamer(mock_gen):
     assert mock_gen.call_count == 3
 
 
+@pytest.mark.django_db
 class TestGenerateBagFiles:
     """
         Tests for coda_mdstore.presentation.generateBagFiles.
@@ -670,7 +1658,7 @@ class TestGenerateBagFiles:
                                           proxyMode=True)
             assert str(exc.value) == 'Unable to get handle for id %s' % (identifier)
 
-    @mock.patch('coda_mdstore.presentation.getFileList')
+    @mock.patch('coda_mdstore.presentation.iterFileLinks')
     @mock.patch('coda_mdstore.presentation.getFileHandle')
     def test_bag_files_with_proxyroot(self, mock_handle, mock_file_list):
         mock_file_list.return_value = ['bagit.txt', 'bag-info.txt']
@@ -688,7 +1676,7 @@ class TestGenerateBagFiles:
                              'https://example.com/bag/ark:/67531/coda1/bag-info.txt']
         assert mock_handle.call_count == 2
 
-    @mock.patch('coda_mdstore.presentation.getFileList')
+    @mock.patch('coda_mdstore.presentation.iterFileLinks')
     @mock.patch('coda_mdstore.presentation.getFileHandle')
     def test_bag_files_with_topfiles_bagroot(self, mock_handle, mock_file_list):
         mock_file_list.return_value = ['bagit.txt', 'bag-info.txt']
@@ -708,16 +1696,91 @@ class TestGenerateBagFiles:
         assert mock_handle.call_count == 2
         assert mock_file_list.call_count == 1
 
+    @mock.patch('coda_mdstore.presentation.iterFileLinks')
+    def test_bag_files_from_mounted_node(self, mock_file_list, tmp_path):
+        node = factories.NodeFactory.create(
+            status='1', access_mode='local', node_path=str(tmp_path))
+        identifier = 'ark:/%d/coda2' % settings.ARK_NAAN
+        bag_dir = tmp_path / presentation.bagFilePath(identifier, '')
+        (bag_dir / 'data').mkdir(parents=True)
+        (bag_dir / 'manifest-md5.txt').write_bytes(
+            b'192e635b17a9c2aea6181f0f87cab05d  data/file01.txt\n')
+        (bag_dir / 'bagit.txt').write_bytes(b'')
+
+        transList = presentation.generateBagFiles(identifier=identifier,
+                                                  proxyRoot='https://example.com/',
+                                                  proxyMode=False)
+        bag_root = presentation.nodeFileURL(node, presentation.bagFilePath(identifier, ''))
+        assert transList == [bag_root + 'data/file01.txt',
+                             bag_root + 'bagit.txt',
+                             bag_root + 'manifest-md5.txt']
+        assert not mock_file_list.called
+
+
+class TestJoinLines:
+    """
+    Tests for coda_mdstore.presentation.joinLines.
+    """
+
+    def test_joins_lines(self):
+        assert ''.join(presentation.joinLines(iter(['a', 'b', 'c']))) == 'a\nb\nc'
+
+    def test_empty(self):
+        assert list(presentation.joinLines(iter([]))) == []
+
+    @mock.patch.object(settings, 'CODA_STREAM_BUFFER_SIZE', 8)
+    def test_yields_blocks(self):
+        lines = ['line%d' % i for i in range(10)]
+        blocks = list(presentation.joinLines(iter(lines)))
+
+        assert len(blocks) > 1
+        assert ''.join(blocks) == '\n'.join(lines)
+
+
+@pytest.mark.django_db
+class TestIterBagURLs:
+    """
+    Tests for coda_mdstore.presentation.iterBagURLs.
+    """
+
+    @mock.patch('coda_mdstore.presentation.getFileHandle')
+    def test_reads_index_in_reverse(self, mock_handle):
+        bag = factories.BagFactory.create()
+        node = factories.NodeFactory.create(status='1', node_url='http://example.com/node/1')
+        locations.remember(bag.name, node)
+        models.Bag_File.objects.bulk_create([
+            models.Bag_File(bag_name=bag, path=path) for path in ['data/a.txt', 'bagit.txt']
+        ])
+        bag_root = presentation.bagRoot(node, bag.name)
+
+        urls = presentation.iterBagURLs(bag.name, '', False, reverse=True)
+        assert list(urls) == [bag_root + '/bagit.txt', bag_root + '/data/a.txt']
+        assert not mock_handle.called
+
+    @mock.patch('coda_mdstore.presentation.bagNode')
+    def test_proxy_mode_needs_no_node(self, mock_node):
+        bag = factories.BagFactory.create()
+        models.Bag_File.objects.create(bag_name=bag, path='bagit.txt')
+
+        urls = presentation.iterBagURLs(bag.name, 'https://example.com/', True)
+        assert list(urls) == ['https://example.com/bag/%s/bagit.txt' % bag.name]
+        assert not mock_node.called
+
 
 @pytest.mark.django_db
 class TestGetFileHandle:
     """
         Tests for coda_mdstore.presentation.getFileHandle.
     """
-    @mock.patch('urllib.request.urlopen')
+    @pytest.fixture(autouse=True)
+    def clear_caches(self):
+        locations.cache.clear()
+        health._cache().clear()
+
+    @mock.patch('coda_mdstore.presentation.openNodeFile')
     def test_getFileHandle(self, mock_urlopen):
-        """Test file handle of first node object with valid node_url is returned."""
-        factories.NodeFactory.create_batch(3)
+        """Test file handle of the node that has the file is returned."""
+        factories.NodeFactory.create_batch(3, status='1')
         codaId = 'ark:/67531/coda1s9ns'
         codaPath = 'manifest-md5.txt'
         url = 'http://example.com/coda-001/store/pairtree_root/co/da/' \
@@ -725,12 +1788,156 @@ class TestGetFileHandle:
 
         mock_url_obj = mock.Mock()
         mock_url_obj.url = url
-        # Raise exception for the first node object url and return mock objects for the rest.
-        mock_urlopen.side_effect = [URLError('Unknown host'), mock_url_obj, mock.Mock()]
-
+        # Only one of the nodes has the file, the rest raise exceptions.
+        results = [URLError('Unknown host'), mock_url_obj, URLError('Not Found')]
+        # the probes run at once; hold each until all three have started.
+        started = threading.Barrier(3, timeout=5)
+        lock = threading.Lock()
+
+        def open_node_file(url, **kwargs):
+            started.wait()
+            with lock:
+                result = results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        mock_urlopen.side_effect = open_node_file
         fileHandle = presentation.getFileHandle(codaId=codaId, codaPath=codaPath)
         assert fileHandle.url == url
+        assert mock_urlopen.call_count == 3
+
+    @mock.patch('coda_mdstore.presentation.openNodeFile')
+    def test_getFileHandle_skips_inactive_nodes(self, mock_urlopen):
+        active = factories.NodeFactory.create(status='1')
+        factories.NodeFactory.create(status='0')
+
+        presentation.getFileHandle(codaId='ark:/67531/coda1s9ns', codaPath='bagit.txt')
+        assert mock_urlopen.call_count == 1
+        assert mock_urlopen.call_args[0][0].startswith(active.node_url + '/')
+
+    @mock.patch.object(settings, 'CODA_NODE_TIMEOUT', 3)
+    @mock.patch.object(settings, 'CODA_NODE_CONNECT_TIMEOUT', 2)
+    @mock.patch('coda_mdstore.presentation.openNodeFile')
+    def test_getFileHandle_uses_node_timeout(self, mock_urlopen):
+        factories.NodeFactory.create(status='1')
+
+        presentation.getFileHandle(codaId='ark:/67531/coda1s9ns', codaPath='bagit.txt')
+        assert mock_urlopen.call_args[1]['timeout'] == (2, 3)
+
+    @mock.patch('coda_mdstore.presentation.openNodeFile')
+    def test_getFileHandle_closes_losing_handles(self, mock_urlopen):
+        """Test the handle from a node that answers late gets closed."""
+        fast, slow = factories.NodeFactory.create_batch(2, status='1')
+        fast_handle = mock.Mock()
+        slow_handle = mock.Mock()
+        slow_started = threading.Event()
+        release_slow = threading.Event()
+        slow_closed = threading.Event()
+        slow_handle.close.side_effect = slow_closed.set
+
+        def urlopen(url, timeout, headers=None):
+            if url.startswith(slow.node_url + '/'):
+                slow_started.set()
+                release_slow.wait(5)
+                return slow_handle
+            # Make sure both probes are in flight before one of them wins.
+            slow_started.wait(5)
+            return fast_handle
+        mock_urlopen.side_effect = urlopen
+
+        fileHandle = presentation.getFileHandle(
+            codaId='ark:/67531/coda1s9ns', codaPath='bagit.txt')
+        release_slow.set()
+
+        assert fileHandle is fast_handle
+        assert slow_closed.wait(5)
+        assert not fast_handle.close.called
+
+    @mock.patch('coda_mdstore.presentation.openNodeFile')
+    def test_getFileHandle_remembers_location(self, mock_urlopen):
+        missing, holder = factories.NodeFactory.create_batch(2, status='1')
+
+        def urlopen(url, timeout, headers=None):
+            if url.startswith(missing.node_url + '/'):
+                raise URLError('Not Found')
+            return mock.Mock()
+        mock_urlopen.side_effect = urlopen
+
+        presentation.getFileHandle(codaId='ark:/67531/coda1s9ns', codaPath='bagit.txt')
+        location = models.Bag_Location.objects.get(bag_name='ark:/67531/coda1s9ns')
+        assert location.node == holder
+
+    @mock.patch('coda_mdstore.presentation.openNodeFile')
+    def test_getFileHandle_tries_cached_location_first(self, mock_urlopen):
+        factories.NodeFactory.create_batch(2, status='1')
+        holder = factories.NodeFactory.create(status='1')
+        models.Bag_Location.objects.create(bag_name='ark:/67531/coda1s9ns', node=holder)
+
+        presentation.getFileHandle(codaId='ark:/67531/coda1s9ns', codaPath='bagit.txt')
+        assert mock_urlopen.call_count == 1
+        assert mock_urlopen.call_args[0][0].startswith(holder.node_url + '/')
+
+    @mock.patch('coda_mdstore.presentation.openNodeFile')
+    def test_getFileHandle_forgets_location_on_miss(self, mock_urlopen):
+        stale, holder = factories.NodeFactory.create_batch(2, status='1')
+        models.Bag_Location.objects.create(bag_name='ark:/67531/coda1s9ns', node=stale)
+
+        def urlopen(url, timeout, headers=None):
+            if url.startswith(stale.node_url + '/'):
+                raise URLError('Not Found')
+            return mock.Mock()
+        mock_urlopen.side_effect = urlopen
+
+        presentation.getFileHandle(codaId='ark:/67531/coda1s9ns', codaPath='bagit.txt')
         assert mock_urlopen.call_count == 2
+        location = models.Bag_Location.objects.get(bag_name='ark:/67531/coda1s9ns')
+        assert location.node == holder
+
+    @pytest.fixture
+    def mounted_node(self, tmp_path):
+        node = factories.NodeFactory.create(
+            status='1', access_mode='local', node_path=str(tmp_path))
+        bag_dir = tmp_path / presentation.bagFilePath('ark:/67531/coda1s9ns', '')
+        bag_dir.mkdir(parents=True)
+        (bag_dir / 'bagit.txt').write_bytes(b'BagIt-Version: 0.96\n')
+        return node
+
+    @mock.patch('coda_mdstore.presentation.openNodeFile')
+    def test_getFileHandle_reads_mounted_node(self, mock_urlopen, mounted_node):
+        factories.NodeFactory.create(status='1')
+
+        fileHandle = presentation.getFileHandle(
+            codaId='ark:/67531/coda1s9ns', codaPath='bagit.txt')
+        assert isinstance(fileHandle, presentation.LocalFileHandle)
+        assert fileHandle.geturl().startswith(mounted_node.node_url + '/')
+        assert fileHandle.read() == b'BagIt-Version: 0.96\n'
+        assert not mock_urlopen.called
+
+    @mock.patch('coda_mdstore.presentation.openNodeFile')
+    def test_getFileHandle_probes_others_on_local_miss(self, mock_urlopen, mounted_node):
+        factories.NodeFactory.create(status='1')
+
+        presentation.getFileHandle(codaId='ark:/67531/coda1s9ns', codaPath='missing.txt')
+        assert mock_urlopen.call_count == 1
+        assert not mock_urlopen.call_args[0][0].startswith(mounted_node.node_url + '/')
+
+    @mock.patch('coda_mdstore.presentation.openNodeFile')
+    def test_getFileHandle_refuses_paths_outside_store(self, mock_urlopen, mounted_node):
+        mock_urlopen.side_effect = URLError('Not Found')
+
+        with pytest.raises(presentation.FileHandleError):
+            presentation.getFileHandle(
+                codaId='ark:/67531/coda1s9ns', codaPath='../../../../../../../../etc/passwd')
+
+    @mock.patch('coda_mdstore.presentation.openNodeFile')
+    def test_getFileHandle_unmounted_local_node_uses_http(self, mock_urlopen, tmp_path):
+        node = factories.NodeFactory.create(
+            status='1', access_mode='local', node_path=str(tmp_path / 'unmounted'))
+
+        presentation.getFileHandle(codaId='ark:/67531/coda1s9ns', codaPath='bagit.txt')
+        assert mock_urlopen.call_count == 1
+        assert mock_urlopen.call_args[0][0].startswith(node.node_url + '/')
 
     def test_getFileHandle_no_node(self):
         codaId = 'ark:/67531/coda1s9ns'
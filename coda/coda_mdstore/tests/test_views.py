@@ -1,6 +1,8 @@
 from datetime import datetime
+import io
 import json
-import urllib.error
+import tarfile
+import zipfile
 
 from lxml import objectify
 from unittest import mock
@@ -8,12 +10,18 @@ import pytest
 
 from django.urls import reverse
 from django.conf import settings
+from django.core.cache import cache
 from django import http
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
-from coda_mdstore import views, models, exceptions
+from coda_mdstore import views, models, exceptions, manifests, presentation, replicas
 from coda_mdstore.factories import FullBagFactory, NodeFactory, ExternalIdentifierFactory
 from coda_mdstore.tests import CODA_XML
 from coda_mdstore.presentation import FileHandleError
+from premis_event_service.models import Event, LinkObject
+from coda_validate.factories import ValidateFactory
+from coda_validate.models import Validate
 
 pytestmark = pytest.mark.django_db()
 
@@ -287,16 +295,12 @@ class TestBagHTMLView:
         response = views.bagHTML(rf.get('/', HTTP_HOST="example.com"), bag.name)
         assert response.status_code in (200, 404)
 
-    @mock.patch('coda_mdstore.views.urlopen')
-    def test_catches_urlerror(self, mock_urlopen, client):
+    def test_events_are_loaded_separately(self, client):
         bag = FullBagFactory.create()
-        mock_urlopen.side_effect = urllib.error.URLError('Fake Exception')
-
         response = client.get(
             reverse('bag-detail', args=[bag.name]), HTTP_HOST="example.com")
 
-        assert mock_urlopen.call_count == 1
-        assert response.context[-1]['linked_events'] == []
+        assert reverse('bag-events', args=[bag.name]).encode() in response.content
 
     def test_renders_correct_template(self, client):
         bag = FullBagFactory.create()
@@ -306,8 +310,6 @@ class TestBagHTMLView:
         assert response.templates[0].name == 'mdstore/bag_info.html'
 
     @pytest.mark.parametrize('key', [
-        'total_events',
-        'linked_events',
         'payload_oxum_file_count',
         'payload_oxum_size',
         'bag_date',
@@ -323,6 +325,108 @@ class TestBagHTMLView:
         assert key in response.context[-1]
 
 
+class TestBagEventsView:
+    """
+    Tests for coda_mdstore.views.bagEvents.
+    """
+
+    def create_events(self, bag, count, date=None):
+        link = LinkObject.objects.create(object_identifier=bag.name, object_type='bag')
+        events = []
+        for i in range(count):
+            event = Event.objects.create(
+                event_identifier='event%02d' % i,
+                event_identifier_type='UUID',
+                event_type='http://purl.org/net/untl/vocabularies/preservationEvents/#fixityCheck',
+                event_date_time=date or datetime(2015, 1, 1 + i),
+                event_detail='Fixity check',
+                event_outcome='http://purl.org/net/untl/vocabularies/eventOutcomes/#success',
+                event_outcome_detail='',
+            )
+            event.linking_objects.add(link)
+            events.append(event)
+        return events
+
+    def test_no_linked_events(self, client):
+        bag = FullBagFactory.create()
+        response = client.get(
+            reverse('bag-events', args=[bag.name]), HTTP_HOST="example.com")
+
+        assert response.context['total_events'] == 0
+        assert response.context['linked_events'] == []
+        assert b'There are no' in response.content
+
+    def test_unknown_bag(self, client):
+        response = client.get(
+            reverse('bag-events', args=['ark:/00001/unknown']), HTTP_HOST="example.com")
+        assert response.status_code == 404
+
+    @mock.patch.object(settings, 'CODA_BAG_EVENT_COUNT', 2)
+    def test_first_page(self, client):
+        bag = FullBagFactory.create()
+        events = self.create_events(bag, 3)
+
+        response = client.get(
+            reverse('bag-events', args=[bag.name]), HTTP_HOST="example.com")
+        context = response.context
+
+        assert context['total_events'] == 3
+        assert context['linked_events'] == [events[2], events[1]]
+        assert b'event02' in response.content
+        assert b'event00' not in response.content
+        assert b'bag-events-more' in response.content
+
+    @mock.patch.object(settings, 'CODA_BAG_EVENT_COUNT', 2)
+    def test_follows_next_link(self, client):
+        bag = FullBagFactory.create()
+        events = self.create_events(bag, 3)
+
+        response = client.get(
+            reverse('bag-events', args=[bag.name]), HTTP_HOST="example.com")
+        response = client.get(response.context['next_url'], HTTP_HOST="example.com")
+        context = response.context
+
+        assert context['total_events'] is None
+        assert context['linked_events'] == [events[0]]
+        assert context['next_url'] is None
+
+    @mock.patch.object(settings, 'CODA_BAG_EVENT_COUNT', 2)
+    def test_pages_events_on_the_same_date(self, client):
+        bag = FullBagFactory.create()
+        events = self.create_events(bag, 5, date=datetime(2015, 1, 1))
+
+        seen = []
+        url = reverse('bag-events-json', args=[bag.name])
+        while url:
+            payload = json.loads(client.get(url, HTTP_HOST="example.com").content)
+            seen += [event['identifier'] for event in payload['events']]
+            url = payload['next']
+
+        assert seen == [event.event_identifier for event in reversed(events)]
+
+    def test_json(self, client):
+        bag = FullBagFactory.create()
+        self.create_events(bag, 1)
+
+        response = client.get(
+            reverse('bag-events-json', args=[bag.name]), HTTP_HOST="example.com")
+        payload = json.loads(response.content)
+
+        assert response['Content-Type'] == 'application/json'
+        assert payload['total'] == 1
+        assert payload['next'] is None
+        assert payload['events'][0]['identifier'] == 'event00'
+        assert payload['events'][0]['date'] == '2015-01-01T00:00:00'
+        assert payload['events'][0]['linked_objects'] == [bag.name]
+
+    def test_bad_cursor(self, client):
+        bag = FullBagFactory.create()
+        response = client.get(
+            reverse('bag-events', args=[bag.name]), {'before': 'yesterday', 'before_id': 'x'},
+            HTTP_HOST="example.com")
+        assert response.status_code == 400
+
+
 class TestBagProxyView:
     """
     Tests for coda_mdstore.views.bagProxy.
@@ -334,15 +438,20 @@ class TestBagProxyView:
 
         # The mocked value that getFileHandle will return.
         file_handle = mock.Mock()
-        file_handle.info().get.side_effect = ['text/plain', '255']
+        file_handle.status = 200
+        file_handle.info.return_value = {
+            'Content-Type': 'text/plain',
+            'Content-Length': '255',
+            'ETag': '"abc123"',
+            'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT',
+        }
         file_handle.geturl.return_value = 'http://example.com/direct-file.txt'
 
+        self.file_handle = file_handle
         self.getFileHandle = mock.Mock(return_value=file_handle)
         monkeypatch.setattr(
             'coda_mdstore.views.getFileHandle', self.getFileHandle)
 
-        monkeypatch.setattr('coda_mdstore.views.FileWrapper', mock.Mock())
-
     def test_returns_status_code_200(self, rf):
         request = rf.get('/', HTTP_HOST="example.com")
         response = views.bagProxy(request, self.bag.name, '/foo/bar')
@@ -355,6 +464,33 @@ class TestBagProxyView:
         assert response['Content-Length'] == '255'
         assert response['Content-Type'] == 'text/plain'
 
+    def test_etag_is_manifest_checksum(self, rf):
+        models.Bag_File.objects.create(
+            bag_name=self.bag, path='data/file01.txt', md5='192e635b17a9c2aea6181f0f87cab05d')
+        request = rf.get('/', HTTP_HOST="example.com")
+        response = views.bagProxy(request, self.bag.name, 'data/file01.txt')
+
+        assert response['ETag'] == '"192e635b17a9c2aea6181f0f87cab05d"'
+
+    def test_response_is_streamed(self, rf):
+        self.file_handle.readinto.side_effect = io.BytesIO(b'file contents').readinto
+        request = rf.get('/', HTTP_HOST="example.com")
+        response = views.bagProxy(request, self.bag.name, '/foo/bar')
+
+        assert isinstance(response, http.StreamingHttpResponse)
+        assert b''.join(response.streaming_content) == b'file contents'
+        assert self.file_handle.close.called
+
+    def test_closing_response_closes_file_handle(self, rf):
+        self.file_handle.readinto.side_effect = io.BytesIO(b'x' * 200000).readinto
+        request = rf.get('/', HTTP_HOST="example.com")
+        response = views.bagProxy(request, self.bag.name, '/foo/bar')
+
+        # Read one chunk, then hang up the way a disconnecting client would.
+        next(iter(response))
+        response.close()
+        assert self.file_handle.close.called
+
     @mock.patch.object(settings, 'REPROXY', True)
     def test_response_has_correct_headers_reproxy(self, rf):
         request = rf.get('/', HTTP_HOST="example.com")
@@ -365,6 +501,107 @@ class TestBagProxyView:
         assert response['X-REPROXY-URL'] == 'http://example.com/direct-file.txt'
         assert response['ETag']
 
+    def test_response_has_validators(self, rf):
+        request = rf.get('/', HTTP_HOST="example.com")
+        response = views.bagProxy(request, self.bag.name, '/foo/bar')
+
+        assert response['ETag'] == '"abc123"'
+        assert response['Last-Modified'] == 'Wed, 21 Oct 2015 07:28:00 GMT'
+        assert response['Accept-Ranges'] == 'bytes'
+
+    def test_range_is_forwarded(self, rf):
+        self.file_handle.status = 206
+        self.file_handle.info.return_value.update({
+            'Content-Length': '10',
+            'Content-Range': 'bytes 0-9/255',
+        })
+        request = rf.get('/', HTTP_HOST="example.com", HTTP_RANGE='bytes=0-9')
+        response = views.bagProxy(request, self.bag.name, '/foo/bar')
+
+        self.getFileHandle.assert_called_once_with(
+            self.bag.name, '/foo/bar', headers={'Range': 'bytes=0-9'})
+        assert response.status_code == 206
+        assert response['Content-Range'] == 'bytes 0-9/255'
+        assert response['Content-Length'] == '10'
+
+    def test_unsatisfiable_range(self, rf):
+        self.file_handle.status = 416
+        self.file_handle.info.return_value['Content-Range'] = 'bytes */255'
+        request = rf.get('/', HTTP_HOST="example.com", HTTP_RANGE='bytes=500-')
+        response = views.bagProxy(request, self.bag.name, '/foo/bar')
+
+        assert response.status_code == 416
+        assert response['Content-Range'] == 'bytes */255'
+        assert self.file_handle.close.called
+
+    def test_if_range_mismatch_returns_whole_file(self, rf):
+        request = rf.get(
+            '/', HTTP_HOST="example.com", HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        response = views.bagProxy(request, self.bag.name, '/foo/bar')
+
+        assert self.getFileHandle.call_args_list == [
+            mock.call(self.bag.name, '/foo/bar', headers={'Range': 'bytes=0-9'}),
+            mock.call(self.bag.name, '/foo/bar'),
+        ]
+        assert response.status_code == 200
+
+    def test_if_none_match_returns_not_modified(self, rf):
+        request = rf.get('/', HTTP_HOST="example.com", HTTP_IF_NONE_MATCH='"abc123"')
+        response = views.bagProxy(request, self.bag.name, '/foo/bar')
+
+        assert response.status_code == 304
+        assert response['ETag'] == '"abc123"'
+        assert self.file_handle.close.called
+
+    def test_if_modified_since_returns_not_modified(self, rf):
+        request = rf.get(
+            '/', HTTP_HOST="example.com",
+            HTTP_IF_MODIFIED_SINCE='Wed, 21 Oct 2015 07:28:00 GMT')
+        response = views.bagProxy(request, self.bag.name, '/foo/bar')
+
+        assert response.status_code == 304
+
+    def test_mounted_node_file_is_handed_to_server(self, rf, tmp_path):
+        path = tmp_path / 'bagit.txt'
+        path.write_bytes(b'BagIt-Version: 0.96\n')
+        self.getFileHandle.return_value = presentation.LocalFileHandle(
+            str(path), 'http://example.com/bagit.txt')
+        request = rf.get('/', HTTP_HOST="example.com")
+        response = views.bagProxy(request, self.bag.name, '/foo/bar')
+
+        assert isinstance(response, http.FileResponse)
+        assert response['Content-Length'] == '20'
+        assert b''.join(response.streaming_content) == b'BagIt-Version: 0.96\n'
+
+    @mock.patch.object(settings, 'REPROXY', True)
+    def test_range_is_left_to_proxy_reproxy(self, rf):
+        self.file_handle.status = 206
+        self.file_handle.info.return_value.update({
+            'Content-Length': '10',
+            'Content-Range': 'bytes 0-9/255',
+        })
+        request = rf.get('/', HTTP_HOST="example.com", HTTP_RANGE='bytes=0-9')
+        response = views.bagProxy(request, self.bag.name, '/foo/bar')
+
+        assert response.status_code == 200
+        assert 'Content-Length' not in response
+        assert 'Content-Range' not in response
+        assert self.file_handle.close.called
+
+    @mock.patch.object(settings, 'CODA_OFFLOAD', 'accel')
+    def test_response_offloaded_to_nginx(self, rf):
+        node = NodeFactory.build(node_name='coda-1', node_url='http://example.com/node/1')
+        self.file_handle.node = node
+        self.file_handle.geturl.return_value = \
+            'http://example.com/node/1/store/pairtree_root/bagit.txt'
+        request = rf.get('/', HTTP_HOST="example.com")
+        response = views.bagProxy(request, self.bag.name, '/foo/bar')
+
+        assert response['X-Accel-Redirect'] == '/_node/coda-1/store/pairtree_root/bagit.txt'
+        assert response['ETag'] == '"abc123"'
+        assert response['Content-Length'] == '255'
+        assert self.file_handle.close.called
+
     def test_raises_not_found_when_object_not_found(self, rf):
         request = rf.get('/')
         with pytest.raises(http.Http404):
@@ -414,6 +651,21 @@ class TestExternalIdentiferSearch:
         assert bag_entry.name == bag.name
         assert len(list(bag_entry.bagInfo.iterchildren())) == 2
 
+    def test_queries_do_not_grow_with_bags(self, rf):
+        request = rf.get('/')
+        for bag in FullBagFactory.create_batch(2):
+            ExternalIdentifierFactory.create(belong_to_bag=bag, value='metapth1')
+        with CaptureQueriesContext(connection) as few:
+            views.externalIdentifierSearch(request, 'metapth1')
+
+        for bag in FullBagFactory.create_batch(10):
+            ExternalIdentifierFactory.create(belong_to_bag=bag, value='metapth1')
+        with CaptureQueriesContext(connection) as many:
+            response = views.externalIdentifierSearch(request, 'metapth1')
+
+        assert len(objectify.fromstring(response.content).entry) == 12
+        assert len(many) == len(few)
+
     def test_with_valid_metadc_identifier_renders_xml(self, rf):
         bag = FullBagFactory.create()
         ext_id = ExternalIdentifierFactory.create(
@@ -616,7 +868,7 @@ class TestBagURLListView:
         with pytest.raises(http.Http404):
             views.bagURLList(request, identifier)
 
-    @mock.patch('coda_mdstore.views.generateBagFiles')
+    @mock.patch('coda_mdstore.views.iterBagURLs')
     def test_raises_http404_file_handle_is_falsy(self, mock_bag_files, rf):
         mock_bag_files.side_effect = FileHandleError()
         bag = FullBagFactory.create()
@@ -624,19 +876,36 @@ class TestBagURLListView:
         with pytest.raises(http.Http404):
             views.bagURLList(request, bag.name)
 
-    @mock.patch('coda_mdstore.views.generateBagFiles')
-    def test_response_content(self, mock_bag_files, rf):
-        mock_bag_files.return_value = [
-            'https://coda/data/file01.txt',
-            'https://coda/data/file02.txt',
-            'https://coda/bagit.txt']
+    def test_response_content(self, rf):
         bag = FullBagFactory.create()
-        request = rf.get('/')
-        response = views.bagURLList(request, bag.name)
+        models.Bag_File.objects.bulk_create([
+            models.Bag_File(bag_name=bag, path=path)
+            for path in ['data/file01.txt', 'data/file02.txt', 'bagit.txt']
+        ])
+        request = rf.get('/', HTTP_HOST='example.com')
+        with mock.patch.object(settings, 'CODA_PROXY_MODE', True):
+            response = views.bagURLList(request, bag.name)
+        root = 'http://example.com/bag/%s/' % bag.name
         assert response.status_code == 200
-        assert (b'https://coda/bagit.txt\n'
-                b'https://coda/data/file02.txt\n'
-                b'https://coda/data/file01.txt') in response.content
+        assert response.streaming
+        assert b''.join(response.streaming_content) == (
+            root + 'bagit.txt\n' + root + 'data/file02.txt\n' + root + 'data/file01.txt'
+        ).encode()
+
+    @mock.patch('coda_mdstore.presentation.readBagFiles')
+    def test_response_content_unindexed(self, mock_files, rf):
+        mock_files.return_value = ('https://coda', None, [
+            ('data/file01.txt', '', None),
+            ('data/file02.txt', '', None),
+            ('bagit.txt', '', None)])
+        bag = FullBagFactory.create()
+        request = rf.get('/')
+        with mock.patch.object(settings, 'CODA_PROXY_MODE', False):
+            response = views.bagURLList(request, bag.name)
+        assert b''.join(response.streaming_content) == (
+            b'https://coda/bagit.txt\n'
+            b'https://coda/data/file02.txt\n'
+            b'https://coda/data/file01.txt')
 
 
 class TestBagLinks:
@@ -663,8 +932,21 @@ class TestBagDownload:
     """
         Tests for coda_mdstore.views.bagDownload.
     """
+    @pytest.fixture
+    def members(self, monkeypatch):
+        node = NodeFactory.build(node_url='http://example.com/node/1')
+        monkeypatch.setattr(
+            'coda_mdstore.presentation.readBagFiles',
+            mock.Mock(return_value=(
+                '', node, [('data/file01.txt', 'abc', 3), ('bagit.txt', '', 2)])))
+        monkeypatch.setattr(
+            'coda_mdstore.presentation.file_chunk_generator',
+            lambda url, localNodes=(), start=0: iter(
+                [(b'abc' if url.endswith('file01.txt') else b'ok')[start:]]))
+
+    @mock.patch('coda_mdstore.views.bagMembers', return_value=None)
     @mock.patch('coda_mdstore.views.generateBagFiles')
-    def test_response_download_zipped_bag(self, mock_files, rf):
+    def test_response_download_zipped_bag(self, mock_files, mock_members, rf):
         """Test response has zipped bag file attached with download kwarg."""
         mock_files.return_value = [
             'https://coda/data/file01.txt',
@@ -675,6 +957,144 @@ class TestBagDownload:
         request = rf.get('/')
         response = views.bagDownload(request, bag.name)
         assert response.get('Content-Disposition') == 'attachment; filename=%s' % zip_filename
+        assert not response.has_header('Content-Length')
+
+    @mock.patch('coda_mdstore.presentation.nodeFileSizes')
+    @mock.patch('coda_mdstore.presentation.readBagFiles')
+    @mock.patch('coda_mdstore.views.generateBagFiles')
+    def test_streams_zip_when_sizes_unknown(self, mock_files, mock_list, mock_sizes, rf):
+        node = NodeFactory.build(node_url='http://example.com/node/1')
+        mock_list.return_value = ('', node, [('data/file01.txt', 'abc', None)])
+        mock_files.return_value = ['http://example.com/node/1/data/file01.txt']
+        bag = FullBagFactory.create()
+        response = views.bagDownload(rf.get('/'), bag.name)
+
+        assert not mock_sizes.called
+        assert not response.has_header('Content-Length')
+        assert mock_files.called
+
+    def test_zip_of_known_length(self, members, rf):
+        bag = FullBagFactory.create()
+        meta_id = bag.name.split('/')[-1]
+        request = rf.get('/')
+        response = views.bagDownload(request, bag.name)
+        data = b''.join(response.streaming_content)
+
+        assert response.status_code == 200
+        assert response['Accept-Ranges'] == 'bytes'
+        assert int(response['Content-Length']) == len(data)
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            assert archive.namelist() == [meta_id + '/data/file01.txt', meta_id + '/bagit.txt']
+            assert archive.read(meta_id + '/data/file01.txt') == b'abc'
+
+    def test_zip_range_request(self, members, rf):
+        bag = FullBagFactory.create()
+        manifests.remember(bag.name, [('data/file01.txt', 'abc', 3), ('bagit.txt', '', 2)])
+        whole = b''.join(views.bagDownload(rf.get('/'), bag.name).streaming_content)
+        # the tail of the zip needs the CRC-32s stored by the first download.
+        first = len(whole) - 30
+        request = rf.get('/', HTTP_RANGE='bytes=%d-' % first)
+        response = views.bagDownload(request, bag.name)
+
+        assert response.status_code == 206
+        assert response['Content-Range'] == 'bytes %d-%d/%d' % (
+            first, len(whole) - 1, len(whole))
+        assert b''.join(response.streaming_content) == whole[first:]
+
+    def test_zip_range_needing_unknown_crcs_sends_whole_zip(self, members, rf):
+        bag = FullBagFactory.create()
+        length = len(b''.join(views.bagDownload(rf.get('/'), bag.name).streaming_content))
+        request = rf.get('/', HTTP_RANGE='bytes=%d-' % (length - 30))
+        response = views.bagDownload(request, bag.name)
+
+        assert response.status_code == 200
+        assert int(response['Content-Length']) == length
+        assert 'Content-Range' not in response
+
+    def test_zip_range_ignored_when_if_range_does_not_match(self, members, rf):
+        bag = FullBagFactory.create()
+        request = rf.get('/', HTTP_RANGE='bytes=40-', HTTP_IF_RANGE='"stale"')
+        response = views.bagDownload(request, bag.name)
+
+        assert response.status_code == 200
+
+    def test_zip_unsatisfiable_range(self, members, rf):
+        bag = FullBagFactory.create()
+        request = rf.get('/', HTTP_RANGE='bytes=100000-')
+        response = views.bagDownload(request, bag.name)
+
+        assert response.status_code == 416
+        assert response['Content-Range'].startswith('bytes */')
+
+    def test_zip_not_modified(self, members, rf):
+        bag = FullBagFactory.create()
+        etag = views.bagDownload(rf.get('/'), bag.name)['ETag']
+        request = rf.get('/', HTTP_IF_NONE_MATCH=etag)
+        response = views.bagDownload(request, bag.name)
+
+        assert response.status_code == 304
+
+    @mock.patch.object(settings, 'CODA_OFFLOAD', 'accel')
+    @mock.patch('coda_mdstore.presentation.nodeFileSizes')
+    @mock.patch('coda_mdstore.presentation.readBagFiles')
+    @mock.patch('coda_mdstore.views.generateBagFiles')
+    def test_zip_offloaded_to_nginx(self, mock_files, mock_list, mock_sizes, rf):
+        bag = FullBagFactory.create()
+        meta_id = bag.name.split('/')[-1]
+        node = NodeFactory.build(node_name='coda-1')
+        mock_list.return_value = (
+            '', node, [('data/file01.txt', 'abc', None), ('bagit.txt', '', None)])
+        mock_sizes.return_value = [10, 20]
+        request = rf.get('/')
+        response = views.bagDownload(request, bag.name)
+
+        assert response['X-Archive-Files'] == 'zip'
+        assert response.get('Content-Disposition') == 'attachment; filename=%s.zip' % meta_id
+        assert response.content.decode().splitlines()[1].startswith('- 20 /_node/coda-1/')
+        assert not mock_files.called
+
+
+class TestBagTarDownload:
+    """
+        Tests for coda_mdstore.views.bagTarDownload.
+    """
+    @pytest.fixture(autouse=True)
+    def setup_fixtures(self, monkeypatch):
+        self.bag = FullBagFactory.create()
+        self.node = NodeFactory.build(node_url='http://example.com/node/1')
+        self.readBagFiles = mock.Mock(
+            return_value=('', self.node, [('data/file01.txt', 'abc', None), ('bagit.txt', '', 2)]))
+        self.nodeFileSizes = mock.Mock(return_value=[3])
+        monkeypatch.setattr('coda_mdstore.presentation.readBagFiles', self.readBagFiles)
+        monkeypatch.setattr('coda_mdstore.presentation.nodeFileSizes', self.nodeFileSizes)
+        monkeypatch.setattr(
+            'coda_mdstore.presentation.file_chunk_generator',
+            lambda url, localNodes: iter([b'abc' if url.endswith('file01.txt') else b'ok']))
+
+    def test_response_is_tar_of_known_length(self, rf):
+        meta_id = self.bag.name.split('/')[-1]
+        request = rf.get('/')
+        response = views.bagTarDownload(request, self.bag.name)
+        data = b''.join(response.streaming_content)
+
+        assert response['Content-Type'] == 'application/x-tar'
+        assert response['Content-Disposition'] == 'attachment; filename=%s.tar' % meta_id
+        assert int(response['Content-Length']) == len(data)
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+            assert tar.getnames() == [meta_id + '/data/file01.txt', meta_id + '/bagit.txt']
+            assert tar.extractfile(meta_id + '/data/file01.txt').read() == b'abc'
+
+    def test_raises_http404_when_sizes_unknown(self, rf):
+        self.nodeFileSizes.return_value = None
+        request = rf.get('/')
+        with pytest.raises(http.Http404):
+            views.bagTarDownload(request, self.bag.name)
+
+    def test_raises_http404_when_bag_files_missing(self, rf):
+        self.readBagFiles.side_effect = FileHandleError()
+        request = rf.get('/')
+        with pytest.raises(http.Http404):
+            views.bagTarDownload(request, self.bag.name)
 
 
 class TestBagFullTextSearchHTMLView:
@@ -712,6 +1132,10 @@ class TestShowNodeStatusView:
     Tests for coda_mdstore.views.showNodeStatus.
     """
 
+    @pytest.fixture(autouse=True)
+    def clear_replica_count(self):
+        cache.delete(replicas.UNDER_REPLICATED_KEY)
+
     def test_gets_status_for_single_node(self, rf):
         node = NodeFactory.create()
 
@@ -758,6 +1182,19 @@ class TestShowNodeStatusView:
         assert context.get('total_size') == NodeFactory.node_size * 10
         assert context.get('total_filled') == 45.0
 
+    def test_context_counts_bags(self, client):
+        bags = FullBagFactory.create_batch(2)
+        first = NodeFactory.create(node_name='coda-a', status='1')
+        second = NodeFactory.create(node_name='coda-b', status='1')
+        replicas.record(bags[0].name, {first: True, second: True})
+        replicas.record(bags[1].name, {first: True})
+
+        response = client.get(reverse('node-list'), HTTP_HOST="example.com")
+        context = response.context[-1]
+
+        assert [status['bags'] for status in context['status_list']] == [2, 1]
+        assert context['under_replicated'] == 1
+
     def test_no_nodes_available(self, rf):
         request = rf.get('/')
         response = views.showNodeStatus(request)
@@ -898,6 +1335,19 @@ class TestAppBag:
         tree = objectify.fromstring(response.content)
         assert len(tree.entry) == 10
 
+    def test_get_request_queries_do_not_grow_with_bags(self, rf):
+        FullBagFactory.create_batch(2)
+        request = rf.get('/', HTTP_HOST='example.com')
+        with CaptureQueriesContext(connection) as few:
+            views.app_bag(request)
+
+        FullBagFactory.create_batch(10)
+        with CaptureQueriesContext(connection) as many:
+            response = views.app_bag(request)
+
+        assert len(objectify.fromstring(response.content).entry) == 12
+        assert len(many) == len(few)
+
     def test_get_request_with_invalid_identifier(self, rf):
         request = rf.get('/', HTTP_HOST='example.com')
         response = views.app_bag(request, 'ark:/000002/id1')
@@ -929,6 +1379,16 @@ class TestAppBag:
             'http://example.com/APP/bag/{0}/'.format(bag.name)
         )
 
+    @mock.patch('coda_mdstore.presentation.openNodeFile')
+    @mock.patch('coda_mdstore.views.createBag')
+    def test_post_request_does_not_probe_nodes(self, mock_createBag, mock_urlopen, rf):
+        bag = FullBagFactory.create()
+        NodeFactory.create(status='1')
+        mock_createBag.return_value = bag, bag.bag_info_set
+
+        views.app_bag(rf.post('/', HTTP_HOST='example.com'))
+        assert not mock_urlopen.called
+
     @mock.patch('coda_mdstore.views.updateBag')
     def test_put_request(self, updateBag, rf):
         bag = FullBagFactory.create()
@@ -940,6 +1400,17 @@ class TestAppBag:
         assert response.status_code == 200
         assert response['Content-Type'] == 'application/atom+xml'
 
+    @mock.patch('coda_mdstore.views.updateBag')
+    def test_put_request_reports_rows_changed(self, updateBag, rf):
+        bag = FullBagFactory.create()
+        bag.changes = {'inserted': 1, 'updated': 2, 'deleted': 0, 'payload': False}
+        updateBag.return_value = bag
+
+        request = rf.put('/', HTTP_HOST='example.com')
+        response = views.app_bag(request, bag.name)
+
+        assert response['X-Rows-Changed'] == 'inserted=1, updated=2, deleted=0'
+
     @mock.patch('coda_mdstore.views.updateBag')
     def test_put_request_returns_not_found(self, updateBag, rf):
         bag = FullBagFactory.create()
@@ -968,6 +1439,32 @@ class TestAppBag:
         assert response.status_code == 200
         assert models.Bag.objects.exists() is False
 
+    def test_delete_request_leaves_other_bags_alone(self, rf):
+        bag, other = FullBagFactory.create_batch(2)
+        ExternalIdentifierFactory.create(belong_to_bag=other)
+        identifiers = other.external_identifier_set.count()
+        request = rf.delete('/', HTTP_HOST='example.com')
+        response = views.app_bag(request, bag.name)
+
+        assert response.status_code == 200
+        assert models.External_Identifier.objects.count() == identifiers
+        assert other.external_identifier_set.count() == identifiers
+
+    def test_delete_request_keeps_validation(self, rf):
+        bag = FullBagFactory.create()
+        ValidateFactory.create(identifier=bag.name)
+        request = rf.delete('/', HTTP_HOST='example.com')
+        response = views.app_bag(request, bag.name)
+
+        assert response.status_code == 200
+        assert Validate.objects.filter(identifier=bag.name).exists()
+
+    def test_delete_request_returns_not_found(self, rf):
+        request = rf.delete('/', HTTP_HOST='example.com')
+        response = views.app_bag(request, 'ark:/00001/unknown')
+
+        assert response.status_code == 404
+
     def test_request_returns_bad_request(self, rf):
         """
         Test that a status code 400 is returned if the request method
@@ -986,3 +1483,59 @@ class TestAppBag:
         response = views.app_bag(request, bag.name)
         assert response.status_code == 200
         assert models.External_Identifier.objects.exists() is False
+
+
+class TestAppBagBatch:
+    """
+    Tests for coda_mdstore.views.app_bag_batch.
+    """
+
+    @mock.patch('coda_mdstore.views.ingestBagFeed')
+    def test_post_request(self, mock_ingest, rf):
+        mock_ingest.return_value = {'created': 1, 'updated': 0, 'failed': 0, 'failures': []}
+        request = rf.post('/', b'<feed/>', 'application/atom+xml')
+        response = views.app_bag_batch(request)
+
+        mock_ingest.assert_called_once_with(request)
+        assert response.status_code == 200
+        assert response['Content-Type'] == 'application/json'
+        assert json.loads(response.content) == mock_ingest.return_value
+
+    def test_malformed_feed_returns_bad_request(self, rf):
+        request = rf.post('/', b'<feed><entry>', 'application/atom+xml')
+        response = views.app_bag_batch(request)
+
+        assert response.status_code == 400
+        assert 'error' in json.loads(response.content)
+
+    def test_get_request_not_allowed(self, rf):
+        response = views.app_bag_batch(rf.get('/'))
+
+        assert response.status_code == 405
+        assert response['Allow'] == 'POST'
+
+
+class TestAppBagDelete:
+    """
+    Tests for coda_mdstore.views.app_bag_delete.
+    """
+
+    def test_post_request(self, rf):
+        bags = FullBagFactory.create_batch(3)
+        body = '%s\n\n%s\nark:/00001/unknown\n' % (bags[0].name, bags[1].name)
+        request = rf.post('/', body, 'text/plain')
+        response = views.app_bag_delete(request)
+
+        report = json.loads(response.content)
+        assert response.status_code == 200
+        assert response['Content-Type'] == 'application/json'
+        assert report['deleted'] == 2
+        assert report['rows']['coda_mdstore.Bag'] == 2
+        assert report['not_found'] == ['ark:/00001/unknown']
+        assert list(models.Bag.objects.values_list('name', flat=True)) == [bags[2].name]
+
+    def test_get_request_not_allowed(self, rf):
+        response = views.app_bag_delete(rf.get('/'))
+
+        assert response.status_code == 405
+        assert response['Allow'] == 'POST'
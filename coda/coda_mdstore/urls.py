@@ -6,6 +6,8 @@ from .resourcesync import changelist, capabilitylist, sitemaps
 urlpatterns = [
     re_path(r'^bag/$', views.all_bags, name='bag-list'),
     re_path(r'^APP/bag/$', views.app_bag, name='app-bag-list'),
+    re_path(r'^APP/bag/batch/$', views.app_bag_batch, name='app-bag-batch'),
+    re_path(r'^APP/bag/delete/$', views.app_bag_delete, name='app-bag-delete'),
     re_path(r'^APP/bag/(?P<identifier>.+?)/$', views.app_bag, name='app-bag-detail'),
     re_path(
         r'^bag/(?P<identifier>ark:\/\d+\/.+?)/links/$', views.bagURLLinks,
@@ -15,6 +17,18 @@ urlpatterns = [
         r'^bag/(?P<identifier>ark:\/\d+\/.+).zip$', views.bagDownload,
         name='bag-download'
     ),
+    re_path(
+        r'^bag/(?P<identifier>ark:\/\d+\/.+)\.tar$', views.bagTarDownload,
+        name='bag-tar-download'
+    ),
+    re_path(
+        r'^bag/(?P<identifier>ark:\/\d+\/.+?)/events/$', views.bagEvents,
+        name='bag-events'
+    ),
+    re_path(
+        r'^bag/(?P<identifier>ark:\/\d+\/.+?)/events\.json$', views.bagEvents,
+        {'as_json': True}, name='bag-events-json'
+    ),
     re_path(r'^bag/(?P<identifier>.+?)/$', views.bagHTML, name='bag-detail'),
     re_path(r'^bag/(?P<identifier>ark:\/\d+\/.+?).urls$', views.bagURLList, name='bag-urls'),
     re_path(
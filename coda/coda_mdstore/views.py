@@ -1,17 +1,17 @@
+import calendar
 import copy
-import uuid
 
-from urllib.request import urlopen
-from urllib.parse import urlencode
 import json
+from urllib.parse import urlencode
 from django.http import HttpResponse, Http404, HttpResponseBadRequest, \
-    HttpResponseNotFound, StreamingHttpResponse
+    HttpResponseNotFound, StreamingHttpResponse, FileResponse
 from django.shortcuts import get_object_or_404, render
-from wsgiref.util import FileWrapper
 from django.db import IntegrityError
-from django.db.models import Sum, Count, Max, Min
+from django.db.models import Sum, Count, Max, Min, Q
 from django.conf import settings
+from django.utils.cache import get_conditional_response
 from django.utils.feedgenerator import Atom1Feed
+from django.utils.http import parse_http_date_safe
 from django.contrib.syndication.views import Feed
 from django.core.paginator import Paginator, EmptyPage, InvalidPage
 from lxml import etree
@@ -22,7 +22,10 @@ from .models import Bag, Bag_Info, Node, External_Identifier
 from codalib import APP_AUTHOR, bagatom
 from .presentation import getFileHandle, bagSearch, \
     makeBagAtomFeed, createBag, updateBag, objectsToXML, updateNode, \
-    nodeEntry, createNode, zip_file_streamer, generateBagFiles, FileHandleError
+    nodeEntry, createNode, zip_file_streamer, generateBagFiles, FileHandleError, \
+    streamFileHandle, fileETag, ifRangeMatches, LocalFileHandle, mountedNodes, \
+    bagMembers, parseByteRange, iterBagURLs, joinLines, bagChecksums, \
+    recordKnownReplicas, ingestBagFeed, deleteBags
 from dateutil import rrule
 from datetime import datetime
 # for historical reasons that are not entirely clear, the tests for
@@ -34,7 +37,9 @@ from django.db import connection
 
 from django.urls import reverse
 
-from coda_mdstore import exceptions
+from coda_mdstore import exceptions, fixity, health, manifests, offload, replicas
+from coda_mdstore.storedzip import StoredZip
+from coda_mdstore.tarstream import TarStream
 
 MAINTENANCE_MSG = settings.MAINTENANCE_MSG
 XML_HEADER = b"<?xml version=\"1.0\"?>\n%s"
@@ -301,16 +306,15 @@ class AtomSiteNewsFeed(Feed):
         return '/bag/%s/' % display.name
 
     def get_object(self, request):
-        display = Bag.objects.order_by('-bagging_date')
+        display = Bag.objects.order_by('-bagging_date').prefetch_related('bag_info_set')
         return (display, request.GET.get('p'))
 
     def item_description(self, display):
         bag_model_values = []
 
-        info = Bag_Info.objects.filter(bag_name=display.name).values()
-        for i in info:
+        for i in display.bag_info_set.all():
             bag_model_values.append(
-                "%s: %s" % (i['field_name'], i['field_body'])
+                "%s: %s" % (i.field_name, i.field_body)
             )
         return bag_model_values
 
@@ -481,48 +485,12 @@ def bagHTML(request, identifier):
         bag_date = datetime.strptime(bag_info_d.get('Bagging-Date'), '%Y-%m-%d')
     except:
         bag_date = None
-    # grab the related premis events from the json search for
-    # linked object id
-    linked_events = []
-    total_events = None
-    try:
-        filters = {'linked_object_id': bag}
-        event_json_url = '%s://%s/event/search.json?%s' % (
-            request.scheme,
-            # TODO: Maybe this should be configurable?
-            request.META.get('HTTP_HOST'),
-            urlencode(filters)
-        )
-        json_response = urlopen(event_json_url)
-        json_events = json.load(json_response)
-        if json_events:
-            total_events = json_events.get('feed', {})
-            total_events = total_events.get('opensearch:totalResults', 0)
-        # Follow next url in results until we hit the last page
-        while json_events:
-            this_page = json_events.get('feed', {})
-            this_page = this_page.get('entry', [])
-            linked_events += this_page
-            next_url = json_events.get('feed', {})
-            next_url = next_url.get('link', [])
-            next_url = {link.get('rel'): link.get('href') for link in next_url}
-            next_url = next_url.get('next')
-            if next_url:
-                try:
-                    json_response = urlopen(next_url)
-                    json_events = json.load(json_response)
-                except:
-                    json_events = None
-            else:
-                json_events = None
-    except:
-        pass
+    # the premis events linked to the bag are loaded into the page by
+    # bagEvents, so a bag with a long history renders as quickly as any.
     return render(
         request,
         'mdstore/bag_info.html',
         {
-            'linked_events': linked_events,
-            'total_events': total_events,
             'payload_oxum_file_count': oxum_file_count,
             'payload_oxum_size': oxum_bytes,
             'bag_date': bag_date,
@@ -533,9 +501,102 @@ def bagHTML(request, identifier):
     )
 
 
+def bagEventPage(identifier, before=None, count=None):
+    """
+    Return a page of the premis events linked to a bag, latest first, and
+    whether there are more. The page starts after the (date, identifier)
+    of the last event on the page before, so it costs the same however
+    far into the bag's history it is.
+    """
+
+    if count is None:
+        count = settings.CODA_BAG_EVENT_COUNT
+    events = Event.objects.filter(linking_objects__object_identifier=identifier)
+    if before is not None:
+        date, event_id = before
+        earlier = Q(event_date_time__lt=date)
+        same_date = Q(event_date_time=date, event_identifier__lt=event_id)
+        events = events.filter(earlier | same_date)
+    page = list(
+        events.order_by('-event_date_time', '-event_identifier').prefetch_related(
+            'linking_objects'
+        )[:count + 1]
+    )
+    return page[:count], len(page) > count
+
+
+def bagEvents(request, identifier, as_json=False):
+    """
+    Return a page of the premis events linked to a bag, as an html fragment
+    for the bag's page or as json. The first page also has the number of
+    events in all. Later pages are asked for with the before and before_id
+    parameters of the next link.
+    """
+
+    bag = get_object_or_404(Bag, name__exact=identifier)
+    before = None
+    if request.GET.get('before'):
+        try:
+            before = (
+                datetime.fromisoformat(request.GET['before']),
+                request.GET['before_id'],
+            )
+        except (KeyError, ValueError):
+            return HttpResponseBadRequest(
+                "before must be an ISO 8601 date, along with before_id.\n",
+                content_type='text/plain'
+            )
+    events, more = bagEventPage(bag.name, before)
+    total_events = None
+    if before is None:
+        total_events = Event.objects.filter(
+            linking_objects__object_identifier=bag.name
+        ).count()
+    next_url = None
+    if more:
+        next_url = '%s?%s' % (request.path, urlencode({
+            'before': events[-1].event_date_time.isoformat(),
+            'before_id': events[-1].event_identifier,
+        }))
+    if as_json:
+        jsonDict = {
+            'events': [
+                {
+                    'identifier': event.event_identifier,
+                    'date': event.event_date_time.isoformat(),
+                    'outcome': event.event_outcome,
+                    'event_type': event.event_type,
+                    'linked_objects': [
+                        obj.object_identifier for obj in event.linking_objects.all()
+                    ],
+                }
+                for event in events
+            ],
+            'next': next_url and request.build_absolute_uri(next_url),
+        }
+        if total_events is not None:
+            jsonDict['total'] = total_events
+        response = HttpResponse(content_type='application/json')
+        json.dump(jsonDict, fp=response, indent=4, sort_keys=True)
+        return response
+    return render(
+        request,
+        'mdstore/bag_events.html',
+        {
+            'bag': bag,
+            'linked_events': events,
+            'total_events': total_events,
+            'next_url': next_url,
+        }
+    )
+
+
 def bagURLList(request, identifier):
     """
-    Return a list of URLS in the bag
+    Return a list of URLS in the bag, last file first
+
+    The list is streamed out as it is read, from the Bag_File index when
+    the bag has been indexed.
     """
 
     # assign the proxy url
@@ -543,14 +604,11 @@ def bagURLList(request, identifier):
     # attempt to grab a bag,
     get_object_or_404(Bag, name__exact=identifier)
     try:
-        transList = generateBagFiles(identifier, proxyRoot, settings.CODA_PROXY_MODE)
+        urls = iterBagURLs(identifier, proxyRoot, settings.CODA_PROXY_MODE, reverse=True)
     except FileHandleError:
         raise Http404
 
-    outputText = "\n".join(reversed(transList))
-    resp = HttpResponse(outputText, content_type="text/plain")
-    resp.status_code = 200
-    return resp
+    return StreamingHttpResponse(joinLines(urls), content_type="text/plain")
 
 
 def bagURLLinks(request, identifier):
@@ -569,48 +627,194 @@ def bagURLLinks(request, identifier):
                   {'links': sorted(transList)})
 
 
+def archiveResponse(request, archive, content_type):
+    """
+    Build the response for an archive whose length is known up front,
+    answering conditional requests and Range requests for a single range
+    the archive can resume from
+    """
+    etag = archive.etag
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        not_modified['ETag'] = etag
+        return not_modified
+    byte_range = None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if request.META.get('HTTP_RANGE') and (
+            not if_range or ifRangeMatches(if_range, etag, None)):
+        byte_range = parseByteRange(request.META['HTTP_RANGE'], len(archive))
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */%d' % len(archive)
+        return response
+    if byte_range and not archive.canResume(*byte_range):
+        # the range needs CRC-32s of files before it that haven't been
+        # worked out, which would mean fetching them all before sending a
+        # byte of it; the whole archive can start at once.
+        byte_range = None
+    if byte_range:
+        first, last = byte_range
+        response = StreamingHttpResponse(
+            archive.stream(first, last), content_type=content_type, status=206)
+        response['Content-Range'] = 'bytes %d-%d/%d' % (first, last, len(archive))
+        response['Content-Length'] = last - first + 1
+    else:
+        response = StreamingHttpResponse(archive.stream(), content_type=content_type)
+        response['Content-Length'] = len(archive)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    return response
+
+
 def bagDownload(request, identifier):
     """
         Return a downloadable bag zipped file.
+
+        When the sizes of the bag's files are known, from the Bag_File
+        index, the file list or a node mounted here, the zip is a stored one
+        laid out up front, so it has a Content-Length and an interrupted
+        download can be resumed with a Range request. The CRC-32s of the
+        files sent whole are stored in the Bag_File index for that. The
+        nodes aren't asked for sizes, a request per file, before the first
+        byte goes out; the zip is streamed without a length instead.
     """
     # assign the proxy url
     proxyRoot = request.build_absolute_uri('/')
     # attempt to grab a bag,
-    get_object_or_404(Bag, name__exact=identifier)
+    bag = get_object_or_404(Bag, name__exact=identifier)
+    meta_id = identifier.split('/')[-1]
+    zip_filename = meta_id + '.zip'
+    members = check = None
     try:
-        transList = generateBagFiles(identifier, proxyRoot, settings.CODA_PROXY_MODE)
+        # let the front-end server zip the bag when it can.
+        response = offload.get_backend().serve_bag(identifier, meta_id)
+        if response is None:
+            members = bagMembers(identifier, meta_id)
+            if members is None:
+                transList = generateBagFiles(identifier, proxyRoot, settings.CODA_PROXY_MODE)
+            elif fixity.enabled():
+                check = fixity.FixityCheck(identifier, bagChecksums(identifier))
     except FileHandleError:
         raise Http404
-    meta_id = identifier.split('/')[-1]
-    zip_filename = meta_id + '.zip'
-    response = StreamingHttpResponse(zip_file_streamer(transList, meta_id),
-                                     content_type='application/zip')
+    if members is not None:
+        archive = StoredZip(
+            members, calendar.timegm(bag.bagging_date.timetuple()), mountedNodes(), check,
+            manifests.MemberCRCs(identifier, meta_id + '/'),
+        )
+        response = archiveResponse(request, archive, 'application/zip')
+    elif response is None:
+        response = StreamingHttpResponse(
+            zip_file_streamer(transList, meta_id, mountedNodes()),
+            content_type='application/zip')
     response['Content-Disposition'] = 'attachment; filename=%s' % zip_filename
     return response
 
 
+def bagTarDownload(request, identifier):
+    """
+    Return a downloadable tar of the bag. Unlike the zip, the length of
+    the tar is known up front, so the sizes of files that aren't known
+    yet are asked of the node first.
+    """
+    bag = get_object_or_404(Bag, name__exact=identifier)
+    meta_id = identifier.split('/')[-1]
+    check = None
+    try:
+        members = bagMembers(identifier, meta_id, probe=True)
+        if members is not None and fixity.enabled():
+            check = fixity.FixityCheck(identifier, bagChecksums(identifier))
+    except FileHandleError:
+        raise Http404
+    if members is None:
+        raise Http404
+    stream = TarStream(
+        members, calendar.timegm(bag.bagging_date.timetuple()), mountedNodes(), check
+    )
+    response = StreamingHttpResponse(stream, content_type='application/x-tar')
+    response['Content-Length'] = len(stream)
+    response['Content-Disposition'] = 'attachment; filename=%s.tar' % meta_id
+    return response
+
+
 def bagProxy(request, identifier, filePath):
     """
     Attempt to proxy a file from within the given bag
+
+    Range requests are passed along to the node holding the file, and
+    conditional requests are answered against the file's ETag and
+    modification date without transferring it. When an offload backend is
+    configured, the front-end server is left to send the file itself.
     """
 
     get_object_or_404(Bag, name__exact=identifier)
-    handle = getFileHandle(identifier, filePath)
-    if handle:
-        resp = HttpResponse(
-            content_type=handle.info().get('Content-Type')
-        )
-        resp['Content-Length'] = handle.info().get('Content-Length')
-        if getattr(settings, 'REPROXY', False):
-            # Have a proxy server point the client to where to download
-            # the file directly in order to bypass serving through Django.
-            resp['X-REPROXY-URL'] = handle.geturl()
-            resp['ETag'] = '"%s"' % uuid.uuid4().hex
-        else:
-            # Serve the data file through Django.
-            resp.content = FileWrapper(handle)
-    else:
+    headers = None
+    if request.META.get('HTTP_RANGE'):
+        headers = {'Range': request.META['HTTP_RANGE']}
+    handle = getFileHandle(identifier, filePath, headers=headers)
+    if not handle:
         raise Http404
+    # the md5 from the bag's manifest makes the best ETag, when it is known.
+    checksum = manifests.checksum(identifier, filePath)
+    etag = fileETag(handle, checksum)
+    last_modified = handle.info().get('Last-Modified')
+    last_modified_ts = parse_http_date_safe(last_modified) if last_modified else None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if headers and if_range and not ifRangeMatches(if_range, etag, last_modified_ts):
+        # The client's copy is stale, so it gets the whole file instead.
+        handle.close()
+        handle = getFileHandle(identifier, filePath)
+        if not handle:
+            raise Http404
+    not_modified = get_conditional_response(
+        request, etag=etag, last_modified=last_modified_ts
+    )
+    if not_modified is not None:
+        handle.close()
+        if etag:
+            not_modified['ETag'] = etag
+        if last_modified:
+            not_modified['Last-Modified'] = last_modified
+        return not_modified
+    content_type = handle.info().get('Content-Type')
+    content_length = handle.info().get('Content-Length')
+    if handle.status == 416:
+        resp = HttpResponse(status=416)
+        resp['Content-Range'] = handle.info().get('Content-Range') or 'bytes */*'
+        handle.close()
+        return resp
+    resp = offload.get_backend().serve(handle, content_type)
+    if resp is not None:
+        # The front-end server sends the file, and answers any Range
+        # request itself, so only the length of the whole file is useful.
+        handle.close()
+        if handle.status != 200:
+            content_length = None
+    else:
+        if checksum and handle.status == 200 and fixity.enabled():
+            # Check the file against the manifest as it goes.
+            check = fixity.FixityCheck(identifier, {handle.geturl(): checksum})
+            resp = StreamingHttpResponse(
+                check.stream(handle.geturl(), streamFileHandle(handle)),
+                content_type=content_type,
+            )
+        elif isinstance(handle, LocalFileHandle) and handle.status == 200:
+            # The file is on a node mounted here, so hand the open file to
+            # the server, which can send it with sendfile where it supports it.
+            resp = FileResponse(handle.file, content_type=content_type)
+        else:
+            # Stream the data file through Django a buffer at a time.
+            resp = StreamingHttpResponse(
+                streamFileHandle(handle), content_type=content_type, status=handle.status
+            )
+            if handle.info().get('Content-Range'):
+                resp['Content-Range'] = handle.info().get('Content-Range')
+        resp['Accept-Ranges'] = 'bytes'
+    if etag:
+        resp['ETag'] = etag
+    if last_modified:
+        resp['Last-Modified'] = last_modified
+    if content_length:
+        resp['Content-Length'] = content_length
     return resp
 
 
@@ -744,11 +948,15 @@ def showNodeStatus(request, identifier=None):
                 'node': node,
                 'filled': percent(node.node_size, node.node_capacity),
                 'available': node.node_capacity - node.node_size,
+                'health': health.get(node),
+                'bags': replicas.counts([node]).get(node.pk, 0),
                 'maintenance_message': MAINTENANCE_MSG,
             }
         )
     else:
         nodes = Node.objects.order_by('node_name')
+        healths = health.get_many(nodes)
+        bag_counts = replicas.counts()
         status_list = []
         total_capacity = 0
         total_size = 0
@@ -757,6 +965,8 @@ def showNodeStatus(request, identifier=None):
         for node in nodes:
             node_status = {}
             node_status["node"] = node
+            node_status["health"] = healths[node.node_name]
+            node_status["bags"] = bag_counts.get(node.pk, 0)
             if node.node_capacity:
                 node_status["filled"] = percent(
                     node.node_size, node.node_capacity
@@ -779,6 +989,8 @@ def showNodeStatus(request, identifier=None):
                 'total_size': total_size,
                 'total_available': total_available,
                 'total_filled': total_filled,
+                'under_replicated': replicas.under_replicated_count(),
+                'replica_count': settings.CODA_REPLICA_COUNT,
                 'maintenance_message': MAINTENANCE_MSG,
             }
         )
@@ -811,7 +1023,9 @@ def app_bag(request, identifier=None):
         entry_text = XML_HEADER % etree.tostring(entries, pretty_print=True)
         return HttpResponse(entry_text, content_type="application/atom+xml")
     elif request.method == 'GET':
-        bags = Paginator(Bag.objects.order_by('-bagging_date'), 20)
+        bags = Paginator(
+            Bag.objects.order_by('-bagging_date').prefetch_related('bag_info_set'), 20
+        )
         if len(request.GET):
             page = request.GET.get('page')
         else:
@@ -841,6 +1055,7 @@ def app_bag(request, identifier=None):
         # attempt to parse POST'd XML
         xml = request.body
         bagObject, bagInfos = createBag(xml)
+        recordKnownReplicas(bagObject.name)
         loc = '%s://%s/APP/bag/%s/' % (
             request.scheme, request.META['HTTP_HOST'], bagObject.name
         )
@@ -876,25 +1091,19 @@ def app_bag(request, identifier=None):
         entryText = XML_HEADER % etree.tostring(returnEntry, pretty_print=True)
         resp = HttpResponse(entryText, content_type="application/atom+xml")
         resp.status_code = 200
+        if hasattr(bagObject, 'changes'):
+            # how many rows the update touched, for the client's logs.
+            resp['X-Rows-Changed'] = 'inserted=%(inserted)d, updated=%(updated)d, ' \
+                'deleted=%(deleted)d' % bagObject.changes
         return resp
     elif request.method == 'DELETE' and identifier:
-        try:
-            bag = Bag.objects.get(name=identifier)
-        except Bag.DoesNotExist:
+        # a bag deleted on its own keeps its validation history
+        deleted, rows = deleteBags([identifier], keepValidations=True)
+        if not deleted:
             return HttpResponse(
                 "There is no bag with id '{0}'.\n".format(identifier),
                 content_type="text/plain", status=404
             )
-        try:
-            bag_ext_ids = External_Identifier.objects.select_related('belong_to_bag')
-        except:
-            return HttpResponse(
-                "Could not retrieve external ids for this bag.\n",
-                content_type="text/plain", status=500
-            )
-        for ext_id in bag_ext_ids:
-            ext_id.delete()
-        bag.delete()
         resp = HttpResponse("Deleted %s.\n" % identifier)
         resp.status_code = 200
         return resp
@@ -911,6 +1120,58 @@ def app_bag(request, identifier=None):
         return resp
 
 
+def app_bag_batch(request):
+    """
+    Create or update the bags in an Atom feed POSTed to it, a batch at a
+    time, and report in JSON how many were created, updated and failed,
+    and which entries failed and why. Use this rather than a POST to
+    app_bag for each bag when loading many of them; their replicas are
+    left to be found by the crawl_replicas command.
+    """
+
+    if request.method != 'POST':
+        resp = HttpResponse(
+            "Invalid method.\n",
+            status=405, content_type="text/plain"
+        )
+        resp['Allow'] = 'POST'
+        return resp
+    report = ingestBagFeed(request)
+    return HttpResponse(
+        json.dumps(report, indent=4),
+        status=400 if 'error' in report else 200,
+        content_type='application/json'
+    )
+
+
+def app_bag_delete(request):
+    """
+    Delete the bags named in the body of a POST to it, one to a line,
+    along with their metadata and validation records, and report in JSON
+    how many rows went from each table and which bags weren't found.
+    """
+
+    if request.method != 'POST':
+        resp = HttpResponse(
+            "Invalid method.\n",
+            status=405, content_type="text/plain"
+        )
+        resp['Allow'] = 'POST'
+        return resp
+    names = [
+        line.strip() for line in request.body.decode('utf-8').splitlines() if line.strip()
+    ]
+    deleted, rows = deleteBags(names)
+    report = {
+        'deleted': len(deleted),
+        'rows': rows,
+        'not_found': sorted(set(names) - set(deleted)),
+    }
+    return HttpResponse(
+        json.dumps(report, indent=4, sort_keys=True), content_type='application/json'
+    )
+
+
 def app_node(request, identifier=None):
     """
     Return an ATOM feed of all of the nodes
@@ -16,6 +16,7 @@ from lxml import etree
 
 from django.views.generic import ListView
 
+from coda_mdstore import codaxml
 from .models import Validate
 
 
@@ -338,26 +339,20 @@ def xmlToValidateObject(validateXML):
     if entryRoot is None:
         raise ValueError("Unable to parse uploaded XML")
     # parse XML
-    contentElement = entryRoot.xpath("*[local-name() = 'content']")[0]
-    validateXML = contentElement.xpath("*[local-name() = 'validate']")[0]
-    identifier = validateXML.xpath(
-        "*[local-name() = 'identifier']")[0].text.strip()
+    fields = codaxml.children(codaxml.content(entryRoot, 'validate'))
+    identifier = codaxml.text(fields, 'identifier')
 
-    last_verified = validateXML.xpath(
-        "*[local-name() = 'last_verified']")[0].text.strip()
+    last_verified = codaxml.text(fields, 'last_verified')
     last_verified = parser.parse(last_verified)
 
-    last_verified_status = validateXML.xpath(
-        "*[local-name() = 'last_verified_status']")[0].text.strip()
+    last_verified_status = codaxml.text(fields, 'last_verified_status')
 
-    priority_change_date = validateXML.xpath(
-        "*[local-name() = 'priority_change_date']")[0].text.strip()
+    priority_change_date = codaxml.text(fields, 'priority_change_date')
     priority_change_date = parser.parse(priority_change_date)
 
-    priority = validateXML.xpath(
-        "*[local-name() = 'priority']")[0].text.strip()
+    priority = codaxml.text(fields, 'priority')
 
-    server = validateXML.xpath("*[local-name() = 'server']")[0].text.strip()
+    server = codaxml.text(fields, 'server')
 
     # make the object and return
     validate = Validate(
@@ -381,12 +376,9 @@ def xmlToUpdateValidateObject(validateXML):
     if entryRoot is None:
         raise ValueError("Unable to parse uploaded XML")
     # parse XML
-    contentElement = entryRoot.xpath("*[local-name() = 'content']")[0]
-    validateXML = contentElement.xpath("*[local-name() = 'validate']")[0]
-    identifier = validateXML.xpath(
-        "*[local-name() = 'identifier']")[0].text.strip()
-    last_verified_status = validateXML.xpath(
-        "*[local-name() = 'last_verified_status']")[0].text.strip()
+    fields = codaxml.children(codaxml.content(entryRoot, 'validate'))
+    identifier = codaxml.text(fields, 'identifier')
+    last_verified_status = codaxml.text(fields, 'last_verified_status')
     # get the object (or 404) and return to the APP view to finish up.
     validate = get_object_or_404(Validate, identifier=identifier)
     validate.last_verified_status = last_verified_status
@@ -1,5 +1,6 @@
 import os
 import json
+import tempfile
 from datetime import timedelta
 from django.core.exceptions import ImproperlyConfigured
 
@@ -83,6 +84,109 @@ DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
 # setting to false sends requests directly to the archival servers.
 CODA_PROXY_MODE = False
 
+# Seconds to wait on a single storage node before giving up on it, and the
+# number of nodes that may be probed at once when looking for a bag's files.
+CODA_NODE_TIMEOUT = 10
+CODA_NODE_CONNECT_TIMEOUT = 5
+CODA_NODE_PROBE_WORKERS = 8
+
+# The most keep-alive connections held open to each storage node.
+CODA_NODE_POOL_SIZE = 10
+
+# A node's circuit opens after this many failed requests in a row, leaving it
+# out of probes for CODA_NODE_CIRCUIT_RESET seconds before it is tried again.
+# Node health is shared through this cache, so it must name one every process
+# can see: the FileBasedCache in CACHES below serves the processes on one
+# server, and several servers need a Memcached or Redis cache instead. See
+# coda_mdstore/health.py.
+CODA_NODE_FAILURE_THRESHOLD = 5
+CODA_NODE_CIRCUIT_RESET = 60
+CODA_NODE_HEALTH_CACHE = 'node_health'
+
+# Size in bytes and number of the reusable buffers that bag files are
+# streamed through when they are served by Django.
+CODA_STREAM_BUFFER_SIZE = 64 * 1024
+CODA_STREAM_BUFFER_COUNT = 32
+
+# Whole-bag downloads read each file in chunks that start at
+# CODA_STREAM_BUFFER_SIZE and double up to this many bytes, through this many
+# reusable buffers.
+CODA_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+CODA_DOWNLOAD_BUFFER_COUNT = 16
+
+# How many bag locations each process keeps in memory in front of the
+# Bag_Location table.
+CODA_LOCATION_CACHE_SIZE = 10000
+
+# How many files of a bag zip download are fetched ahead of the one being
+# zipped, and the most bytes that may wait in memory for it. Set
+# CODA_ZIP_PREFETCH_FILES to 0 to fetch the files one at a time.
+CODA_ZIP_PREFETCH_FILES = 8
+CODA_ZIP_PREFETCH_BYTES = 16 * 1024 * 1024
+
+# Keep the paths, checksums and sizes of each bag's files in the Bag_File
+# table once its manifest has been read, so they are listed without asking a
+# node. See coda_mdstore/manifests.py and the index_bag_files command.
+CODA_INDEX_BAG_FILES = True
+
+# With CODA_INDEX_BAG_FILES off, the file lists read from the nodes are kept
+# on disk in this cache (see CACHES below), with the most recently used ones
+# in each process' memory as well. A list is used as is for
+# CODA_FILE_LIST_TTL seconds, then checked with the node through a
+# conditional request. See coda_mdstore/filelists.py.
+CODA_FILE_LIST_CACHE = 'filelists'
+CODA_FILE_LIST_TTL = 5 * 60
+CODA_FILE_LIST_CACHE_SIZE = 1000
+
+# Hash bag files as they are downloaded, through bagProxy or a whole-bag zip
+# or tar, and compare them with the bag's manifest. A mismatch marks the
+# bag's validation Failed; passing a bag is left to the validator. See
+# coda_mdstore/fixity.py.
+CODA_VERIFY_DOWNLOADS = False
+
+# How many copies of each bag should be on active nodes. Bags with fewer
+# are counted on the node status page and listed by the replica_report
+# management command. See coda_mdstore/replicas.py.
+CODA_REPLICA_COUNT = 2
+
+# How long, in seconds, the number of bags with fewer than
+# CODA_REPLICA_COUNT copies shown on the node status page is kept before it
+# is counted again. replica_report stores the number it finds too, though
+# that only reaches the web processes when the default cache is shared
+# with them.
+CODA_REPLICA_REPORT_TTL = 60 * 60
+
+# How many of a bag's premis events, latest first, are loaded into its page
+# at a time.
+CODA_BAG_EVENT_COUNT = 20
+
+# How many bags a feed POSTed to /APP/bag/batch/ is saved in at a time, and
+# how many are deleted at a time by /APP/bag/delete/ and the delete_bags
+# management command.
+CODA_INGEST_BATCH_SIZE = 500
+CODA_DELETE_BATCH_SIZE = 500
+
+# Optional directory the on-disk caches are kept in.
+try:
+    CACHE_ROOT = get_secret('CACHE_ROOT')
+except ImproperlyConfigured:
+    CACHE_ROOT = os.path.join(tempfile.gettempdir(), 'coda')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'filelists': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(CACHE_ROOT, 'filelists'),
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+    'node_health': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(CACHE_ROOT, 'node_health'),
+    },
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.mysql',
@@ -134,6 +238,17 @@ try:
 except ImproperlyConfigured:
     REPROXY = False
 
+# Optional backend that has the front-end web server send bag files instead of
+# streaming them through Django: 'accel' (nginx X-Accel-Redirect, with mod_zip
+# for whole-bag downloads), 'sendfile' (Apache/lighttpd X-Sendfile, for nodes
+# mounted on this server), 'reproxy' (the same as REPROXY = True), or the
+# dotted path of a backend class. See coda_mdstore/offload.py.
+CODA_OFFLOAD = None
+
+# The internal nginx location each node is proxied under for the 'accel'
+# backend, followed by the node's name.
+CODA_ACCEL_PREFIX = '/_node/'
+
 if DEBUG:
     DEBUG_TOOLBAR_CONFIG = {
         'SHOW_TOOLBAR_CALLBACK': lambda request: True
@@ -13,4 +13,25 @@ $(document).ready(function() {
 $(window).resize(function(){
     $('.dashboard-row .dashboard-box').css('height','auto');
     $('.dashboard-row .dashboard-box').equalHeight();
-});
\ No newline at end of file
+});
+
+// Load the premis events of a bag into its page, a page of them at a time.
+$(document).ready(function() {
+    var panel = $('#bag-events');
+    if (!panel.length) {
+        return;
+    }
+    $.get(panel.data('url'), function(html) {
+        panel.html(html);
+    });
+    panel.on('click', '.bag-events-more', function(e) {
+        var more = $(this);
+        e.preventDefault();
+        more.addClass('disabled');
+        $.get(more.attr('href'), function(html) {
+            var page = $('<div>').html(html);
+            panel.find('tbody').append(page.find('tbody tr'));
+            more.replaceWith(page.find('.bag-events-more'));
+        });
+    });
+});